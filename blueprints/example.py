@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 import os
 import mysql.connector
-from flask import Flask, Blueprint, render_template, request, jsonify, url_for, redirect, send_file
+from flask import Flask, Blueprint, render_template, request, jsonify, url_for, redirect, send_file, Response
 import plotly
 import plotly.express as px
 import plotly.graph_objects as go
@@ -19,20 +19,23 @@ from datetime import datetime, timedelta
 import time
 from glob import glob
 import shutil
-from imageio import imread
+import threading
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from core import db_pool
+from core.query_cache import DayChunkCache, day_range
+from core.cadence import cadence_filter_indices, bucket_filter_indices
+from core.bundle_archive import build_tar, stream_tar, available_formats, format_suffixes
+from core.job_queue import JobQueue, JobQueueFull
+from core.bundle_store import BundleStore, bundle_key, archive_name_for
+from core.download_quota import DownloadQuota
+from core.dir_cache import DirCache
+from core.html_movie import HtmlMovieTemplate, write_html_movie
+from core.http_cache import conditional_cache
+from core.video_movie import render_video, video_key, video_filename, video_formats, existing_video
 
 logger = logging.getLogger(__name__)
 
-def safe_getsize(f):
-    try:
-        if os.path.exists(f):
-            return os.path.getsize(f)
-    except Exception:
-        return 0
-    return 0
-
 from functools import wraps
 
 def format_duration(seconds):
@@ -71,11 +74,21 @@ example = Blueprint('example', __name__, template_folder='templates')
 lwadata_dir = '/common/webplots/lwa-data'
 data_subdir = 'tmp/data-request'
 movie_subdir = 'tmp/html'
+## gzip level of data bundles: 6 is ~2x faster than the tarfile default 9 at nearly the same size
+bundle_compresslevel = int(os.getenv('LWA_BUNDLE_COMPRESSLEVEL', 6))
+bundle_zstd_level = int(os.getenv('LWA_BUNDLE_ZSTD_LEVEL', 3))
+## Default archive format (gz, or zst if zstandard is installed) and compression threads (0: all cores)
+bundle_format = os.getenv('LWA_BUNDLE_FORMAT', 'gz')
+bundle_threads = int(os.getenv('LWA_BUNDLE_THREADS', 0)) or None
 
 ##=========================
 max_IP_downloads_per_day = 20
 max_MB_downloads_per_IP = 1000.
+## Former JSON download log, imported once into the SQLite quota store
 lwa_user_downloads_log_path = "/home/xychen/lwadata-query-web-utils/lwa_user_downloads_log.json"
+lwa_user_downloads_db_path = os.getenv('LWA_DOWNLOAD_QUOTA_DB', "/home/xychen/lwadata-query-web-utils/lwa_user_downloads.sqlite")
+## Bumped by utils/lwadata2sql.py whenever metadata rows change
+lwa_metadata_version_path = os.getenv('LWA_METADATA_VERSION_PATH', "/home/xychen/lwadata-query-web-utils/lwa_metadata_version.json")
 
 ##=========================
 def create_lwa_query_db_connection():
@@ -86,9 +99,120 @@ def create_lwa_query_db_connection():
         password=os.getenv('FLARE_DB_PASSWORD')
     )
 
+def lwa_query_db_connection():
+    """Borrow a pooled connection: `with lwa_query_db_connection() as connection:`"""
+    return db_pool.get_pool(create_lwa_query_db_connection).connection()
+
 ##=========================
+query_cache = DayChunkCache(
+    max_bytes=int(float(os.getenv('LWA_QUERY_CACHE_MB', 256)) * 1024 * 1024),
+    recent_ttl=float(os.getenv('LWA_QUERY_CACHE_RECENT_TTL', 300)),
+    version_path=lwa_metadata_version_path,
+)
+
+## HTTP caching of the query responses: ETags from the parameters and the
+## metadata version (304 without touching the database), and a long max-age
+## for ranges the ingest no longer touches
+query_cache_params = ('start', 'end', 'cadence', 'image_type', 'cadence_mode')
+http_past_max_age = int(os.getenv('LWA_HTTP_PAST_MAX_AGE', 86400))
+http_quicklook_max_age = int(os.getenv('LWA_HTTP_QUICKLOOK_MAX_AGE', 3600))
+http_cache_stats = {}
+
+def load_image_rows_by_day(table, first_day, last_day):
+    """Fetch (file_path, obs_time, file_size, file_mtime_ns) rows of [first_day, last_day + 1 day), grouped by day."""
+    query_img = """
+        SELECT file_path, obs_time, file_size, file_mtime_ns FROM {table}
+        WHERE obs_time >= %s AND obs_time < %s
+        ORDER BY obs_time
+    """
+    with lwa_query_db_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(query_img.format(table=table), (first_day, last_day + timedelta(days=1)))
+        rows = cursor.fetchall()
+        cursor.close()
+    by_day = {}
+    for row in rows:
+        t = row[1]
+        by_day.setdefault(datetime(t.year, t.month, t.day), []).append(row)
+    return by_day
+
+def load_spec_rows_by_day(table, first_day, last_day):
+    """Fetch (file_path, start_time, end_time, file_size, file_mtime_ns) rows overlapping each day of [first_day, last_day]."""
+    query_spec = """
+        SELECT file_path, start_time, end_time, file_size, file_mtime_ns FROM {table}
+        WHERE start_time < %s AND end_time >= %s
+        ORDER BY start_time
+    """
+    with lwa_query_db_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(query_spec.format(table=table), (last_day + timedelta(days=1), first_day))
+        rows = cursor.fetchall()
+        cursor.close()
+    by_day = {}
+    for row in rows:
+        st, ed = row[1], row[2]
+        day = max(first_day, datetime(st.year, st.month, st.day))
+        while day <= last_day and day <= ed:
+            by_day.setdefault(day, []).append(row)
+            day += timedelta(days=1)
+    return by_day
+
+def load_image_rows_bucketed(table, start, end, cadence_sec):
+    """
+    Fetch only the first (file_path, obs_time, file_size, file_mtime_ns) row of every cadence bucket in [start, end].
+    Buckets are (seconds since 1970-01-01) DIV cadence_sec, see core.cadence.bucket_filter_indices.
+    """
+    query_bucket = """
+        SELECT t.file_path, t.obs_time, t.file_size, t.file_mtime_ns FROM {table} t
+        JOIN (
+            SELECT MIN(obs_time) AS first_time FROM {table}
+            WHERE obs_time BETWEEN %s AND %s
+            GROUP BY TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', obs_time) DIV %s
+        ) b ON t.obs_time = b.first_time
+        WHERE t.obs_time BETWEEN %s AND %s
+        ORDER BY t.obs_time
+    """
+    with lwa_query_db_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(query_bucket.format(table=table), (start, end, int(cadence_sec), start, end))
+        rows = cursor.fetchall()
+        cursor.close()
+    # Two files sharing the first obs_time of a bucket: keep one, like the greedy filter
+    return [row for i, row in enumerate(rows) if i == 0 or row[1] != rows[i - 1][1]]
+
+def slice_image_chunks(chunks, days, start, end):
+    """Concatenate day chunks of image rows, trimming the first and last day to [start, end]."""
+    rows = []
+    for i, day in enumerate(days):
+        if 0 < i < len(days) - 1:
+            rows.extend(chunks[day])
+        else:
+            rows.extend(row for row in chunks[day] if start <= row[1] <= end)
+    return rows
+
+cadence_modes = ('greedy', 'bucket')
+
 @runtime_report
-def get_lwa_file_lists_from_mysql(start_utc, end_utc, image_type="mfs"):
+def get_lwa_file_lists_from_mysql(start_utc, end_utc, image_type="mfs", cadence_sec=None, cadence_mode="greedy",
+                                  file_types=None, with_stats=False):
+    """
+    File paths and observation times of spec and image files within [start_utc, end_utc].
+
+    Parameters:
+        file_types (list): optional subset of 'spec_fits', 'slow_lev1', 'slow_lev15' to fetch
+        cadence_sec (int): optional minimum spacing applied to the image lists
+        cadence_mode (str): "greedy" keeps the exact filter_files_by_cadence selection;
+            "bucket" keeps the first file per cadence-aligned bucket and lets MySQL
+            drop the rest, so coarse cadences over long ranges transfer few rows
+        with_stats (bool): also return the file sizes and mtimes recorded at ingest
+
+    Returns:
+        (file_lists, obs_times) keyed by 'spec_fits', 'slow_lev1', 'slow_lev15';
+        with_stats adds file_stats, {file_type: {file_path: (file_size, file_mtime_ns)}}
+        with None for rows ingested before the sizes were recorded
+    """
+    if cadence_mode not in cadence_modes:
+        raise ValueError(f"Unsupported cadence_mode: {cadence_mode}")
     start = Time(start_utc).datetime
     end = Time(end_utc).datetime
     # Choose table based on image_type
@@ -106,34 +230,54 @@ def get_lwa_file_lists_from_mysql(start_utc, end_utc, image_type="mfs"):
         }
     else:
         raise ValueError(f"Unsupported image_type: {image_type}")
-    # Connection
-    connection = create_lwa_query_db_connection()
-    cursor = connection.cursor()
-    query_spec = """
-        SELECT file_path, start_time, end_time FROM lwa_spec_fits_files
-        WHERE start_time <= %s AND end_time >= %s
-        ORDER BY start_time
-    """
-    query_img = """
-        SELECT file_path, obs_time FROM {table}
-        WHERE obs_time BETWEEN %s AND %s
-        ORDER BY obs_time
-    """
+    if file_types:
+        tables = {k: v for k, v in tables.items() if k in file_types}
+
+    # Rows are cached per UTC day and sliced to [start, end] here
+    days = day_range(start, end)
     file_lists = {}
     obs_times = {}
+    file_stats = {}
     for file_type, table in tables.items():
         if file_type == 'spec_fits':
-            cursor.execute(query_spec, (end, start))
-            rows = cursor.fetchall()
+            chunks = query_cache.fetch(table, days, load_spec_rows_by_day)
+            seen = set()
+            rows = []
+            for day in days:
+                for row in chunks[day]:
+                    if row[0] not in seen and row[1] <= end and row[2] >= start:
+                        seen.add(row[0])
+                        rows.append(row)
+            rows.sort(key=lambda row: row[1])
             file_lists[file_type] = [row[0] for row in rows]
             obs_times[file_type] = [(row[1], row[2]) for row in rows]
+            if with_stats:
+                file_stats[file_type] = {row[0]: (row[3], row[4]) for row in rows}
+        elif cadence_sec and cadence_mode == 'bucket':
+            # Served from memory when the days are cached, otherwise decimated in SQL
+            chunks = query_cache.cached_chunks(table, days)
+            if chunks is None:
+                rows = load_image_rows_bucketed(table, start, end, cadence_sec)
+            else:
+                rows = slice_image_chunks(chunks, days, start, end)
+                rows = [rows[i] for i in bucket_filter_indices([row[1] for row in rows], cadence_sec).tolist()]
+            file_lists[file_type] = [row[0] for row in rows]
+            obs_times[file_type] = [row[1] for row in rows]
+            if with_stats:
+                file_stats[file_type] = {row[0]: (row[2], row[3]) for row in rows}
         else:
-            cursor.execute(query_img.format(table=table), (start, end))
-            rows = cursor.fetchall()
+            chunks = query_cache.fetch(table, days, load_image_rows_by_day)
+            rows = slice_image_chunks(chunks, days, start, end)
             file_lists[file_type] = [row[0] for row in rows]
             obs_times[file_type] = [row[1] for row in rows]
-    cursor.close()
-    connection.close()
+            if with_stats:
+                file_stats[file_type] = {row[0]: (row[2], row[3]) for row in rows}
+            if cadence_sec:
+                obs_times[file_type], file_lists[file_type] = filter_files_by_cadence(
+                    obs_times[file_type], file_lists[file_type], cadence_sec
+                )
+    if with_stats:
+        return file_lists, obs_times, file_stats
     return file_lists, obs_times
 
 ##=========================
@@ -176,11 +320,15 @@ def convert_local_to_filename(files_path):
     return [os.path.basename(path) for path in files_path]
 
 ##=========================
+## Listings of the quicklook PNG day directories, revalidated by directory mtime
+png_listing_cache = DirCache(revalidate_every=float(os.getenv('LWA_STAT_CACHE_REVALIDATE', 30)), max_dirs=1024)
+
 @runtime_report
 def convert_slow_hdf_to_existing_png(hdf_list):
     """
     Convert each .hdf path (lev1 or lev15) to its corresponding .png path by timestamp match,
-    and return only those that actually exist on disk.
+    and return only those that actually exist on disk. Each day directory is listed
+    once (and cached), instead of one stat per frame.
 
     Parameters:
         hdf_list (list): List of full paths to .hdf files
@@ -188,7 +336,7 @@ def convert_slow_hdf_to_existing_png(hdf_list):
     Returns:
         List of existing .png file paths
     """
-    png_list = []
+    candidates = []
     for hdf_path in hdf_list:
         try:
             hdf_filename = os.path.basename(hdf_path)
@@ -204,13 +352,17 @@ def convert_slow_hdf_to_existing_png(hdf_list):
             prefix = "ovro-lwa-352.synop_mfs_10s"
             png_filename = f"{prefix}.{date_part}T{timestamp_part}Z.image_I.png"
             # png_filename = hdf_filename.replace('.lev1.5_', '.synop_').replace('.hdf', '.png')
-            png_path = f"{lwadata_dir}/qlook_images/slow/synop/{yyyy}/{mm}/{dd}/{png_filename}"
-            if os.path.exists(png_path):
-                png_list.append(png_path)
+            png_dir = f"{lwadata_dir}/qlook_images/slow/synop/{yyyy}/{mm}/{dd}"
+            candidates.append((png_dir, png_filename))
         except Exception as e:
             logger.warning("Error processing %s: %s", hdf_path, e)
             continue
-    return png_list
+
+    day_dirs = sorted({png_dir for png_dir, _ in candidates})
+    with ThreadPoolExecutor(max_workers=min(8, len(day_dirs) or 1)) as executor:
+        listings = dict(zip(day_dirs, executor.map(png_listing_cache.listdir, day_dirs)))
+    return [f"{png_dir}/{png_filename}" for png_dir, png_filename in candidates
+            if png_filename in listings[png_dir]]
 # png_files = convert_slow_hdf_to_existing_png(slow_hdf_files)
 
 ##=========================
@@ -258,40 +410,37 @@ def filter_files_by_cadence(times, files, cadence_sec):
     if not times or not files or len(times) != len(files):
         return times, files  # return original if mismatch
 
-    filtered_times = [times[0]]
-    filtered_files = [files[0]]
-    last_time = times[0]
-
-    for i in range(1, len(times)):
-        if (times[i] - last_time).total_seconds() >= cadence_sec:
-            filtered_times.append(times[i])
-            filtered_files.append(files[i])
-            last_time = times[i]
+    kept = cadence_filter_indices(times, cadence_sec)
+    if len(kept) == len(times):
+        return times, files
+    kept = kept.tolist()
+    filtered_times = [times[i] for i in kept]
+    filtered_files = [files[i] for i in kept]
 
     return filtered_times, filtered_files
 
 ##=========================
-@example.route("/api/flare/query", methods=['POST'])
+@example.route("/api/flare/query", methods=['GET', 'POST'])
+@conditional_cache(query_cache_params, version=lambda: query_cache.version, past_max_age=http_past_max_age,
+                   stats=http_cache_stats)
 def get_lwafilelist_from_database():
 
-    start = request.form['start']
-    end = request.form['end']
-    cadence = request.form.get('cadence', None)
-    image_type = request.form.get('image_type', 'mfs')
+    start = request.values['start']
+    end = request.values['end']
+    cadence = request.values.get('cadence', None)
+    image_type = request.values.get('image_type', 'mfs')
+    cadence_mode = request.values.get('cadence_mode', 'greedy')
     logger.info("Get lwa filelist image_type: %s", image_type)
 
     cadence_sec = int(cadence) if cadence else None
     logger.info("cadence_sec: %s", cadence_sec)
     if not start or not end:
         raise ValueError("Start and end times are required.")
+    if cadence_mode not in cadence_modes:
+        return jsonify({'error': f'Unsupported cadence_mode: {cadence_mode}'}), 400
 
-    file_lists, obs_times = get_lwa_file_lists_from_mysql(start, end, image_type=image_type)
-
-    if cadence_sec:
-        for key in ['slow_lev1', 'slow_lev15']:
-            obs_times[key], file_lists[key] = filter_files_by_cadence(
-                obs_times[key], file_lists[key], cadence_sec
-            )
+    file_lists, obs_times = get_lwa_file_lists_from_mysql(
+        start, end, image_type=image_type, cadence_sec=cadence_sec, cadence_mode=cadence_mode)
 
     logger.info("Query: Found %d spec_fits files", len(file_lists['spec_fits']))
     logger.info("Query: Found %d slow_lev1_hdf files", len(file_lists['slow_lev1']))
@@ -314,105 +463,23 @@ def get_lwafilelist_from_database():
     })
 
 ##=========================
+## Player template, compiled once and re-read only when its mtime changes
+html_movie_template = HtmlMovieTemplate(os.getenv('LWA_HTML_MOVIE_TEMPLATE', '/nas7a/beam/software/html_movie_example.html'))
+
 @runtime_report
 def lwa_png_html_movie(png_paths, output_dir=f"{lwadata_dir}/{movie_subdir}"):
-    ''' This routine will be called after every update to the figs_mfs
-        folder (in /common/webplots/lwa-data) to write the movie.html file that 
-        allows them to be viewed as a movie.  Just call this with a Time() object 
-        or iso time string containing the desired date.
+    ''' Write the movie.html page that shows png_paths as a movie and return its URL.
+        The page is named by a hash of its frames, so an identical selection
+        returns the existing page without writing anything.
     '''
-    # import glob, os
-    # import imageio.v2 as imageio
-    # try:
-    #     datstr = t.iso[:10]
-    # except:
-    #     datstr = t[:10]
-    # files = glob.glob(image_dir + '*.png')
-    # files.sort()
-    # nfiles = len(files)
-    # if nfiles == 0:
-    #     print('No files (yet) in folder',image_dir)
-    #     return
-
     if not png_paths:
         raise ValueError("No PNG files provided.")
-    files = sorted(png_paths)#[:10]
-
-    # Extract date and timestamp for HTML file naming
-    fname = os.path.basename(files[0])
-    if "T" not in fname:
-        raise ValueError("Filename missing timestamp.")
-    date_str = fname.split("T")[0].split(".")[-1]  # e.g., 2025-05-10
-    timestamp_part = fname.split("T")[1].split("Z")[0]
-    yyyy, mm, dd = date_str.split("-")
-    html_filename = f"movie_{date_str}T{timestamp_part}Z.html"
-
-    html_path = os.path.join(output_dir, html_filename)
-
-    # # Copy PNG files into the output directory
-    # copied_files = []
-    # for f in files:
-    #     try:
-    #         basename = os.path.basename(f)
-    #         target_path = os.path.join(output_dir, basename)
-    #         shutil.copy(f, target_path)
-    #         copied_files.append(target_path)
-    #     except Exception as e:
-    #         print(f"Failed to copy {f}: {e}")
-    # files = copied_files
-
-    ## get html from example
-    files.sort()
-    nfiles = len(files)
-    # if nfiles == 0:
-    #     print('No files (yet) in folder')#
-    #     return
-    ## Read one file to determine its size
-    img = imread(files[0])
-    ysize, xsize, ncolors = img.shape
-    f = open('/nas7a/beam/software/html_movie_example.html', 'r')
-    lines = f.readlines()
-    nlines = len(lines)
-    f.close()
-    skiplines = []
-
-    for i, line in enumerate(lines):
-        k = line.find('var imax')
-        j = line.find('var iwidth')
-        l = line.find('NAME=animation')
-        if k != -1:
-            # Set number of frames
-            lines[i] = line[:10] + '{:3d}'.format(nfiles) + line[13:]
-        if j != -1:
-            # Set width and height of images
-            lines[i] = 'var iwidth = {:d}, iheight = {:d};\n'.format(xsize, ysize)
-        if l != -1:
-            # Set width and height of frame
-            if xsize > 1125:
-                # Reduce frame size for overly large images
-                xfsize = xsize*3//4
-                yfsize = ysize*3//4
-            else:
-                xfsize = xsize
-                yfsize = ysize
-            lines[i] = '<img NAME=animation ALT="FRAME" width='+str(xfsize)+' height='+str(yfsize)+'>'
-        k = line.find('urls[')
-        if k != -1:
-            skiplines.append(i)
-    #print skiplines
-    htmlname = html_path
-
-    f = open(htmlname, 'w')
-    for i in range(skiplines[1] - 1):
-        f.write(lines[i])
-    for i in range(nfiles):
-        rel_path = os.path.relpath(files[i], output_dir)
-        f.write(f'urls[{i:d}]=url_path+"/{rel_path}";\n')
-    for i in range(skiplines[-1]+1,nlines):
-        f.write(lines[i])
-    f.close()
-    logger.info("HTML saved to %s", htmlname)
-    
+
+    html_filename, reused, timings = write_html_movie(png_paths, output_dir, html_movie_template)
+    logger.info("HTML %s %s (%d frames): %s", "reused" if reused else "saved to",
+                os.path.join(output_dir, html_filename), len(png_paths),
+                ", ".join(f"{stage} {dt * 1e3:.1f} ms" for stage, dt in timings.items()))
+
     movie_url = f"https://ovsa.njit.edu/lwa-data/{movie_subdir}/{html_filename}"
     return movie_url
 
@@ -444,46 +511,58 @@ def generate_html_movie():
     #     return f"Could not construct movie path: {e}", 500
 
 ##=========================
-@example.route("/api/flare/spec_movie", methods=['POST'])
-def get_lwa_spec_movie_from_database():
-    start = request.form['start']
-    if not start:
-        raise ValueError("Start time is required.")
-    logger.info("Start time: %s", start)
-
-    start_time = Time(start).datetime
-    date_str = start_time.strftime("%Y%m%d")
-    date_str2 = start_time.strftime("%Y-%m-%d")
-    yyyy = start_time.strftime("%Y")
-
-    ## Local server file paths (for existence check)
-    local_spec_path = f"/common/lwa/spec_v2/daily/{date_str}.png"
-    local_movie_path = f"/common/webplots/lwa-data/qlook_daily/movies/{yyyy}/ovro-lwa-352.synop_mfs_image_I_movie_{date_str}.mp4"
-
-    # Public URLs
-    spec_png_path = f"https://ovsa.njit.edu/lwa/extm/daily/{date_str}.png"
-    movie_path = f"https://ovsa.njit.edu/lwa-data/qlook_daily/movies/{yyyy}/ovro-lwa-352.synop_mfs_image_I_movie_{date_str}.mp4"
-
-    # Check existence
-    spec_exists = os.path.exists(local_spec_path)
-    movie_exists = os.path.exists(local_movie_path)
+## Daily quicklook products, looked up in directory listings (the flat spec
+## directory and one movie directory per year) revalidated by their mtime;
+## a movie written by lwa-query-web_utils.py renames into its year directory,
+## which changes its mtime
+spec_daily_dir = "/common/lwa/spec_v2/daily"
+movie_daily_dir = f"{lwadata_dir}/qlook_daily/movies"
+quicklook_listing_cache = DirCache(revalidate_every=float(os.getenv('LWA_QUICKLOOK_REVALIDATE', 30)), max_dirs=64)
+spec_movie_max_days = 62
+
+def quicklook_availability(day):
+    """Spectrogram and movie URLs of a UTC day, or the messages shown when they do not exist."""
+    date_str = day.strftime("%Y%m%d")
+    date_str2 = day.strftime("%Y-%m-%d")
+    yyyy = day.strftime("%Y")
+    movie_filename = f"ovro-lwa-352.synop_mfs_image_I_movie_{date_str}.mp4"
 
     response = {}
-
-    if spec_exists:
-        response["spec_png_path"] = spec_png_path
-        logger.info("spec_png_path: %s", spec_png_path)
+    if f"{date_str}.png" in quicklook_listing_cache.listdir(spec_daily_dir):
+        response["spec_png_path"] = f"https://ovsa.njit.edu/lwa/extm/daily/{date_str}.png"
     else:
         response["spec_message"] = f"The spectrogram plot on {date_str2} does not exist."
-        logger.info("spec_png_path does not exist: %s", spec_png_path)
-    if movie_exists:
-        response["movie_path"] = movie_path
-        logger.info("movie_path exists: %s", movie_path)
+    if movie_filename in quicklook_listing_cache.listdir(f"{movie_daily_dir}/{yyyy}"):
+        response["movie_path"] = f"https://ovsa.njit.edu/lwa-data/qlook_daily/movies/{yyyy}/{movie_filename}"
     else:
         response["movie_message"] = f"The movie on {date_str2} does not exist."
-        logger.info("movie_path does not exist: %s", movie_path)
+    return response
 
-    return jsonify(response)
+@example.route("/api/flare/spec_movie", methods=['GET', 'POST'])
+@conditional_cache(('start', 'end'), past_max_age=http_quicklook_max_age, stats=http_cache_stats)
+def get_lwa_spec_movie_from_database():
+    """
+    Daily spectrogram and movie of the day of start. With an end as well,
+    {"days": {"YYYY-MM-DD": {...}}} for every day from start to end (at most
+    spec_movie_max_days), so the page can step through days without asking again.
+    """
+    start = request.values['start']
+    if not start:
+        raise ValueError("Start time is required.")
+    start_day = Time(start).datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = request.values.get('end')
+    if not end:
+        response = quicklook_availability(start_day)
+        logger.info("spec/movie on %s: %s", start_day.strftime("%Y-%m-%d"),
+                    ", ".join(k for k in ("spec_png_path", "movie_path") if k in response) or "none")
+        return jsonify(response)
+
+    end_day = Time(end).datetime.replace(hour=0, minute=0, second=0, microsecond=0)
+    n_days = (end_day - start_day).days + 1
+    if n_days < 1 or n_days > spec_movie_max_days:
+        return jsonify({"error": f"The range must cover 1 to {spec_movie_max_days} days."}), 400
+    days = [start_day + timedelta(days=i) for i in range(n_days)]
+    return jsonify({"days": {day.strftime("%Y-%m-%d"): quicklook_availability(day) for day in days}})
 
 # ##=========================
 '''Several method to downsample times
@@ -567,6 +646,55 @@ def compress_time_segments(times, max_gap_seconds=60):
     segments.append((start, prev))
     return segments
 
+##=========================
+# Must match segment_max_gap_seconds in utils/lwadata2sql.py
+availability_max_gap_seconds = 600
+
+@runtime_report
+def get_availability_segments_from_mysql(start, end, image_type="mfs"):
+    """
+    Availability spans of the image products from lwa_availability_segments,
+    maintained by utils/lwadata2sql.py at ingest time.
+
+    Segments sticking out of [start, end] are clipped to the first/last file
+    inside the range with one small query each, so the result equals
+    compress_time_segments() over the files within the range.
+
+    Returns:
+        {'slow_lev1': (segments, n_files), 'slow_lev15': (segments, n_files)}
+    """
+    products = {
+        'slow_lev1': (f'{image_type}_lev1', f'lwa_slow_{image_type}_lev1_hdf_files'),
+        'slow_lev15': (f'{image_type}_lev15', f'lwa_slow_{image_type}_lev15_hdf_files'),
+    }
+    query_seg = """
+        SELECT seg_start, seg_end, n_files FROM lwa_availability_segments
+        WHERE product = %s AND seg_end >= %s AND seg_start <= %s
+        ORDER BY seg_start
+    """
+    query_edge = """
+        SELECT MIN(obs_time), MAX(obs_time), COUNT(*) FROM {table}
+        WHERE obs_time BETWEEN %s AND %s
+    """
+    result = {}
+    with lwa_query_db_connection() as connection:
+        cursor = connection.cursor()
+        for label, (product, table) in products.items():
+            cursor.execute(query_seg, (product, start, end))
+            segments = []
+            n_files = 0
+            for seg_start, seg_end, n in cursor.fetchall():
+                if seg_start < start or seg_end > end:
+                    cursor.execute(query_edge.format(table=table), (max(seg_start, start), min(seg_end, end)))
+                    seg_start, seg_end, n = cursor.fetchone()
+                    if not n:
+                        continue
+                segments.append((seg_start, seg_end))
+                n_files += n
+            result[label] = (segments, n_files)
+        cursor.close()
+    return result
+
 color_map = {
     'spec_fits': '#1f77b4',  # muted blue
     'slow_lev1':  '#ff7f0e',  # safety orange
@@ -574,32 +702,32 @@ color_map = {
 }
 
 # ##=========================
-@example.route('/plot', methods=['POST'])
-def plot():
-    start = request.form['start']
-    end = request.form['end']
-    cadence = request.form.get('cadence', None)
-    cadence_sec = int(cadence) if cadence else None
-    logger.info("plotly cadence_sec: %s", cadence_sec)
-
-    image_type = request.form.get('image_type', 'mfs')
-
-    try:
-        start = datetime.strptime(start, "%Y-%m-%dT%H:%M:%S") - timedelta(days=0)
-        end = datetime.strptime(end, "%Y-%m-%dT%H:%M:%S") + timedelta(days=0)
-    except ValueError:
-        return jsonify({'error': 'Invalid date format'}), 400
-    if start > end:
-        return jsonify({'error': 'End date must be after start date'}), 400
-
-    file_lists, obs_times = get_lwa_file_lists_from_mysql(Time(start).isot, Time(end).isot, image_type=image_type)
+def segments_to_line_xy(segments, y_label):
+    """
+    Flatten (start, end) spans into x/y arrays for a single line trace,
+    with None between spans so Plotly draws them as separate pieces.
+    """
+    x = []
+    y = []
+    for seg_start, seg_end in segments:
+        x.extend((seg_start, seg_end, None))
+        y.extend((y_label, y_label, None))
+    return x[:-1], y[:-1]
+
+def build_availability_figure(obs_times, start, end, image_type, image_segments=None):
+    """
+    Build the data availability figure from the obs_times of get_lwa_file_lists_from_mysql.
 
-    if cadence_sec:
-        for key in ['slow_lev1', 'slow_lev15']:
-            obs_times[key], file_lists[key] = filter_files_by_cadence(
-                obs_times[key], file_lists[key], cadence_sec
-            )
+    Parameters:
+        obs_times (dict): {'spec_fits': [(start, end), ...], 'slow_lev1': [t, ...], 'slow_lev15': [t, ...]}
+        start, end (datetime): x-axis range
+        image_type (str): "mfs" or "fch", used in the labels
+        image_segments (dict): optional precomputed {label: (segments, n_files)} used
+            instead of compressing obs_times, see get_availability_segments_from_mysql
 
+    Returns:
+        plotly.graph_objects.Figure
+    """
     fig = go.Figure()
     labels = ['spec_fits', 'slow_lev1', 'slow_lev15']
     # labels_fig = ['spec_fits', 'image_lev1', 'image_lev15']
@@ -607,9 +735,14 @@ def plot():
 
     for i, (label, label_fig) in enumerate(zip(labels, labels_fig)):
 
-        times = obs_times.get(label, [])
-        y_values = [label_fig] * len(times)
-        label_with_count = f"N({label_fig}) = {len(times)}" if times else f"N({label_fig}) = 0"
+        if image_segments and label in image_segments:
+            segments, n_files = image_segments[label]
+            times = segments
+        else:
+            segments = None
+            times = obs_times.get(label, [])
+            n_files = len(times)
+        label_with_count = f"N({label_fig}) = {n_files}"
 
         if not times:
             fig.add_trace(go.Scatter(
@@ -620,35 +753,23 @@ def plot():
                 name=label_with_count,
                 showlegend=True
             ))
-        elif label == 'spec_fits':
-            show_legend = True
-            for sp_start, sp_end in times:
-                fig.add_trace(go.Scatter(
-                    x=[sp_start, sp_end],
-                    y=[label_fig, label_fig],
-                    mode='lines',
-                    line=dict(width=15, color=color_map[label]),
-                    name=label_with_count,
-                    showlegend=show_legend
-                ))
-                show_legend = False
         else:
-            if label == 'slow_lev1':
-                segments = compress_time_segments(times, max_gap_seconds=600)#180
-            else:
-                segments = compress_time_segments(times, max_gap_seconds=600)
-
-            show_legend = True
-            for i_st, i_ed in segments:
-                fig.add_trace(go.Scatter(
-                    x=[i_st, i_ed],
-                    y=[label_fig, label_fig],
-                    mode='lines',
-                    line=dict(width=15, color=color_map[label]),
-                    name=label_with_count,
-                    showlegend=show_legend
-                ))
-                show_legend = False
+            if label == 'spec_fits':
+                segments = times
+            elif segments is None:
+                segments = compress_time_segments(times, max_gap_seconds=availability_max_gap_seconds)
+
+            # One trace per product: spans are separate line pieces split by None
+            x, y = segments_to_line_xy(segments, label_fig)
+            fig.add_trace(go.Scatter(
+                x=x,
+                y=y,
+                mode='lines',
+                line=dict(width=15, color=color_map[label]),
+                name=label_with_count,
+                showlegend=True,
+                connectgaps=False
+            ))
 
     fig.update_layout(
         title=dict(
@@ -662,64 +783,152 @@ def plot():
         legend=dict(font=dict(size=16)),
         height=400
     )
+    return fig
 
+def parse_plot_timerange(start, end):
+    """Parse the form's start/end; returns (start, end, error_response)."""
+    try:
+        start = datetime.strptime(start, "%Y-%m-%dT%H:%M:%S") - timedelta(days=0)
+        end = datetime.strptime(end, "%Y-%m-%dT%H:%M:%S") + timedelta(days=0)
+    except ValueError:
+        return None, None, (jsonify({'error': 'Invalid date format'}), 400)
+    if start > end:
+        return None, None, (jsonify({'error': 'End date must be after start date'}), 400)
+    return start, end, None
+
+# ##=========================
+@example.route('/plot', methods=['GET', 'POST'])
+@conditional_cache(query_cache_params, version=lambda: query_cache.version, past_max_age=http_past_max_age,
+                   stats=http_cache_stats)
+def plot():
+    start = request.values['start']
+    end = request.values['end']
+    cadence = request.values.get('cadence', None)
+    cadence_sec = int(cadence) if cadence else None
+    logger.info("plotly cadence_sec: %s", cadence_sec)
+
+    image_type = request.values.get('image_type', 'mfs')
+    cadence_mode = request.values.get('cadence_mode', 'greedy')
+
+    start, end, error = parse_plot_timerange(start, end)
+    if error:
+        return error
+    if cadence_mode not in cadence_modes:
+        return jsonify({'error': f'Unsupported cadence_mode: {cadence_mode}'}), 400
+
+    image_segments = None
+    if not cadence_sec:
+        # Without cadence the image spans come from the precomputed segments table
+        try:
+            image_segments = get_availability_segments_from_mysql(start, end, image_type=image_type)
+        except mysql.connector.Error as e:
+            logger.warning("Availability segments unavailable, scanning obs_time rows: %s", e)
+
+    file_lists, obs_times = get_lwa_file_lists_from_mysql(
+        Time(start).isot, Time(end).isot, image_type=image_type, cadence_sec=cadence_sec, cadence_mode=cadence_mode,
+        file_types=['spec_fits'] if image_segments else None)
+
+    fig = build_availability_figure(obs_times, start, end, image_type, image_segments=image_segments)
+    return jsonify({
+        'plot': pio.to_json(fig)
+    })
+
+# ##=========================
+@example.route('/api/flare/query_plot', methods=['GET', 'POST'])
+@conditional_cache(query_cache_params, version=lambda: query_cache.version, past_max_age=http_past_max_age,
+                   stats=http_cache_stats)
+def query_and_plot():
+    """
+    File lists and the availability figure from a single metadata fetch.
+    Returns the keys of /api/flare/query plus 'plot' from /plot.
+    """
+    start = request.values['start']
+    end = request.values['end']
+    cadence = request.values.get('cadence', None)
+    cadence_sec = int(cadence) if cadence else None
+    image_type = request.values.get('image_type', 'mfs')
+    cadence_mode = request.values.get('cadence_mode', 'greedy')
+    logger.info("Query+plot image_type: %s, cadence_sec: %s", image_type, cadence_sec)
+
+    start, end, error = parse_plot_timerange(start, end)
+    if error:
+        return error
+    if cadence_mode not in cadence_modes:
+        return jsonify({'error': f'Unsupported cadence_mode: {cadence_mode}'}), 400
+
+    file_lists, obs_times = get_lwa_file_lists_from_mysql(
+        Time(start).isot, Time(end).isot, image_type=image_type, cadence_sec=cadence_sec, cadence_mode=cadence_mode)
+
+    logger.info("Query: Found %d spec_fits files", len(file_lists['spec_fits']))
+    logger.info("Query: Found %d slow_lev1_hdf files", len(file_lists['slow_lev1']))
+    logger.info("Query: Found %d slow_lev15_hdf files", len(file_lists['slow_lev15']))
+
+    fig = build_availability_figure(obs_times, start, end, image_type)
     return jsonify({
+        "spec_fits": convert_local_to_filename(file_lists['spec_fits']),
+        "slow_lev1": convert_local_to_filename(file_lists['slow_lev1']),
+        "slow_lev15": convert_local_to_filename(file_lists['slow_lev15']),
         'plot': pio.to_json(fig)
     })
 
 ##=========================
+## Background bundle and movie jobs; the job table is shared by all web workers
+_bundle_jobs = None
+_bundle_jobs_lock = threading.Lock()
+
+
+def get_bundle_jobs():
+    """
+    Return the job queue, creating it (and its SQLite table) on first use, so
+    importing the blueprint does not touch LWA_JOBS_DB_PATH.
+    """
+    global _bundle_jobs
+    if _bundle_jobs is None:
+        with _bundle_jobs_lock:
+            if _bundle_jobs is None:
+                _bundle_jobs = JobQueue(
+                    os.getenv('LWA_JOBS_DB_PATH', "/home/xychen/lwadata-query-web-utils/lwa_jobs.sqlite"),
+                    workers=int(os.getenv('LWA_JOB_WORKERS', 2)),
+                    max_queued=int(os.getenv('LWA_JOB_MAX_QUEUED', 32)),
+                )
+    return _bundle_jobs
+
+## Content-addressed archives in tmp/data-request, evicted LRU beyond the size budget
+bundle_store = BundleStore(
+    f"{lwadata_dir}/{data_subdir}",
+    max_bytes=int(float(os.getenv('LWA_BUNDLE_STORE_GB', 200)) * 1024 ** 3),
+)
+
 """To enforce user download limits (eg, max 20 downloads per day, and max 10GB per bundle)
 Flask backend can track IPs.
 Before serving a file, it will check how many downloads from that IP today and how much total data has been sent.
 """
 
-def load_user_download_log():
-    if os.path.exists(lwa_user_downloads_log_path):
-        with open(lwa_user_downloads_log_path, 'r') as f:
-            return json.load(f)
-    else:
-        # Create an empty log file
-        with open(lwa_user_downloads_log_path, 'w') as f:
-            json.dump({}, f, indent=2)
-        return {}
-
+download_quota = DownloadQuota(lwa_user_downloads_db_path, legacy_json_path=lwa_user_downloads_log_path)
 
-def save_user_download_log(log):
-    with open(lwa_user_downloads_log_path, 'w') as f:
-        json.dump(log, f)
 
+def reserve_user_download(IP, archive_size_MB, max_downloads=20, max_total_MB=50):
+    """
+    Check today's quota of IP and record the download in the same transaction.
 
-def is_user_download_allowed(IP, archive_size_MB, max_downloads=20, max_total_MB=50):
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    log = load_user_download_log()
-    IP_log = log.get(IP, {}).get(today, {"count": 0, "size": 0})
-
-    if IP_log["count"] >= max_downloads:
+    Returns:
+        (allowed, reason): reason explains a denial, empty if allowed
+    """
+    allowed, count, requested_already_MB = download_quota.check_and_record(
+        IP, archive_size_MB, max_downloads=max_downloads, max_total_MB=max_total_MB)
+    if allowed:
+        return True, ""
+    if count >= max_downloads:
         return False, f"Download count limit ({max_downloads}) reached for today. Try again tomorrow or contact the OVRO-LWA Solar Team."
 
-    requested_already_MB = IP_log["size"]
     requested_now_MB = archive_size_MB
     requested_total_MB = requested_already_MB + requested_now_MB
-    if requested_total_MB > max_total_MB:
-        return False, (
-            f"You have already downloaded approximately {int(requested_already_MB)} MB today. "
-            f"This request is for {int(requested_now_MB)} MB, bringing your total to {int(requested_total_MB)} MB, "
-            f"which exceeds the daily limit of {int(max_total_MB)} MB. "
-            "Try again tomorrow or contact the OVRO-LWA Solar Team."
-        )
-    return True, ""
-
-
-def log_user_download(IP, archive_size_MB):
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    log = load_user_download_log()
-    if IP not in log:
-        log[IP] = {}
-    if today not in log[IP]:
-        log[IP][today] = {"count": 0, "size": 0}
-    log[IP][today]["count"] += 1
-    log[IP][today]["size"] += archive_size_MB
-    save_user_download_log(log)
+    return False, (
+        f"You have already downloaded approximately {int(requested_already_MB)} MB today. "
+        f"This request is for {int(requested_now_MB)} MB, bringing your total to {int(requested_total_MB)} MB, "
+        f"which exceeds the daily limit of {int(max_total_MB)} MB. "
+        "Try again tomorrow or contact the OVRO-LWA Solar Team."
+    )
 
 
 # ##=========================
@@ -740,6 +949,33 @@ def extract_timestamp_from_filename(filename):
     else:
         return "UNKNOWN"
 
+# ##=========================
+## Stats of files ingested before their sizes were recorded, revalidated by directory mtime
+file_stat_cache = DirCache(revalidate_every=float(os.getenv('LWA_STAT_CACHE_REVALIDATE', 30)))
+
+def resolve_file_stats(file_paths, recorded):
+    """
+    (path, size, mtime_ns) of every file: the values recorded at ingest, or for
+    older rows a (cached) stat; size and mtime are None if the file is missing.
+
+    Parameters:
+        file_paths (list): files of the bundle
+        recorded (dict): file_path -> (file_size, file_mtime_ns) from get_lwa_file_lists_from_mysql
+    """
+    missing = [f for f in file_paths if recorded.get(f, (None, None))[0] is None]
+    stated = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            stated = dict(zip(missing, executor.map(file_stat_cache.stat, missing)))
+    file_stats = []
+    for f in file_paths:
+        if f in stated:
+            size, mtime_ns = stated[f] or (None, None)
+        else:
+            size, mtime_ns = recorded[f]
+        file_stats.append((f, size, mtime_ns))
+    return file_stats
+
 # ##=========================
 @example.route('/check_bundle_summary/<bundle_type>', methods=['POST'])
 def check_bundle_summary(bundle_type):
@@ -748,20 +984,19 @@ def check_bundle_summary(bundle_type):
     cadence = request.form.get('cadence', None)
     cadence_sec = int(cadence) if cadence else None
     image_type = request.form.get('image_type', 'mfs')
+    cadence_mode = request.form.get('cadence_mode', 'greedy')
 
     if not start or not end:
         return "Start and end parameters are required", 400
+    if cadence_mode not in cadence_modes:
+        return f"Unsupported cadence_mode: {cadence_mode}", 400
 
-    file_lists, obs_times = get_lwa_file_lists_from_mysql(start, end, image_type=image_type)
+    file_lists, obs_times, recorded_stats = get_lwa_file_lists_from_mysql(
+        start, end, image_type=image_type, cadence_sec=cadence_sec, cadence_mode=cadence_mode, with_stats=True)
 
     if bundle_type not in file_lists:
         return jsonify({"error": "Invalid bundle type"}), 400
 
-    if cadence_sec and bundle_type in ['slow_lev1', 'slow_lev15']:
-        obs_times[bundle_type], file_lists[bundle_type] = filter_files_by_cadence(
-            obs_times[bundle_type], file_lists[bundle_type], cadence_sec
-        )
-
     selected_files_json = request.form.get('selected_files')
     if selected_files_json:
         try:
@@ -772,9 +1007,8 @@ def check_bundle_summary(bundle_type):
     else:
         file_paths = file_lists[bundle_type]
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        sizes = list(executor.map(safe_getsize, file_paths))
-    total_size_MB = sum(sizes) / (1024 * 1024)
+    file_stats = resolve_file_stats(file_paths, recorded_stats[bundle_type])
+    total_size_MB = sum(st[1] or 0 for st in file_stats) / (1024 * 1024)
 
     ## Get the IP information
     if 'X-Forwarded-For' in request.headers:
@@ -783,9 +1017,7 @@ def check_bundle_summary(bundle_type):
     else:
         user_IP = request.remote_addr
 
-    log = load_user_download_log()
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    already_downloaded_MB = log.get(user_IP, {}).get(today, {}).get("size", 0)
+    _, already_downloaded_MB = download_quota.usage(user_IP)
     total_after_MB = already_downloaded_MB + total_size_MB
     # return jsonify({"file_count": len(file_paths), "total_now_size": int(total_size_MB)})
     return jsonify({
@@ -798,26 +1030,41 @@ def check_bundle_summary(bundle_type):
 
 
 # ##=========================
-@example.route('/generate_bundle/<bundle_type>', methods=['POST'])
-def generate_data_bundle(bundle_type):
+bundle_names = {
+    'spec_fits': 'ovro-lwa-spec',
+    'slow_lev1': 'ovro-lwa-image-lev1',
+    'slow_lev15': 'ovro-lwa-image-lev15'
+}
+
+def prepare_bundle_request(bundle_type):
+    """
+    Resolve the bundle form of the current request and apply the download quota.
+
+    Returns:
+        (file_paths, file_stats, download_name, fmt, None) if the download is
+        allowed, otherwise (None, None, None, None, error_response); file_stats
+        holds (path, size, mtime_ns) per file for the bundle key
+    """
     start = request.form.get('start')
     end = request.form.get('end')
     cadence = request.form.get('cadence', None)
     cadence_sec = int(cadence) if cadence else None
     image_type = request.form.get('image_type', 'mfs')
+    cadence_mode = request.form.get('cadence_mode', 'greedy')
+    fmt = request.form.get('format', bundle_format)
 
     if not start or not end:
-        return "Start and end parameters are required", 400
+        return None, None, None, None, ("Start and end parameters are required", 400)
+    if fmt not in available_formats():
+        return None, None, None, None, (f"Unsupported bundle format: {fmt}", 400)
+    if cadence_mode not in cadence_modes:
+        return None, None, None, None, (f"Unsupported cadence_mode: {cadence_mode}", 400)
 
-    file_lists, obs_times = get_lwa_file_lists_from_mysql(start, end, image_type=image_type)
+    file_lists, obs_times, recorded_stats = get_lwa_file_lists_from_mysql(
+        start, end, image_type=image_type, cadence_sec=cadence_sec, cadence_mode=cadence_mode, with_stats=True)
 
     if bundle_type not in file_lists:
-        return f"Invalid bundle type: {bundle_type}", 400
-
-    if cadence_sec and bundle_type in ['slow_lev1', 'slow_lev15']:
-        obs_times[bundle_type], file_lists[bundle_type] = filter_files_by_cadence(
-            obs_times[bundle_type], file_lists[bundle_type], cadence_sec
-        )
+        return None, None, None, None, (f"Invalid bundle type: {bundle_type}", 400)
 
     # for selected_files
     selected_files_json = request.form.get('selected_files')
@@ -826,77 +1073,252 @@ def generate_data_bundle(bundle_type):
             selected_files = set(json.loads(selected_files_json))
             file_paths = [f for f in file_lists[bundle_type] if os.path.basename(f) in selected_files]
         except Exception as e:
-            return f"Invalid selected_files format: {e}", 400
+            return None, None, None, None, (f"Invalid selected_files format: {e}", 400)
     else:
         file_paths = file_lists[bundle_type]
 
-    # file_paths = file_lists[bundle_type]
     if not file_paths:
-        return f"No files found for {bundle_type}", 404
+        return None, None, None, None, (f"No files found for {bundle_type}", 404)
 
     # To check if the data request for downloading is allowed
-    # user_IP = request.remote_addr
     if 'X-Forwarded-For' in request.headers:
         # May contain multiple IPs if behind multiple proxies
         user_IP = request.headers['X-Forwarded-For'].split(',')[0].strip()
     else:
         user_IP = request.remote_addr
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        sizes = list(executor.map(safe_getsize, file_paths))
-    estimated_size_MB = sum(sizes) / (1024 * 1024)
-    allowed, reason = is_user_download_allowed(user_IP, estimated_size_MB, max_downloads=max_IP_downloads_per_day, max_total_MB=max_MB_downloads_per_IP)
+    file_stats = resolve_file_stats(file_paths, recorded_stats[bundle_type])
+    estimated_size_MB = sum(st[1] or 0 for st in file_stats) / (1024 * 1024)
+    allowed, reason = reserve_user_download(user_IP, estimated_size_MB, max_downloads=max_IP_downloads_per_day, max_total_MB=max_MB_downloads_per_IP)
     if not allowed:
-        return f"Download denied: {reason}", 403
-    log_user_download(user_IP, estimated_size_MB)
+        return None, None, None, None, (f"Download denied: {reason}", 403)
 
     # Download is allowed
-    bundle_names = {
-        'spec_fits': 'ovro-lwa-spec',
-        'slow_lev1': 'ovro-lwa-image-lev1',
-        'slow_lev15': 'ovro-lwa-image-lev15'
-    }
     start_time_str = extract_timestamp_from_filename(os.path.basename(file_paths[0]))
     end_time_str = extract_timestamp_from_filename(os.path.basename(file_paths[-1]))
     cadence_suffix = f"_cad{cadence_sec}s" if cadence_sec else ""
 
     archive_label = bundle_names.get(bundle_type, bundle_type)
-    archive_filename = f"{archive_label}-{image_type}{cadence_suffix}_{start_time_str}Z-{end_time_str}Z.tar.gz"
-    # # Create a permanent bundle output path
-    # bundle_dir = "/data1/xychen/flaskenv/lwa_data_query_request"
-    bundle_dir = f"{lwadata_dir}/{data_subdir}"
-    os.makedirs(bundle_dir, exist_ok=True)
-    # archivse_path = os.path.join(bundle_dir, f"{bundle_type}_{start_time_str}_{end_time_str}.tar.gz")
-    archive_path = os.path.join(bundle_dir, archive_filename)
-
-    # Create .tar
-    if not os.path.exists(archive_path):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            for path in file_paths:
-                if os.path.exists(path):
-                    shutil.copy(path, temp_dir)
-            shutil.make_archive(
-                base_name=archive_path.replace(".tar.gz", ""),
-                format="gztar",
-                root_dir=temp_dir
-            )
-    logger.info("Generate bundle for %s from %s to %s", bundle_type, start, end)
-    return jsonify({"archive_name": os.path.basename(archive_path)})
+    download_name = f"{archive_label}-{image_type}{cadence_suffix}_{start_time_str}Z-{end_time_str}Z{format_suffixes[fmt]}"
+    return file_paths, file_stats, download_name, fmt, None
+
+
+def bundle_compress_args(fmt):
+    """Keyword arguments of build_tar/stream_tar for the bundle format."""
+    return dict(fmt=fmt, threads=bundle_threads,
+                compresslevel=bundle_zstd_level if fmt == 'zst' else bundle_compresslevel)
+
+
+@example.route('/generate_bundle/<bundle_type>', methods=['POST'])
+def generate_data_bundle(bundle_type):
+    file_paths, file_stats, download_name, fmt, error = prepare_bundle_request(bundle_type)
+    if error:
+        return error
+
+    # Archives are shared by every request selecting the same files
+    key = bundle_key(file_stats, fmt)
+    archive_path = bundle_store.lookup(key)
+
+    # Stream the archive straight into the response, nothing is written on disk
+    if request.form.get('stream') in ('1', 'true'):
+        if archive_path:
+            return send_file(archive_path, as_attachment=True, download_name=download_name)
+        logger.info("Stream bundle %s", download_name)
+        return Response(
+            stream_tar(file_paths, **bundle_compress_args(fmt)),
+            mimetype='application/zstd' if fmt == 'zst' else 'application/gzip',
+            headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+        )
+
+    # Create .tar.gz directly from the source files
+    if not archive_path:
+        n_files, n_bytes = build_tar(file_paths, bundle_store.archive_path(key, fmt), **bundle_compress_args(fmt))
+        bundle_store.add(key, n_files, fmt)
+    logger.info("Generate bundle %s (%s)", download_name, key)
+    return jsonify({"archive_name": archive_name_for(key, fmt), "download_name": download_name})
+
+# ##=========================
+def bundle_job_to_json(job, download_name=None):
+    """Public view of a job row for the polling endpoints."""
+    result = job['result'] or {}
+    return {
+        "job_id": job['job_id'],
+        "state": job['state'],
+        "files_done": job['files_done'],
+        "files_total": job['files_total'],
+        "bytes_done": job['bytes_done'],
+        "bytes_total": job['bytes_total'],
+        "archive_name": result.get('archive_name'),
+        "movie_url": result.get('movie_url'),
+        "download_name": download_name or job['params'].get('download_name'),
+        "error": job['error'],
+    }
+
+
+@example.route('/bundle_jobs/submit/<bundle_type>', methods=['POST'])
+def submit_bundle_job(bundle_type):
+    """
+    Queue the bundle for a background worker and return its job id right away.
+    An archive of the same files that already exists, or is being built for
+    someone else, is reused instead of compressing the files again.
+    """
+    file_paths, file_stats, download_name, fmt, error = prepare_bundle_request(bundle_type)
+    if error:
+        return error
+
+    key = bundle_key(file_stats, fmt)
+    bytes_total = sum(st[1] or 0 for st in file_stats)
+    params = {"bundle_type": bundle_type, "download_name": download_name}
+    result = {"archive_name": archive_name_for(key, fmt)}
+
+    job_id = None
+    if bundle_store.lookup(key):
+        job_id = get_bundle_jobs().complete('bundle', result, params=params,
+                                      files_total=len(file_paths), bytes_total=bytes_total)
+    else:
+        job_id = get_bundle_jobs().find_active('bundle', key)
+    if job_id is None:
+        def build(ctx):
+            n_files, n_bytes = build_tar(file_paths, bundle_store.archive_path(key, fmt),
+                                         progress=ctx.progress, **bundle_compress_args(fmt))
+            bundle_store.add(key, n_files, fmt)
+            return result
+        try:
+            job_id = get_bundle_jobs().submit('bundle', build, params=params, dedup_key=key,
+                                        files_total=len(file_paths), bytes_total=bytes_total)
+        except JobQueueFull as e:
+            return str(e), 503
+    logger.info("Bundle job %s for %s (%s)", job_id, download_name, key)
+    return jsonify(bundle_job_to_json(get_bundle_jobs().get(job_id), download_name=download_name)), 202
+
+
+@example.route('/bundle_jobs/<job_id>', methods=['GET'])
+def get_bundle_job(job_id):
+    job = get_bundle_jobs().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(bundle_job_to_json(job))
+
+
+@example.route('/bundle_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_bundle_job(job_id):
+    if get_bundle_jobs().cancel(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(bundle_job_to_json(get_bundle_jobs().get(job_id)))
+
+# ##=========================
+## Videos of the selected frames, rendered by the job workers next to the HTML movie pages
+video_fps = int(os.getenv('LWA_VIDEO_FPS', 6))
+video_max_width = int(os.getenv('LWA_VIDEO_MAX_WIDTH', 1280))
+video_threads = int(os.getenv('LWA_VIDEO_THREADS', 0))
+
+@example.route('/movie_jobs/submit', methods=['POST'])
+def submit_movie_job():
+    """
+    Queue an MP4/WebM render of the selected frames and return its job id right
+    away; poll and cancel it through /bundle_jobs/<job_id>. A video of the same
+    frames and settings that already exists, or is being rendered for someone
+    else, is reused.
+    """
+    selected_files_json = request.form.get('selected_files', '')
+    if not selected_files_json:
+        return "No files selected", 400
+    try:
+        selected_files = json.loads(selected_files_json)
+    except Exception as e:
+        return f"Invalid JSON: {e}", 400
+    fmt = request.form.get('format', 'mp4')
+    if fmt not in video_formats:
+        return f"Unknown video format: {fmt}", 400
+    try:
+        fps = min(max(int(request.form.get('fps', video_fps)), 1), 30)
+    except ValueError:
+        return "Invalid fps", 400
+
+    png_files = convert_slow_hdf_to_existing_png(selected_files)
+    if not png_files:
+        return "No quicklook images found for the selected files", 404
+
+    key = video_key(png_files, fmt, fps, video_max_width)
+    video_name = video_filename(png_files, key, fmt)
+    video_path = os.path.join(lwadata_dir, movie_subdir, video_name)
+    params = {"format": fmt, "fps": fps, "download_name": video_name}
+    result = {"movie_url": f"https://ovsa.njit.edu/lwa-data/{movie_subdir}/{video_name}"}
+
+    job_id = None
+    if existing_video(video_path):
+        job_id = get_bundle_jobs().complete('movie', result, params=params, files_total=len(png_files))
+    else:
+        job_id = get_bundle_jobs().find_active('movie', key)
+    if job_id is None:
+        def render(ctx):
+            n_frames, n_bytes = render_video(png_files, video_path, fmt=fmt, fps=fps, max_width=video_max_width,
+                                             threads=video_threads, progress=ctx.progress)
+            logger.info("Video %s: %d frames, %.1f MB", video_path, n_frames, n_bytes / 1024 ** 2)
+            return result
+        try:
+            job_id = get_bundle_jobs().submit('movie', render, params=params, dedup_key=key, files_total=len(png_files))
+        except JobQueueFull as e:
+            return str(e), 503
+    logger.info("Movie job %s for %d frames (%s)", job_id, len(png_files), video_name)
+    return jsonify(bundle_job_to_json(get_bundle_jobs().get(job_id))), 202
 
 # ##=========================
 @example.route('/download_ready_bundle/<archive_name>', methods=['GET'])
 def download_ready_bundle(archive_name):
+    """
+    Serve a finished archive, given either its file name or the id of the job
+    that built it. The optional ?name= sets the file name the user receives.
+    """
+    download_name = request.args.get('name')
+    if not archive_name.endswith(tuple(format_suffixes.values())):
+        job = get_bundle_jobs().get(archive_name)
+        if job is None:
+            return f"{archive_name} not found", 404
+        if job['state'] != 'done':
+            return jsonify(bundle_job_to_json(job)), 409
+        archive_name = job['result']['archive_name']
+        download_name = download_name or job['params'].get('download_name')
+
     # bundle_dir = "/data1/xychen/flaskenv/lwa_dafta_query_request"
     bundle_dir = f"{lwadata_dir}/{data_subdir}"
-    archive_path = os.path.join(bundle_dir, archive_name)
+    archive_path = os.path.join(bundle_dir, os.path.basename(archive_name))
     logger.info("Download bundle: %s", archive_path)
     if os.path.exists(archive_path):
-        return send_file(archive_path, as_attachment=True, download_name=archive_name)
+        return send_file(archive_path, as_attachment=True,
+                         download_name=os.path.basename(download_name or archive_name))
     else:
         return f"{archive_name} not found", 404
 
+# ##=========================
+@example.route('/api/db/pool_stats', methods=['GET'])
+def get_db_pool_stats():
+    """Connection pool stats of the worker process serving this request."""
+    return jsonify(db_pool.get_pool(create_lwa_query_db_connection).stats())
+
+@example.route('/api/db/cache_stats', methods=['GET'])
+def get_query_cache_stats():
+    """Metadata row cache and HTTP 304/full response stats of the worker process serving this request."""
+    stats = query_cache.stats()
+    stats['http'] = dict(http_cache_stats)
+    return jsonify(stats)
+
+@example.route('/api/db/stat_cache_stats', methods=['GET'])
+def get_file_stat_cache_stats():
+    """File stat, PNG and quicklook listing cache stats of the worker process serving this request."""
+    stats = file_stat_cache.stats()
+    stats['png_listings'] = png_listing_cache.stats()
+    stats['quicklook_listings'] = quicklook_listing_cache.stats()
+    return jsonify(stats)
+
+@example.route('/api/db/bundle_stats', methods=['GET'])
+def get_bundle_store_stats():
+    """Archive reuse (hit/miss) and size of the shared bundle store."""
+    return jsonify(bundle_store.stats())
+
 # ##=========================
 @example.route("/")
 def render_example_paper():
     hostname = socket.gethostname()
-    return render_template('index.html', result=[], plot_html_ID=None, hostname=hostname)
+    return render_template('index.html', result=[], plot_html_ID=None, hostname=hostname,
+                           bundle_formats=available_formats(), bundle_format=bundle_format)
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""
+    This module writes compressed tar data bundles straight from the source files.
+
+    Files are added with their basename as arcname and copied through tarfile's
+    bounded buffer, so no scratch copy of the selection is ever made. The same
+    writer can fill an archive file or feed an HTTP response chunk by chunk.
+    Compression runs on several cores: block-parallel gzip (standard .tar.gz
+    output) or, when zstandard is installed, multithreaded zstd (.tar.zst).
+"""
+import os
+import zlib
+import queue
+import struct
+import tarfile
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+copy_bufsize = 1024 * 1024
+bundle_formats = ('gz', 'zst')
+format_suffixes = {'gz': '.tar.gz', 'zst': '.tar.zst'}
+
+
+def available_formats():
+    """Formats usable on this host; 'zst' needs the optional zstandard package."""
+    return tuple(f for f in bundle_formats if f != 'zst' or zstandard is not None)
+
+
+##=========================
+## Blocks compress to at most 1.01 x their size at level 1 (and grow a little
+## when stored), so a block whose sample does not beat this ratio is stored.
+store_ratio = 0.97
+sample_bytes = 64 * 1024
+dict_bytes = 32 * 1024
+
+
+def _deflate_block(data, level, zdict, last):
+    """Raw deflate one block, primed with the previous 32 KiB like pigz."""
+    if level > 0 and len(data) > sample_bytes:
+        sample = zlib.compress(data[:sample_bytes], 1)
+        if len(sample) > store_ratio * sample_bytes:
+            level = 0  # already compressed payload (e.g. gzip-filtered HDF5)
+    if zdict:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, 8)
+    out = comp.compress(data)
+    return out + comp.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(object):
+    """
+    Write-only file object producing a standard single-member gzip stream,
+    compressing block_size blocks on `threads` threads (the pigz scheme: each
+    block is byte-aligned with a sync flush and uses the tail of the previous
+    block as dictionary, so the ratio stays close to plain gzip). Blocks that
+    do not compress are stored, which makes packed HDF5 files nearly free.
+    """
+
+    def __init__(self, fileobj, compresslevel=6, threads=None, block_size=copy_bufsize):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.threads = max(1, int(threads or os.cpu_count() or 1))
+        self.block_size = block_size
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._prev_tail = b''
+        self._crc = 0
+        self._size = 0
+        self._closed = False
+        # gzip header: deflate, no flags, mtime 0, unknown OS (as GzipFile(mtime=0))
+        self.fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', 0) + b'\x00\xff')
+
+    def _submit(self, data, last):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._pending.append(self._executor.submit(
+            _deflate_block, data, self.compresslevel, self._prev_tail, last))
+        self._prev_tail = data[-dict_bytes:]
+        while len(self._pending) > 2 * self.threads:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            self.fileobj.write(struct.pack('<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Drop pending blocks; the partial output is discarded by the caller
+            self._closed = True
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+
+
+def open_compressor(fileobj, fmt='gz', compresslevel=6, threads=None):
+    """
+    Compressed write-only wrapper around fileobj.
+
+    Parameters:
+        fmt (str): 'gz' (standard gzip, block-parallel) or
+            'zst' (zstd with its own worker threads; needs zstandard)
+        compresslevel (int): gzip 1-9 / zstd 1-19
+        threads (int): compression threads, None for all cores
+    """
+    threads = max(1, int(threads or os.cpu_count() or 1))
+    if fmt == 'zst':
+        if zstandard is None:
+            raise ValueError("zstd bundles need the zstandard package")
+        cctx = zstandard.ZstdCompressor(level=compresslevel, threads=threads if threads > 1 else 0)
+        try:
+            return cctx.stream_writer(fileobj, closefd=False)
+        except TypeError:  # zstandard < 0.15 never closes the inner file
+            return cctx.stream_writer(fileobj)
+    if fmt != 'gz':
+        raise ValueError(f"Unknown bundle format: {fmt}")
+    return ParallelGzipWriter(fileobj, compresslevel=compresslevel, threads=threads)
+
+
+##=========================
+def write_tar(file_paths, fileobj, fmt='gz', compresslevel=6, threads=None, bufsize=copy_bufsize, progress=None):
+    """
+    Write a compressed tar stream of file_paths into an open binary file object.
+
+    Parameters:
+        file_paths (list): source files, stored under their basename
+        fileobj: writable binary file object (only write() is used)
+        fmt (str): 'gz' or 'zst', see open_compressor
+        compresslevel (int): compression level, see open_compressor
+        threads (int): compression threads, None for all cores
+        bufsize (int): read/write block size
+        progress (callable): progress(n_files, n_bytes) after every file; may
+            raise to abort the archive
+
+    Returns:
+        (n_files, n_bytes) actually archived; missing files are skipped, but an
+        error while a file is being copied raises
+    """
+    n_files = 0
+    n_bytes = 0
+    with open_compressor(fileobj, fmt=fmt, compresslevel=compresslevel, threads=threads) as comp:
+        with tarfile.open(fileobj=comp, mode='w|', bufsize=bufsize) as tar:
+            for path in file_paths:
+                try:
+                    info = tar.gettarinfo(path, arcname=os.path.basename(path))
+                    f = open(path, 'rb')
+                except OSError as e:
+                    logger.warning("Skipping %s in bundle: %s", path, e)
+                    continue
+                # Once the header is in the stream a failed copy (file truncated or
+                # unreadable meanwhile) would shift every later member: abort instead
+                with f:
+                    tar.addfile(info, f)
+                n_files += 1
+                n_bytes += info.size
+                if progress is not None:
+                    progress(n_files, n_bytes)
+    return n_files, n_bytes
+
+
+def build_tar(file_paths, archive_path, fmt='gz', compresslevel=6, threads=None, progress=None):
+    """
+    Write the archive next to its final name and rename it into place, so a
+    concurrent download never sees a partial file.
+    """
+    part_path = f"{archive_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with open(part_path, 'wb') as f:
+            n_files, n_bytes = write_tar(file_paths, f, fmt=fmt, compresslevel=compresslevel,
+                                         threads=threads, progress=progress)
+        os.replace(part_path, archive_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return n_files, n_bytes
+
+
+##=========================
+class _QueueWriter(object):
+    """File-like sink handing written blocks to a bounded queue."""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise BrokenPipeError("Bundle stream closed by the client")
+        if data:
+            self.chunks.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def stream_tar(file_paths, fmt='gz', compresslevel=6, threads=None, max_buffered_chunks=16):
+    """
+    Generator yielding a compressed tar of file_paths block by block, for a streamed
+    HTTP response. A producer thread writes the archive; at most
+    max_buffered_chunks blocks are held in memory while the client is slower.
+    """
+    chunks = queue.Queue(maxsize=max_buffered_chunks)
+    cancelled = threading.Event()
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            write_tar(file_paths, _QueueWriter(chunks, cancelled), fmt=fmt,
+                      compresslevel=compresslevel, threads=threads)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            logger.exception("Bundle stream failed")
+            errors.append(e)
+        finally:
+            while True:
+                try:
+                    chunks.put(done, timeout=1)
+                    break
+                except queue.Full:
+                    if cancelled.is_set():
+                        break
+
+    producer = threading.Thread(target=produce, name="bundle-stream", daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        # Client went away (or we are done): stop the producer and drain the queue
+        cancelled.set()
+        while producer.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
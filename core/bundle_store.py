@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""
+    This module keeps data bundles content-addressed so they are compressed once.
+
+    A bundle is keyed by the sha256 of its sorted file list together with each
+    file's size and mtime, so any request selecting the same files (whatever
+    time range, cadence or name it came from) reuses the same archive, and a
+    reprocessed file yields a new key. Archives are stored as
+    bundle-<key>.tar.gz (or .tar.zst) and recorded in a SQLite index next to
+    them, with a hit/miss counter and last-access times for a size-bounded LRU
+    eviction.
+"""
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+archive_prefix = 'bundle-'
+archive_suffixes = {'gz': '.tar.gz', 'zst': '.tar.zst'}
+
+
+##=========================
+def bundle_key(file_stats, fmt='gz'):
+    """
+    Parameters:
+        file_stats (list): (path, size, mtime_ns) of every file in the bundle;
+            files that could not be stat'ed (size None) are left out
+        fmt (str): archive format; formats other than gz get their own keys
+
+    Returns:
+        str: hex sha256 of the sorted entries
+    """
+    h = hashlib.sha256()
+    if fmt != 'gz':
+        h.update(f"format={fmt}\n".encode())
+    for path, size, mtime_ns in sorted(s for s in file_stats if s[1] is not None):
+        h.update(f"{path}\0{size}\0{mtime_ns}\n".encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+def archive_name_for(key, fmt='gz'):
+    return f"{archive_prefix}{key}{archive_suffixes[fmt]}"
+
+
+class BundleStore(object):
+    """
+    Index of the archives in bundle_dir.
+
+    Parameters:
+        bundle_dir (str): directory holding the archives (tmp/data-request)
+        max_bytes (int): evict least recently used archives beyond this total
+        min_keep_seconds (float): never evict archives accessed more recently
+            than this, so a bundle that was just built can still be downloaded
+    """
+
+    def __init__(self, bundle_dir, max_bytes=200 * 1024 ** 3, min_keep_seconds=3600.):
+        self.bundle_dir = bundle_dir
+        self.index_path = os.path.join(bundle_dir, 'bundle_index.sqlite')
+        self.max_bytes = int(max_bytes)
+        self.min_keep_seconds = float(min_keep_seconds)
+        self._initialized = False
+
+    ##=========================
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.bundle_dir, exist_ok=True)
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archives (
+                    bundle_key TEXT PRIMARY KEY,
+                    archive_name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    n_files INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._initialized = True
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+        conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
+
+    def archive_path(self, key, fmt='gz'):
+        return os.path.join(self.bundle_dir, archive_name_for(key, fmt))
+
+    ##=========================
+    def lookup(self, key):
+        """Return the path of the archive for key (and count a hit), or None (and count a miss)."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT archive_name FROM archives WHERE bundle_key = ?", (key,)).fetchone()
+            path = os.path.join(self.bundle_dir, row['archive_name']) if row else None
+            if path and os.path.exists(path):
+                conn.execute("UPDATE archives SET last_access = ?, hits = hits + 1 WHERE bundle_key = ?",
+                             (time.time(), key))
+                self._count(conn, 'hits')
+                return path
+            if row:
+                conn.execute("DELETE FROM archives WHERE bundle_key = ?", (key,))
+            self._count(conn, 'misses')
+            return None
+        finally:
+            conn.close()
+
+    def add(self, key, n_files, fmt='gz'):
+        """Record the freshly built archive of key."""
+        name = archive_name_for(key, fmt)
+        size = os.path.getsize(os.path.join(self.bundle_dir, name))
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO archives (bundle_key, archive_name, size, n_files, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)", (key, name, size, int(n_files), now, now))
+        finally:
+            conn.close()
+
+    ##=========================
+    def evict(self, max_bytes=None, stray_age_seconds=86400., dry_run=False):
+        """
+        Remove least recently used archives until the total is below max_bytes.
+        Files not in the index (old-style archive names, stale .part files) are
+        removed once older than stray_age_seconds. Returns the removed file names.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else int(max_bytes)
+        now = time.time()
+        removed = []
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT bundle_key, archive_name, size, last_access FROM archives "
+                                "ORDER BY last_access").fetchall()
+            indexed = set()
+            total = 0
+            live = []
+            for row in rows:
+                if os.path.exists(os.path.join(self.bundle_dir, row['archive_name'])):
+                    indexed.add(row['archive_name'])
+                    total += row['size']
+                    live.append(row)
+                elif not dry_run:
+                    conn.execute("DELETE FROM archives WHERE bundle_key = ?", (row['bundle_key'],))
+
+            for row in live:
+                if total <= max_bytes:
+                    break
+                if now - row['last_access'] < self.min_keep_seconds:
+                    continue
+                removed.append(row['archive_name'])
+                total -= row['size']
+                if not dry_run:
+                    _remove(os.path.join(self.bundle_dir, row['archive_name']))
+                    conn.execute("DELETE FROM archives WHERE bundle_key = ?", (row['bundle_key'],))
+        finally:
+            conn.close()
+
+        for entry in os.scandir(self.bundle_dir):
+            if entry.name in indexed or entry.name.startswith('bundle_index.sqlite') or not entry.is_file():
+                continue
+            if now - entry.stat().st_mtime > stray_age_seconds:
+                removed.append(entry.name)
+                if not dry_run:
+                    _remove(entry.path)
+        return removed
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counters = {row['name']: row['value'] for row in conn.execute("SELECT name, value FROM counters")}
+            row = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS size FROM archives").fetchone()
+        finally:
+            conn.close()
+        return {
+            'archives': row['n'],
+            'bytes': row['size'],
+            'max_bytes': self.max_bytes,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+        }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+##=========================
+if __name__ == '__main__':
+    # python -m core.bundle_store /common/webplots/lwa-data/tmp/data-request --max-gb 200
+    parser = argparse.ArgumentParser(description="Evict least recently used data bundles")
+    parser.add_argument('bundle_dir')
+    parser.add_argument('--max-gb', type=float, default=200., help="Size budget of all archives")
+    parser.add_argument('--keep-hours', type=float, default=1., help="Never evict archives used within this time")
+    parser.add_argument('--stray-hours', type=float, default=24., help="Age after which unindexed files are removed")
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--stats', action='store_true', help="Print the index stats and exit")
+    args = parser.parse_args()
+
+    store = BundleStore(args.bundle_dir, max_bytes=args.max_gb * 1024 ** 3, min_keep_seconds=args.keep_hours * 3600)
+    if args.stats:
+        print(store.stats())
+        sys.exit(0)
+    for name in store.evict(stray_age_seconds=args.stray_hours * 3600, dry_run=args.dry_run):
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {name}")
+    print(store.stats())
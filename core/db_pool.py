@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""
+    This module keeps a process-wide pool of MySQL connections.
+
+    Each gunicorn worker gets its own pool (the pool is rebuilt after a fork),
+    connections are pinged before reuse and transparently replaced when stale.
+    Pool size and timeouts are read from the environment:
+
+        FLARE_DB_POOL_SIZE        max connections per process (default 4)
+        FLARE_DB_POOL_TIMEOUT     seconds to wait for a free connection (default 10)
+        FLARE_DB_POOL_PING_AFTER  ping idle connections older than this (default 0, always)
+        FLARE_DB_POOL_STATS_EVERY log pool stats at most every N seconds (default 300)
+"""
+import os
+import time
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class LwaConnectionPool(object):
+    """
+    A small blocking connection pool.
+
+    Parameters:
+        factory (callable): returns a new, open MySQL connection
+        pool_size (int): maximum number of connections held by this process
+        timeout (float): seconds to wait for a connection before raising PoolError
+        ping_after (float): idle seconds after which a connection is pinged before reuse
+        stats_every (float): minimum seconds between two pool stats log lines
+    """
+
+    def __init__(self, factory, pool_size=4, timeout=10., ping_after=0., stats_every=300.):
+        self.factory = factory
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = float(timeout)
+        self.ping_after = float(ping_after)
+        self.stats_every = float(stats_every)
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_release_time)
+        self._open = 0
+        self._checked_out = 0
+        self._last_stats_log = time.monotonic()
+        self._counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'total_wait_s': 0.,
+            'max_wait_s': 0.,
+        }
+
+    ##=========================
+    def _checkout(self):
+        t0 = time.monotonic()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.pool_size:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - t0)
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolError(
+                        f"No MySQL connection available after {self.timeout:.1f} s "
+                        f"(pool_size={self.pool_size}, checked_out={self._checked_out})"
+                    )
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._open += 1
+            self._checked_out += 1
+            wait_s = time.monotonic() - t0
+            self._counters['checkouts'] += 1
+            self._counters['total_wait_s'] += wait_s
+            self._counters['max_wait_s'] = max(self._counters['max_wait_s'], wait_s)
+            if waited:
+                self._counters['waits'] += 1
+
+        try:
+            if conn is None:
+                conn = self._create()
+            elif time.monotonic() - last_used >= self.ping_after:
+                conn = self._revalidate(conn)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+        self._maybe_log_stats()
+        return conn
+
+    def _create(self):
+        conn = self.factory()
+        with self._cond:
+            self._counters['created'] += 1
+        return conn
+
+    def _revalidate(self, conn):
+        """Ping a reused connection and replace it if the server dropped it."""
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except mysql.connector.Error as e:
+            logger.info("Stale MySQL connection (%s); reconnecting", e)
+            _close_quietly(conn)
+            with self._cond:
+                self._counters['reconnects'] += 1
+            return self._create()
+
+    def _release(self, conn, discard=False):
+        with self._cond:
+            self._checked_out -= 1
+            if discard:
+                self._open -= 1
+                self._counters['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            _close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a ``with`` block.
+
+        Connections that raised a MySQL interface/operational error are closed
+        instead of being returned to the pool.
+        """
+        conn = self._checkout()
+        discard = False
+        try:
+            yield conn
+        except (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError):
+            discard = True
+            raise
+        finally:
+            if not discard:
+                try:
+                    # End any implicit transaction so the next borrower sees fresh data
+                    conn.rollback()
+                except mysql.connector.Error:
+                    discard = True
+            self._release(conn, discard=discard)
+
+    ##=========================
+    def stats(self):
+        """Return a snapshot of the pool state and cumulative wait statistics."""
+        with self._cond:
+            counters = dict(self._counters)
+            checkouts = counters['checkouts']
+            counters.update({
+                'pid': os.getpid(),
+                'pool_size': self.pool_size,
+                'open': self._open,
+                'checked_out': self._checked_out,
+                'idle': len(self._idle),
+                'avg_wait_ms': 1000. * counters['total_wait_s'] / checkouts if checkouts else 0.,
+                'max_wait_ms': 1000. * counters['max_wait_s'],
+            })
+        return counters
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log < self.stats_every:
+            return
+        self._last_stats_log = now
+        s = self.stats()
+        logger.info(
+            "MySQL pool pid=%d: checked_out=%d idle=%d open=%d/%d checkouts=%d waits=%d "
+            "timeouts=%d avg_wait=%.2f ms max_wait=%.2f ms reconnects=%d",
+            s['pid'], s['checked_out'], s['idle'], s['open'], s['pool_size'], s['checkouts'],
+            s['waits'], s['timeouts'], s['avg_wait_ms'], s['max_wait_ms'], s['reconnects']
+        )
+
+    def close(self):
+        """Close all idle connections."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+##=========================
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(factory):
+    """
+    Return the pool of the current process, creating it on first use.
+
+    A pool inherited through fork() (gunicorn preload) is dropped without
+    closing its sockets, which still belong to the parent.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = LwaConnectionPool(
+                factory,
+                pool_size=int(os.getenv('FLARE_DB_POOL_SIZE', 4)),
+                timeout=float(os.getenv('FLARE_DB_POOL_TIMEOUT', 10)),
+                ping_after=float(os.getenv('FLARE_DB_POOL_PING_AFTER', 0)),
+                stats_every=float(os.getenv('FLARE_DB_POOL_STATS_EVERY', 300)),
+            )
+            _pool_pid = pid
+            logger.info("Created MySQL pool for pid %d (size=%d)", pid, _pool.pool_size)
+    return _pool
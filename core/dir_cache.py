@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+    This module caches directory listings and file stats of the NFS data disks.
+
+    Entries are grouped by directory and revalidated with a single stat of the
+    directory: files are added, removed or replaced (rename into place) only by
+    changing the directory, so while its mtime is unchanged the cached names and
+    file stats are reused. A directory is re-checked at most every
+    revalidate_every seconds. Files rewritten in place (same inode) are not
+    detected until the directory changes; the data pipeline never does that.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+##=========================
+class _DirEntry(object):
+    __slots__ = ('mtime_ns', 'checked_at', 'names', 'stats')
+
+    def __init__(self, mtime_ns, checked_at):
+        self.mtime_ns = mtime_ns
+        self.checked_at = checked_at
+        self.names = None   # frozenset of entry names, filled by listdir()
+        self.stats = {}     # name -> (size, mtime_ns) or None if missing
+
+
+class DirCache(object):
+    """
+    Parameters:
+        revalidate_every (float): seconds a directory mtime is trusted without a new stat
+        max_dirs (int): directories kept, least recently used are dropped
+    """
+
+    def __init__(self, revalidate_every=30., max_dirs=4096):
+        self.revalidate_every = float(revalidate_every)
+        self.max_dirs = int(max_dirs)
+        self._lock = threading.Lock()
+        self._dirs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dir_stats = 0
+
+    def _entry(self, dirpath):
+        """Current entry of dirpath, revalidated against its mtime; None if it does not exist."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._dirs.get(dirpath)
+            if entry is not None and now - entry.checked_at < self.revalidate_every:
+                self._dirs.move_to_end(dirpath)
+                return entry
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self._lock:
+            self.dir_stats += 1
+            entry = self._dirs.get(dirpath)
+            if entry is None or entry.mtime_ns != mtime_ns:
+                entry = _DirEntry(mtime_ns, now)
+                self._dirs[dirpath] = entry
+                while len(self._dirs) > self.max_dirs:
+                    self._dirs.popitem(last=False)
+            else:
+                entry.checked_at = now
+            self._dirs.move_to_end(dirpath)
+        return entry if mtime_ns is not None else None
+
+    ##=========================
+    def listdir(self, dirpath):
+        """frozenset of the names in dirpath (empty if it does not exist)."""
+        entry = self._entry(dirpath)
+        if entry is None:
+            return frozenset()
+        names = entry.names
+        if names is not None:
+            self.hits += 1
+            return names
+        self.misses += 1
+        try:
+            names = frozenset(os.listdir(dirpath))
+        except OSError:
+            names = frozenset()
+        entry.names = names
+        return names
+
+    def exists(self, path):
+        dirpath, name = os.path.split(path)
+        return name in self.listdir(dirpath)
+
+    def stat(self, path):
+        """(size, mtime_ns) of path, or None if it cannot be stat'ed."""
+        dirpath, name = os.path.split(path)
+        entry = self._entry(dirpath)
+        if entry is None:
+            return None
+        if name in entry.stats:
+            self.hits += 1
+            return entry.stats[name]
+        self.misses += 1
+        try:
+            st = os.stat(path)
+            result = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            result = None
+        entry.stats[name] = result
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'dirs': len(self._dirs),
+                'hits': self.hits,
+                'misses': self.misses,
+                'dir_stats': self.dir_stats,
+            }
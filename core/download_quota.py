@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+"""
+    This module keeps the per-IP daily download quota in SQLite (WAL mode).
+
+    One row per (IP, UTC day) holds the number of bundles and the MB requested.
+    check_and_record() reads and increments that row inside a single
+    BEGIN IMMEDIATE transaction, so concurrent gunicorn workers cannot both
+    pass the limit or lose an update; the lookup is a primary key probe, so it
+    costs the same no matter how much history is kept. Days older than
+    keep_days are deleted automatically once per day.
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+day_format = "%Y-%m-%d"
+
+
+def utc_today():
+    return datetime.utcnow().strftime(day_format)
+
+
+##=========================
+class DownloadQuota(object):
+    """
+    Parameters:
+        db_path (str): SQLite file shared by all web workers
+        keep_days (int): days of history kept before automatic expiry
+        legacy_json_path (str): former JSON download log, imported once when
+            the database is created
+    """
+
+    def __init__(self, db_path, keep_days=30, legacy_json_path=None):
+        self.db_path = db_path
+        self.keep_days = int(keep_days)
+        self.legacy_json_path = legacy_json_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._initialized = False
+        self._expired_on = None
+
+    def _connect(self):
+        """Connection of the calling thread, kept open: reopening (and the WAL
+        checkpoint on closing) would cost far more than the quota query itself."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        # WAL commits then skip the fsync; a power cut can only lose the last few downloads
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    self._init_db(conn)
+                    self._initialized = True
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            created = conn.execute("SELECT name FROM sqlite_master WHERE name = 'downloads'").fetchone() is None
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    ip TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    size_mb REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (ip, day)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_downloads_day ON downloads (day)")
+            if created and self.legacy_json_path and os.path.exists(self.legacy_json_path):
+                n = self._import_json(conn, self.legacy_json_path)
+                logger.info("Imported %d download log entries from %s", n, self.legacy_json_path)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _add(conn, ip, day, count, size_mb):
+        conn.execute("INSERT OR IGNORE INTO downloads (ip, day, count, size_mb) VALUES (?, ?, 0, 0)", (ip, day))
+        conn.execute("UPDATE downloads SET count = count + ?, size_mb = size_mb + ? WHERE ip = ? AND day = ?",
+                     (int(count), float(size_mb), ip, day))
+
+    ##=========================
+    def usage(self, ip, day=None):
+        """Return (count, size_mb) recorded for ip on day (default: today, UTC)."""
+        conn = self._connect()
+        row = conn.execute("SELECT count, size_mb FROM downloads WHERE ip = ? AND day = ?",
+                           (ip, day or utc_today())).fetchone()
+        return (row[0], row[1]) if row else (0, 0.)
+
+    def check_and_record(self, ip, size_mb, max_downloads, max_total_MB):
+        """
+        Atomically check today's quota of ip and, if the request fits, record it.
+
+        Returns:
+            (allowed, count, size_mb): the decision and the usage of today
+            before this request
+        """
+        day = utc_today()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT count, size_mb FROM downloads WHERE ip = ? AND day = ?",
+                               (ip, day)).fetchone()
+            count, used_mb = (row[0], row[1]) if row else (0, 0.)
+            allowed = count < max_downloads and used_mb + size_mb <= max_total_MB
+            if allowed:
+                self._add(conn, ip, day, 1, size_mb)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if self._expired_on != day:
+            self._expired_on = day
+            self.expire()
+        return allowed, count, used_mb
+
+    def expire(self, keep_days=None):
+        """Delete days older than keep_days; returns the number of rows removed."""
+        keep_days = self.keep_days if keep_days is None else int(keep_days)
+        cutoff = (datetime.utcnow() - timedelta(days=keep_days)).strftime(day_format)
+        conn = self._connect()
+        return conn.execute("DELETE FROM downloads WHERE day < ?", (cutoff,)).rowcount
+
+    ##=========================
+    def top(self, day=None, limit=20):
+        """[(ip, count, size_mb)] of the heaviest users on day, largest volume first."""
+        conn = self._connect()
+        return conn.execute("SELECT ip, count, size_mb FROM downloads WHERE day = ? "
+                            "ORDER BY size_mb DESC LIMIT ?", (day or utc_today(), int(limit))).fetchall()
+
+    def history(self, ip):
+        """[(day, count, size_mb)] of ip, newest first."""
+        conn = self._connect()
+        return conn.execute("SELECT day, count, size_mb FROM downloads WHERE ip = ? ORDER BY day DESC",
+                            (ip,)).fetchall()
+
+    def reset(self, ip, day=None):
+        """Clear the usage of ip on day (default: today), e.g. to lift a limit by hand."""
+        conn = self._connect()
+        return conn.execute("DELETE FROM downloads WHERE ip = ? AND day = ?",
+                            (ip, day or utc_today())).rowcount
+
+    def import_json(self, json_path):
+        """Add the entries of a former JSON download log ({ip: {day: {count, size}}})."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            n = self._import_json(conn, json_path)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return n
+
+    def _import_json(self, conn, json_path):
+        with open(json_path, 'r') as f:
+            log = json.load(f)
+        n = 0
+        for ip, days in log.items():
+            for day, entry in days.items():
+                self._add(conn, ip, day, entry.get('count', 0), entry.get('size', 0))
+                n += 1
+        return n
+
+
+##=========================
+if __name__ == '__main__':
+    # python -m core.download_quota /home/xychen/lwadata-query-web-utils/lwa_user_downloads.sqlite top
+    parser = argparse.ArgumentParser(description="Query and administer the download quota store")
+    parser.add_argument('db_path')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('top', help="Heaviest users of a day")
+    p.add_argument('--day', help="YYYY-MM-DD (default: today, UTC)")
+    p.add_argument('--limit', type=int, default=20)
+    p = sub.add_parser('ip', help="Download history of one IP")
+    p.add_argument('ip')
+    p = sub.add_parser('reset', help="Clear the usage of an IP for a day")
+    p.add_argument('ip')
+    p.add_argument('--day', help="YYYY-MM-DD (default: today, UTC)")
+    p = sub.add_parser('expire', help="Delete old days now")
+    p.add_argument('--keep-days', type=int, default=30)
+    p = sub.add_parser('import', help="Import a former JSON download log")
+    p.add_argument('json_path')
+    args = parser.parse_args()
+
+    quota = DownloadQuota(args.db_path)
+    if args.command == 'top':
+        for ip, count, size_mb in quota.top(args.day, args.limit):
+            print(f"{ip:<40} {count:>5d} {size_mb:>10.1f} MB")
+    elif args.command == 'ip':
+        for day, count, size_mb in quota.history(args.ip):
+            print(f"{day} {count:>5d} {size_mb:>10.1f} MB")
+    elif args.command == 'reset':
+        print(f"Removed {quota.reset(args.ip, args.day)} row(s)")
+    elif args.command == 'expire':
+        print(f"Removed {quota.expire(args.keep_days)} row(s)")
+    elif args.command == 'import':
+        print(f"Imported {quota.import_json(args.json_path)} entries")
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""
+    This module reports files newly written into a set of directories.
+
+    InotifyWatcher uses the optional inotify_simple package and reports a file
+    once it is closed after writing or renamed into place. inotify only sees
+    changes made by this host, so directories on NFS/CIFS mounts written by
+    other machines need PollingWatcher, which re-lists a directory only when its
+    mtime changed and reports files once their mtime is settle_seconds old.
+    open_watcher() picks the right one.
+
+    watch(dirs) sets the watched directories ({dirpath: [fnmatch patterns]})
+    and can be called again at any time (e.g. when a new day directory
+    appears); poll(timeout) returns the paths of the new files.
+"""
+import os
+import time
+import logging
+from fnmatch import fnmatch
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+logger = logging.getLogger(__name__)
+
+network_fs_types = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', 'lustre', 'gpfs', 'ceph', 'glusterfs')
+
+
+##=========================
+def fs_type(path):
+    """Filesystem type of the mount holding path, from /proc/mounts (None if unknown)."""
+    path = os.path.realpath(path)
+    best, best_type = '', None
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                prefix = mount_point.rstrip('/') + '/'
+                if (path == mount_point or path.startswith(prefix)) and len(mount_point) > len(best):
+                    best, best_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+def is_network_fs(path):
+    fstype = fs_type(path) or ''
+    return fstype in network_fs_types or fstype.startswith('fuse.')
+
+
+def _matches(name, patterns):
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+def _list_matching(dirpath, patterns):
+    try:
+        with os.scandir(dirpath) as it:
+            return [entry.path for entry in it if _matches(entry.name, patterns)]
+    except FileNotFoundError:
+        return []
+
+
+##=========================
+class PollingWatcher(object):
+    """
+    Parameters:
+        interval (float): seconds between directory checks
+        settle_seconds (float): age a file's mtime must reach before it is
+            reported, so files still being written are picked up later
+    """
+    kind = 'poll'
+
+    def __init__(self, interval=10., settle_seconds=5.):
+        self.interval = float(interval)
+        self.settle_seconds = float(settle_seconds)
+        self._dirs = {}      # dirpath -> patterns
+        self._mtimes = {}    # dirpath -> mtime_ns at the last listing
+        self._seen = {}      # dirpath -> set of names already reported (or present at start)
+        self._pending = {}   # path -> dirpath, listed but not settled yet
+        self._next_check = 0.
+
+    def watch(self, dirs, report_existing=True):
+        """Set the watched directories; files already in a newly added directory
+        are reported by the next poll() unless report_existing is False."""
+        for dirpath in list(self._dirs):
+            if dirpath not in dirs:
+                del self._dirs[dirpath]
+                self._mtimes.pop(dirpath, None)
+                self._seen.pop(dirpath, None)
+        for dirpath, patterns in dirs.items():
+            if dirpath in self._dirs:
+                self._dirs[dirpath] = list(patterns)
+                continue
+            self._dirs[dirpath] = list(patterns)
+            if not report_existing and os.path.isdir(dirpath):
+                self._mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+                self._seen[dirpath] = {os.path.basename(p) for p in _list_matching(dirpath, patterns)}
+            else:
+                self._seen[dirpath] = set()
+
+    def poll(self, timeout=None):
+        """Wait until the next check is due (at most timeout seconds) and return the new paths."""
+        wait = self._next_check - time.monotonic()
+        if wait > 0:
+            if timeout is not None and timeout < wait:
+                time.sleep(timeout)
+                return []
+            time.sleep(wait)
+        self._next_check = time.monotonic() + self.interval
+
+        candidates = dict(self._pending)
+        for dirpath, patterns in self._dirs.items():
+            try:
+                mtime_ns = os.stat(dirpath).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if self._mtimes.get(dirpath) == mtime_ns:
+                continue
+            self._mtimes[dirpath] = mtime_ns
+            seen = self._seen[dirpath]
+            for path in _list_matching(dirpath, patterns):
+                if os.path.basename(path) not in seen:
+                    candidates[path] = dirpath
+
+        new_paths = []
+        self._pending = {}
+        cutoff_ns = int((time.time() - self.settle_seconds) * 1e9)
+        for path, dirpath in candidates.items():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_mtime_ns > cutoff_ns:
+                self._pending[path] = dirpath
+                continue
+            if dirpath in self._seen:
+                self._seen[dirpath].add(os.path.basename(path))
+                new_paths.append(path)
+        return new_paths
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Reports files on IN_CLOSE_WRITE / IN_MOVED_TO; needs inotify_simple."""
+    kind = 'inotify'
+
+    def __init__(self):
+        if inotify_simple is None:
+            raise RuntimeError("inotify_simple is not installed")
+        self._inotify = inotify_simple.INotify()
+        self._mask = inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO
+        self._dirs = {}      # dirpath -> patterns
+        self._wds = {}       # wd -> dirpath
+        self._backlog = []   # paths found outside events (new directories, queue overflow)
+
+    def watch(self, dirs, report_existing=True):
+        """Set the watched directories; directories that do not exist yet are
+        retried on the next call. Files already in a newly watched directory
+        are reported by the next poll() unless report_existing is False."""
+        for wd, dirpath in list(self._wds.items()):
+            if dirpath not in dirs:
+                try:
+                    self._inotify.rm_watch(wd)
+                except OSError:
+                    pass
+                del self._wds[wd]
+                self._dirs.pop(dirpath, None)
+        watched = set(self._wds.values())
+        for dirpath, patterns in dirs.items():
+            self._dirs[dirpath] = list(patterns)
+            if dirpath in watched:
+                continue
+            try:
+                wd = self._inotify.add_watch(dirpath, self._mask)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            self._wds[wd] = dirpath
+            if report_existing:
+                # Written before the watch existed
+                self._backlog.extend(_list_matching(dirpath, patterns))
+
+    def poll(self, timeout=None):
+        """Return the new paths, waiting at most timeout seconds for events."""
+        if self._backlog:
+            paths, self._backlog = self._backlog, []
+            return paths
+        events = self._inotify.read(timeout=None if timeout is None else int(timeout * 1000))
+        paths = []
+        for event in events:
+            if event.mask & inotify_simple.flags.Q_OVERFLOW:
+                # Events were dropped: report everything, duplicates are ignored downstream
+                logger.warning("inotify queue overflow, re-listing %d directories", len(self._wds))
+                for dirpath in self._wds.values():
+                    paths.extend(_list_matching(dirpath, self._dirs[dirpath]))
+                continue
+            if event.mask & inotify_simple.flags.IGNORED:
+                # Directory removed; watch() adds it again if it comes back
+                self._wds.pop(event.wd, None)
+                continue
+            dirpath = self._wds.get(event.wd)
+            if dirpath and event.name and _matches(event.name, self._dirs[dirpath]):
+                paths.append(os.path.join(dirpath, event.name))
+        return paths
+
+    def close(self):
+        self._inotify.close()
+
+
+def open_watcher(dirpaths, mode='auto', interval=10., settle_seconds=5.):
+    """
+    Parameters:
+        dirpaths: directories (or their parents, if not created yet) to be watched
+        mode (str): 'inotify', 'poll' or 'auto' (inotify if installed and none
+            of dirpaths is on a network filesystem)
+    """
+    if mode == 'auto':
+        local = not any(is_network_fs(_existing_parent(p)) for p in dirpaths)
+        mode = 'inotify' if inotify_simple is not None and local else 'poll'
+    if mode == 'inotify':
+        return InotifyWatcher()
+    return PollingWatcher(interval=interval, settle_seconds=settle_seconds)
+
+
+def _existing_parent(path):
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path or '/'
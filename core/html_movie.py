@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+    This module writes the HTML movie pages (a JavaScript player over a list of PNGs).
+
+    The player template is read and split once into the text before and after
+    its urls[] block plus the few lines that depend on the frames (number of
+    frames, image and frame size); it is re-read only when its mtime changes.
+    Image sizes come from the PNG IHDR header. Pages are named by a hash of
+    their frames and template version, so the same selection reuses its page.
+"""
+import os
+import time
+import struct
+import hashlib
+import threading
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+
+##=========================
+def png_size(path):
+    """(width, height) of a PNG from its IHDR chunk (first 24 bytes), without decoding it."""
+    with open(path, 'rb') as f:
+        head = f.read(24)
+    if len(head) < 24 or head[:8] != png_signature or head[12:16] != b'IHDR':
+        raise ValueError(f"Not a PNG file: {path}")
+    return struct.unpack('>II', head[16:24])
+
+
+class HtmlMovieTemplate(object):
+    """
+    Parameters:
+        path (str): player template with 'var imax', 'var iwidth', 'NAME=animation'
+            and 'urls[' lines
+        revalidate_every (float): seconds the template mtime is trusted without a new stat
+    """
+
+    def __init__(self, path, revalidate_every=60.):
+        self.path = path
+        self.revalidate_every = float(revalidate_every)
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self._checked_at = 0.
+        self._head = None
+        self._tail = None
+
+    def _compile(self, lines):
+        """Split the template into head and tail parts: fixed text, or (kind, line) to fill in."""
+        skiplines = [i for i, line in enumerate(lines) if 'urls[' in line]
+        if len(skiplines) < 2:
+            raise ValueError(f"No urls[] block in the movie template {self.path}")
+
+        def parts(selected):
+            out = []
+            for line in selected:
+                if 'NAME=animation' in line:
+                    out.append(('frame', line))
+                elif 'var iwidth' in line:
+                    out.append(('size', line))
+                elif 'var imax' in line:
+                    out.append(('imax', line))
+                elif out and isinstance(out[-1], str):
+                    out[-1] += line
+                else:
+                    out.append(line)
+            return out
+
+        return parts(lines[:skiplines[1] - 1]), parts(lines[skiplines[-1] + 1:])
+
+    def load(self):
+        """Compiled (head, tail, mtime_ns), re-read if the template file changed."""
+        now = time.monotonic()
+        with self._lock:
+            if self._head is not None and now - self._checked_at < self.revalidate_every:
+                return self._head, self._tail, self._mtime_ns
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if mtime_ns != self._mtime_ns:
+                with open(self.path, 'r') as f:
+                    self._head, self._tail = self._compile(f.readlines())
+                self._mtime_ns = mtime_ns
+            self._checked_at = now
+            return self._head, self._tail, self._mtime_ns
+
+    @staticmethod
+    def _fill(parts, nfiles, xsize, ysize):
+        out = []
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            kind, line = part
+            if kind == 'imax':
+                # Set number of frames
+                out.append(line[:10] + '{:3d}'.format(nfiles) + line[13:])
+            elif kind == 'size':
+                # Set width and height of images
+                out.append('var iwidth = {:d}, iheight = {:d};\n'.format(xsize, ysize))
+            else:
+                # Set width and height of frame, reduced for overly large images
+                if xsize > 1125:
+                    xfsize, yfsize = xsize * 3 // 4, ysize * 3 // 4
+                else:
+                    xfsize, yfsize = xsize, ysize
+                out.append('<img NAME=animation ALT="FRAME" width=' + str(xfsize) + ' height=' + str(yfsize) + '>')
+        return out
+
+    def render(self, urls, xsize, ysize):
+        head, tail, _ = self.load()
+        nfiles = len(urls)
+        body = [f'urls[{i:d}]=url_path+"/{url}";\n' for i, url in enumerate(urls)]
+        return "".join(self._fill(head, nfiles, xsize, ysize) + body + self._fill(tail, nfiles, xsize, ysize))
+
+
+##=========================
+def write_html_movie(png_paths, output_dir, template, name_prefix='movie'):
+    """
+    Write (or reuse) the movie page of png_paths in output_dir.
+
+    Returns:
+        (html_filename, reused, timings): timings maps each stage to seconds
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    files = sorted(png_paths)
+    rel_paths = [os.path.relpath(f, output_dir) for f in files]
+    _, _, template_mtime_ns = template.load()
+    t1 = time.perf_counter()
+    timings['template'] = t1 - t0
+
+    h = hashlib.sha256(f"{template.path}\0{template_mtime_ns}\n".encode())
+    for rel_path in rel_paths:
+        h.update(rel_path.encode('utf-8', 'surrogateescape') + b'\n')
+    fname = os.path.basename(files[0])
+    if "T" not in fname:
+        raise ValueError("Filename missing timestamp.")
+    date_str = fname.split("T")[0].split(".")[-1]  # e.g., 2025-05-10
+    timestamp_part = fname.split("T")[1].split("Z")[0]
+    html_filename = f"{name_prefix}_{date_str}T{timestamp_part}Z_{h.hexdigest()[:16]}.html"
+    html_path = os.path.join(output_dir, html_filename)
+    reused = os.path.exists(html_path)
+    t2 = time.perf_counter()
+    timings['lookup'] = t2 - t1
+    if reused:
+        # Keep it from the tmp cleanup while it is being used
+        os.utime(html_path)
+        return html_filename, True, timings
+
+    xsize, ysize = png_size(files[0])
+    t3 = time.perf_counter()
+    timings['png_size'] = t3 - t2
+    html = template.render(rel_paths, xsize, ysize)
+    t4 = time.perf_counter()
+    timings['render'] = t4 - t3
+    tmp_path = f"{html_path}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(tmp_path, 'w') as f:
+        f.write(html)
+    os.replace(tmp_path, html_path)
+    timings['write'] = time.perf_counter() - t4
+    return html_filename, False, timings
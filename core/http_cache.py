@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+    This module adds HTTP caching headers and conditional GETs to Flask views.
+
+    A view wrapped by conditional_cache() gets an ETag and a Cache-Control
+    header. When the ETag can be derived from the request alone (route,
+    parameters and the metadata version bumped by utils/lwadata2sql.py), a
+    request whose If-None-Match matches is answered 304 before the view runs;
+    otherwise the ETag is a hash of the response body. Ranges that ended before
+    the recent days, which the ingest no longer touches, may be kept by
+    browsers and proxies for past_max_age seconds without asking again; recent
+    ones are revalidated on every use.
+"""
+import json
+import hashlib
+from functools import wraps
+from datetime import datetime, timedelta
+
+from flask import request, make_response
+
+
+##=========================
+def parse_param_time(value):
+    """datetime of an ISO time parameter ('2025-05-10T12:00:00', trailing Z allowed), or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.strip().rstrip('Z').replace(' ', 'T'))
+    except ValueError:
+        return None
+
+
+def cache_control_for(latest, past_max_age=86400, recent_days=1, now=None):
+    """
+    Cache-Control for data up to latest (datetime, UTC): public with max-age
+    past_max_age if latest is before midnight of recent_days ago, otherwise
+    public but revalidated on every use. Unknown times count as recent.
+    """
+    now = now or datetime.utcnow()
+    recent_from = datetime(now.year, now.month, now.day) - timedelta(days=recent_days)
+    if latest is not None and latest < recent_from:
+        return f"public, max-age={int(past_max_age)}"
+    return "public, no-cache"
+
+
+def request_etag(path, params, version):
+    h = hashlib.sha256(f"{path}\0{json.dumps(params, sort_keys=True)}\0{version}".encode())
+    return h.hexdigest()[:32]
+
+
+def conditional_cache(params, time_params=('start', 'end'), version=None, past_max_age=86400, recent_days=1,
+                      stats=None):
+    """
+    Decorator for views answering GET (and POST) requests.
+
+    Parameters:
+        params (tuple): request values the response depends on
+        time_params (tuple): values holding the times covered; the latest one
+            decides between the long and the revalidated Cache-Control
+        version (callable): returns the current data version; without it the
+            ETag is a hash of the response body
+        stats (dict): if given, counts 'not_modified' and 'full' responses
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            values = {k: request.values.get(k) for k in params}
+            times = [t for t in (parse_param_time(values.get(k)) for k in time_params) if t is not None]
+            cache_control = cache_control_for(max(times) if times else None, past_max_age, recent_days)
+            conditional = request.method in ('GET', 'HEAD')
+
+            etag = None
+            if version is not None:
+                etag = request_etag(request.path, values, version())
+                if conditional and request.if_none_match.contains_weak(etag):
+                    response = make_response('', 304)
+                    response.set_etag(etag)
+                    response.headers['Cache-Control'] = cache_control
+                    if stats is not None:
+                        stats['not_modified'] = stats.get('not_modified', 0) + 1
+                    return response
+
+            response = make_response(func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag or hashlib.sha256(response.get_data()).hexdigest()[:32])
+            response.headers['Cache-Control'] = cache_control
+            if conditional:
+                response.make_conditional(request)
+            if stats is not None:
+                key = 'not_modified' if response.status_code == 304 else 'full'
+                stats[key] = stats.get(key, 0) + 1
+            return response
+        return wrapper
+    return decorator
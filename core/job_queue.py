@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""
+    This module runs long requests (data bundles, movies) as background jobs.
+
+    Jobs execute on a small pool of worker threads inside the web process and
+    are fed through a bounded queue. Their state lives in a SQLite table (WAL
+    mode) so any gunicorn worker can answer polls and cancel requests:
+
+        queued -> running -> done | failed | cancelled
+
+    Cancellation is cooperative: the job function calls ctx.check_cancelled()
+    (or ctx.progress()) between units of work. Jobs whose owner process died
+    are reported as failed the next time they are looked at.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+job_states = ('queued', 'running', 'done', 'failed', 'cancelled')
+finished_states = ('done', 'failed', 'cancelled')
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when the bounded queue of this process is full."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function once its cancellation was requested."""
+
+
+##=========================
+class JobContext(object):
+    """Handle passed to job functions for progress reports and cancellation checks."""
+
+    def __init__(self, jobs, job_id, progress_every=1.):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.progress_every = progress_every
+        self._last_write = 0.
+        self.files_done = 0
+        self.bytes_done = 0
+
+    def check_cancelled(self):
+        if self.jobs._cancel_requested(self.job_id):
+            raise JobCancelled(self.job_id)
+
+    def progress(self, files_done, bytes_done, force=False):
+        """Record progress (throttled) and raise JobCancelled if a cancel is pending."""
+        self.files_done = files_done
+        self.bytes_done = bytes_done
+        now = time.monotonic()
+        if not force and now - self._last_write < self.progress_every:
+            return
+        self._last_write = now
+        self.jobs._update(self.job_id, files_done=files_done, bytes_done=bytes_done)
+        self.check_cancelled()
+
+
+class JobQueue(object):
+    """
+    Parameters:
+        db_path (str): SQLite file holding the job table (shared by all workers)
+        workers (int): worker threads per process
+        max_queued (int): jobs waiting in this process before submit() refuses
+        keep_days (float): finished jobs older than this are purged
+    """
+
+    def __init__(self, db_path, workers=2, max_queued=32, keep_days=7.):
+        self.db_path = db_path
+        self.workers = max(1, int(workers))
+        self.max_queued = max(1, int(max_queued))
+        self.keep_days = float(keep_days)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self._init_db()
+
+    ##=========================
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    owner_pid INTEGER,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    files_total INTEGER DEFAULT 0,
+                    files_done INTEGER DEFAULT 0,
+                    bytes_total INTEGER DEFAULT 0,
+                    bytes_done INTEGER DEFAULT 0,
+                    cancel_requested INTEGER DEFAULT 0,
+                    params TEXT,
+                    result TEXT,
+                    error TEXT,
+                    dedup_key TEXT
+                )
+            """)
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'dedup_key' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN dedup_key TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (kind, dedup_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished)")
+            conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                         (time.time() - self.keep_days * 86400,))
+        finally:
+            conn.close()
+
+    def _update(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {cols} WHERE job_id = ?", list(fields.values()) + [job_id])
+        finally:
+            conn.close()
+
+    def _cancel_requested(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return bool(row and row['cancel_requested'])
+
+    ##=========================
+    def _ensure_workers(self):
+        """Start the worker threads of this process (again after a fork)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queued)
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+            self._pid = pid
+
+    def _worker(self):
+        while True:
+            job_id, func = self._queue.get()
+            try:
+                self._run(job_id, func)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id, func):
+        if self._cancel_requested(job_id):
+            self._update(job_id, state='cancelled', finished=time.time())
+            return
+        self._update(job_id, state='running', started=time.time())
+        ctx = JobContext(self, job_id)
+        try:
+            result = func(ctx)
+        except JobCancelled:
+            logger.info("Job %s cancelled", job_id)
+            self._update(job_id, state='cancelled', finished=time.time())
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._update(job_id, state='failed', finished=time.time(), error=str(e))
+        else:
+            self._update(job_id, state='done', finished=time.time(), result=json.dumps(result),
+                         files_done=ctx.files_done, bytes_done=ctx.bytes_done)
+            logger.info("Job %s done", job_id)
+
+    ##=========================
+    def find_active(self, kind, dedup_key):
+        """Return the id of a queued or running job of kind with dedup_key, or None."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT job_id FROM jobs WHERE kind = ? AND dedup_key = ? "
+                                "AND state IN ('queued', 'running') AND cancel_requested = 0 "
+                                "ORDER BY created", (kind, dedup_key)).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            job = self.get(row['job_id'])
+            if job['state'] in ('queued', 'running'):
+                return job['job_id']
+        return None
+
+    def submit(self, kind, func, params=None, files_total=0, bytes_total=0, dedup_key=None):
+        """
+        Queue func(ctx) for background execution and return the new job id.
+        The return value of func must be JSON serializable; it becomes job['result'].
+        dedup_key tags the job so find_active() can hand identical requests the same job.
+        """
+        self._ensure_workers()
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, state, owner_pid, created, files_total, bytes_total, params, dedup_key) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, os.getpid(), time.time(), int(files_total), int(bytes_total),
+                 json.dumps(params or {}), dedup_key)
+            )
+        finally:
+            conn.close()
+        try:
+            self._queue.put_nowait((job_id, func))
+        except queue.Full:
+            self._update(job_id, state='failed', finished=time.time(), error="Job queue is full")
+            raise JobQueueFull(f"Too many queued jobs ({self.max_queued}); please retry later.")
+        return job_id
+
+    def complete(self, kind, result, params=None, files_total=0, bytes_total=0):
+        """Record a job that needed no work (e.g. the archive already exists) as done."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, state, owner_pid, created, started, finished, files_total, "
+                "files_done, bytes_total, bytes_done, params, result) VALUES (?, ?, 'done', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, os.getpid(), now, now, now, int(files_total), int(files_total),
+                 int(bytes_total), int(bytes_total), json.dumps(params or {}), json.dumps(result))
+            )
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict (result decoded), or None if unknown."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['state'] not in finished_states and not _pid_alive(job['owner_pid']):
+            self._update(job_id, state='failed', finished=time.time(), error="Worker process restarted")
+            job.update(state='failed', error="Worker process restarted")
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        return job
+
+    def cancel(self, job_id):
+        """Request cancellation; queued jobs are cancelled immediately. Returns the new state."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+            conn.execute("UPDATE jobs SET state = 'cancelled', finished = ? WHERE job_id = ? AND state = 'queued'",
+                         (time.time(), job_id))
+        finally:
+            conn.close()
+        job = self.get(job_id)
+        return job['state'] if job else None
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+"""
+    This module caches metadata rows fetched from MySQL in day-aligned chunks.
+
+    A query for any time range is served from the chunks of the UTC days it
+    touches and sliced in memory, so e.g. 06:00-18:00 reuses a cached full day.
+    Chunks are evicted LRU once the estimated size exceeds a byte budget; chunks
+    of recent days (still being ingested) also expire after a TTL.
+
+    Writers (utils/lwadata2sql.py) signal changes through a small JSON version
+    file. Every process checks it at most every few seconds and drops the chunks
+    overlapping the time ranges that were modified since it last looked.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Keep this many invalidation entries in the version file; a reader that is
+# further behind simply drops its whole cache.
+max_version_entries = 200
+version_time_format = "%Y-%m-%dT%H:%M:%S"
+
+
+##=========================
+def read_metadata_version(version_path):
+    """Return the parsed version file, or an empty version 0 state."""
+    try:
+        with open(version_path, 'r') as f:
+            state = json.load(f)
+        state.setdefault('version', 0)
+        state.setdefault('ranges', [])
+        return state
+    except (OSError, ValueError):
+        return {'version': 0, 'ranges': []}
+
+
+def bump_metadata_version(version_path, timerange=None):
+    """
+    Record that metadata changed within timerange (or everywhere if None).
+
+    Parameters:
+        version_path (str): path of the shared JSON version file
+        timerange (list): [start, end] as datetime or "YYYY-MM-DDTHH:MM:SS" strings
+
+    Returns:
+        int: the new version number
+    """
+    if timerange is not None:
+        timerange = [t.strftime(version_time_format) if isinstance(t, datetime) else t for t in timerange]
+    os.makedirs(os.path.dirname(version_path) or '.', exist_ok=True)
+    with open(version_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = read_metadata_version(version_path)
+        version = state['version'] + 1
+        ranges = state['ranges'][-(max_version_entries - 1):]
+        ranges.append([version] + (list(timerange) if timerange else [None, None]))
+        tmp_path = f"{version_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': version,
+                'updated': datetime.utcnow().strftime(version_time_format),
+                'ranges': ranges,
+            }, f)
+        os.replace(tmp_path, version_path)
+    return version
+
+
+##=========================
+def estimate_rows_bytes(rows):
+    """Rough in-memory size of a list of (file_path, datetime[, datetime]) tuples."""
+    size = 64
+    for row in rows:
+        size += 64 + 48 * (len(row) - 1) + 49 + len(row[0])
+    return size
+
+
+def day_range(start, end):
+    """List of datetime midnights for every UTC day touched by [start, end]."""
+    day = datetime(start.year, start.month, start.day)
+    days = []
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+class DayChunkCache(object):
+    """
+    LRU cache of per-(table, day) row lists.
+
+    Parameters:
+        max_bytes (int): estimated memory budget for all cached rows
+        recent_ttl (float): seconds a chunk of a recent day stays valid
+        recent_days (int): days before today (UTC) that count as recent
+        version_path (str): shared version file written by the ingest scripts
+        version_check_every (float): minimum seconds between two version file checks
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, recent_ttl=300., recent_days=1,
+                 version_path=None, version_check_every=5.):
+        self.max_bytes = int(max_bytes)
+        self.recent_ttl = float(recent_ttl)
+        self.recent_days = int(recent_days)
+        self.version_path = version_path
+        self.version_check_every = float(version_check_every)
+        self._lock = threading.RLock()
+        self._chunks = OrderedDict()  # (table, day) -> (rows, nbytes, expires_at)
+        self._bytes = 0
+        self._version = None
+        self._version_mtime = None
+        self._next_version_check = 0.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ##=========================
+    def _expiry_for(self, day):
+        recent_from = datetime.utcnow() - timedelta(days=self.recent_days)
+        recent_from = datetime(recent_from.year, recent_from.month, recent_from.day)
+        if day >= recent_from:
+            return time.monotonic() + self.recent_ttl
+        return None
+
+    def get(self, table, day):
+        key = (table, day)
+        with self._lock:
+            entry = self._chunks.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            rows, nbytes, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._chunks.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, table, day, rows):
+        key = (table, day)
+        nbytes = estimate_rows_bytes(rows)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._chunks:
+                self._drop(key)
+            self._chunks[key] = (rows, nbytes, self._expiry_for(day))
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._chunks:
+                self._drop(next(iter(self._chunks)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        rows, nbytes, _ = self._chunks.pop(key)
+        self._bytes -= nbytes
+
+    def invalidate(self, start=None, end=None):
+        """Drop chunks overlapping [start, end]; drop everything if either is None."""
+        with self._lock:
+            if start is None or end is None:
+                self._chunks.clear()
+                self._bytes = 0
+                return
+            first_day = datetime(start.year, start.month, start.day)
+            for key in [k for k in self._chunks if first_day <= k[1] <= end]:
+                self._drop(key)
+
+    ##=========================
+    def check_version(self):
+        """Apply invalidations written by other processes since the last check."""
+        if not self.version_path:
+            return
+        now = time.monotonic()
+        if now < self._next_version_check:
+            return
+        self._next_version_check = now + self.version_check_every
+        try:
+            mtime = os.stat(self.version_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._version_mtime and self._version is not None:
+            return
+        state = read_metadata_version(self.version_path)
+        with self._lock:
+            self._version_mtime = mtime
+            seen = self._version
+            self._version = state['version']
+            if seen is None or state['version'] <= seen:
+                if seen is not None and state['version'] < seen:
+                    # Version file was reset; nothing we hold can be trusted
+                    self.invalidate()
+                return
+            ranges = [r for r in state['ranges'] if r[0] > seen]
+            if not ranges or ranges[0][0] != seen + 1:
+                self.invalidate()
+                return
+            for _, st, ed in ranges:
+                if st is None or ed is None:
+                    self.invalidate()
+                    return
+                self.invalidate(datetime.strptime(st, version_time_format),
+                                datetime.strptime(ed, version_time_format))
+        logger.info("Metadata version %s -> %s; invalidated %d range(s)", seen, self._version, len(ranges))
+
+    @property
+    def version(self):
+        self.check_version()
+        return self._version or 0
+
+    ##=========================
+    def fetch(self, table, days, loader):
+        """
+        Return {day: rows} for all requested days, loading missing ones.
+
+        Parameters:
+            table (str): cache namespace, normally the MySQL table name
+            days (list of datetime): sorted, contiguous day midnights
+            loader (callable): loader(table, first_day, last_day) -> {day: rows}
+                for the half-open range [first_day, last_day + 1 day)
+        """
+        self.check_version()
+        chunks = {}
+        missing = []
+        for day in days:
+            rows = self.get(table, day)
+            if rows is None:
+                missing.append(day)
+            else:
+                chunks[day] = rows
+
+        # One query per run of consecutive missing days
+        runs = []
+        for day in missing:
+            if runs and day - runs[-1][-1] == timedelta(days=1):
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        for run in runs:
+            loaded = loader(table, run[0], run[-1])
+            for day in run:
+                rows = loaded.get(day, [])
+                chunks[day] = rows
+                self.put(table, day, rows)
+        return chunks
+
+    def cached_chunks(self, table, days):
+        """Return {day: rows} if every day is cached and fresh, else None (loads nothing)."""
+        self.check_version()
+        now = time.monotonic()
+        with self._lock:
+            chunks = {}
+            for day in days:
+                entry = self._chunks.get((table, day))
+                if entry is None or (entry[2] is not None and now >= entry[2]):
+                    return None
+                chunks[day] = entry[0]
+            for day in days:
+                self._chunks.move_to_end((table, day))
+            self.hits += len(days)
+        return chunks
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'chunks': len(self._chunks),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'version': self._version,
+            }
+
+
+##=========================
+if __name__ == '__main__':
+    # python -m core.query_cache /path/to/lwa_metadata_version.json [START END]
+    path = sys.argv[1]
+    print(bump_metadata_version(path, sys.argv[2:4] if len(sys.argv) >= 4 else None))
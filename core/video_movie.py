@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+"""
+    This module renders a list of quicklook PNGs into one MP4 or WebM file.
+
+    The viewer then downloads a single compressed video instead of fetching
+    every full-size PNG of an HTML movie page. ffmpeg reads the frames through
+    a concat list on stdin and reports its progress on stdout (-progress), which
+    is passed on to the caller so a background job can show it and stop ffmpeg
+    when cancelled. Videos are named by a hash of their frames and settings, so
+    the same selection is rendered only once.
+"""
+import os
+import hashlib
+import threading
+import subprocess
+
+video_formats = {
+    'mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart'],
+    'webm': ['-c:v', 'libvpx-vp9', '-crf', '33', '-b:v', '0', '-deadline', 'realtime', '-cpu-used', '8',
+             '-row-mt', '1', '-pix_fmt', 'yuv420p'],
+}
+video_mimetypes = {'mp4': 'video/mp4', 'webm': 'video/webm'}
+
+
+##=========================
+def video_key(png_paths, fmt, fps, max_width):
+    """sha256 of the sorted frames and the rendering settings."""
+    h = hashlib.sha256(f"{fmt}\0{fps}\0{max_width}\n".encode())
+    for path in sorted(png_paths):
+        h.update(path.encode('utf-8', 'surrogateescape') + b'\n')
+    return h.hexdigest()
+
+
+def video_filename(png_paths, key, fmt, name_prefix='video'):
+    """{name_prefix}_{date}T{time}Z_{key[:16]}.{fmt}, dated by the first frame like the HTML movie pages."""
+    fname = os.path.basename(min(png_paths))
+    if "T" not in fname:
+        raise ValueError("Filename missing timestamp.")
+    date_str = fname.split("T")[0].split(".")[-1]
+    timestamp_part = fname.split("T")[1].split("Z")[0]
+    return f"{name_prefix}_{date_str}T{timestamp_part}Z_{key[:16]}.{fmt}"
+
+
+def _concat_list(png_paths, fps):
+    lines = ["ffconcat version 1.0"]
+    for path in png_paths:
+        lines.append("file 'file:" + path.replace("'", "'\\''") + "'")
+        lines.append(f"option framerate {fps}")
+        lines.append(f"duration {1. / fps:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def render_video(png_paths, output_path, fmt='mp4', fps=6, max_width=1280, threads=0, progress=None):
+    """
+    Render png_paths (sorted by name, i.e. time) into output_path. The video is
+    written to a .part file and renamed when complete.
+
+    Parameters:
+        max_width (int): frames wider than this are scaled down (0: keep the size)
+        progress: called as progress(frames_done, bytes_done) while ffmpeg runs;
+            an exception raised by it (e.g. JobCancelled) stops ffmpeg and is re-raised
+
+    Returns:
+        (n_frames, n_bytes) of the video
+    """
+    if fmt not in video_formats:
+        raise ValueError(f"Unknown video format: {fmt}")
+    files = sorted(png_paths)
+    if not files:
+        raise ValueError("No PNG files provided.")
+    part_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+    # Even sizes, as yuv420p requires
+    width = f"min(iw,{int(max_width)})" if max_width else "iw"
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1",
+           "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe", "-i", "pipe:0",
+           "-vf", f"scale='trunc({width}/2)*2':-2:flags=area", "-r", str(fps),
+           "-threads", str(int(threads))] + video_formats[fmt] + ["-f", fmt, part_path]
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr is drained aside so a chatty ffmpeg cannot block on a full pipe
+    errors = []
+    stderr_reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+    n_frames, n_bytes = 0, 0
+    try:
+        try:
+            proc.stdin.write(_concat_list(files, fps).encode('utf-8'))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        for line in proc.stdout:
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            if key == 'frame':
+                n_frames = int(value)
+            elif key == 'total_size' and value.isdigit():
+                n_bytes = int(value)
+            elif key == 'progress' and progress is not None:
+                progress(n_frames, n_bytes)
+        proc.wait()
+        stderr_reader.join(timeout=5)
+        if proc.returncode != 0:
+            message = (errors[0] if errors else b'').decode('utf-8', 'replace').strip()
+            raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {message.splitlines()[-1] if message else ''}")
+        os.replace(part_path, output_path)
+    except BaseException:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return n_frames, os.path.getsize(output_path)
+
+
+def existing_video(output_path):
+    """True if the video exists; its mtime is refreshed to keep it from the tmp cleanup."""
+    if not os.path.exists(output_path):
+        return False
+    os.utime(output_path)
+    return True
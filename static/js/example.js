@@ -6,6 +6,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const startInput = document.getElementById('start');
     const endInput = document.getElementById('end');
     const cadenceInput = document.getElementById('cadence');
+    const cadenceModeInput = document.getElementById('cadence_mode');
+    const bundleFormatInput = document.getElementById('bundle_format');  // only when zstd is offered
     const imageTypeInput = document.getElementById('image_type');
     let movieOffsetDays = 0;
     let queryVersion = 0;
@@ -47,54 +49,90 @@ document.addEventListener('DOMContentLoaded', function () {
     //     list.focus(); // re-focus triggers redraw of grey highlighting
     // }
 
-    function updateSpecAndMovie(baseStart, offsetDays, thisQuery = null) {
-        const dateStr = baseStart.slice(0, 10);
-        const baseDate = new Date(`${dateStr}T00:00:00`);
-        baseDate.setUTCDate(baseDate.getUTCDate() + offsetDays);
-        const newDateStr = baseDate.toISOString().slice(0, 10);
-        const shiftedStart = `${newDateStr}T12:00:00`;
-
-        const formData = new FormData();
-        formData.append("start", shiftedStart);
-
-        fetch(`${baseUrl}/api/flare/spec_movie`, {
-            method: 'POST',
-            body: formData
-        })
+    // Spec/movie availability per day, fetched for a range around the shown
+    // day so that -1/+1 Day is answered from here; entries expire so that a
+    // movie made later in the day still shows up
+    const specMovieCache = new Map();
+    const specMovieMaxAge = 5 * 60 * 1000;
+    const specMoviePrefetchDays = 7;
+
+    function shiftDate(dateStr, days) {
+        const date = new Date(`${dateStr}T00:00:00Z`);
+        date.setUTCDate(date.getUTCDate() + days);
+        return date.toISOString().slice(0, 10);
+    }
+
+    function cachedSpecMovie(dateStr) {
+        const entry = specMovieCache.get(dateStr);
+        return entry && Date.now() - entry.time < specMovieMaxAge ? entry.data : null;
+    }
+
+    function fetchSpecMovieRange(dateStr) {
+        // GET, so the browser and the proxy can keep past days (see Cache-Control)
+        const params = new URLSearchParams({
+            start: `${shiftDate(dateStr, -specMoviePrefetchDays)}T00:00:00`,
+            end: `${shiftDate(dateStr, specMoviePrefetchDays)}T00:00:00`,
+        });
+        return fetch(`${baseUrl}/api/flare/spec_movie?${params}`)
         .then(res => res.json())
         .then(data => {
-            if (thisQuery !== null && thisQuery !== queryVersion) return;
+            const time = Date.now();
+            Object.entries(data.days || {}).forEach(([day, dayData]) => {
+                specMovieCache.set(day, { time: time, data: dayData });
+            });
+        });
+    }
 
-            const movieContainer = document.getElementById("movie-container");
-            const moviePlayer = document.getElementById("movie-player");
-            const movieSource = document.getElementById("movie-player-source");
-            const movieMessage = document.getElementById("movie-message");
-            const specImage = document.getElementById("spec-preview");
-            const specMessage = document.getElementById("spec-message");
-
-            if (data.movie_path) {
-                movieSource.src = data.movie_path;
-                moviePlayer.load();
-                moviePlayer.style.display = "block";
-                movieMessage.style.display = "none";
-            } else {
-                moviePlayer.style.display = "none";
-                movieMessage.textContent = data.movie_message || "The image movie does not exist for the selected day.";
-                movieMessage.style.display = "block";
-            }
+    function showSpecAndMovie(data) {
+        const movieContainer = document.getElementById("movie-container");
+        const moviePlayer = document.getElementById("movie-player");
+        const movieSource = document.getElementById("movie-player-source");
+        const movieMessage = document.getElementById("movie-message");
+        const specImage = document.getElementById("spec-preview");
+        const specMessage = document.getElementById("spec-message");
+
+        if (data.movie_path) {
+            movieSource.src = data.movie_path;
+            moviePlayer.load();
+            moviePlayer.style.display = "block";
+            movieMessage.style.display = "none";
+        } else {
+            moviePlayer.style.display = "none";
+            movieMessage.textContent = data.movie_message || "The image movie does not exist for the selected day.";
+            movieMessage.style.display = "block";
+        }
 
-            if (data.spec_png_path) {
-                specImage.src = data.spec_png_path;
-                specImage.style.display = "block";
-                specMessage.style.display = "none";
-            } else {
-                specImage.style.display = "none";
-                specMessage.textContent = data.spec_message || "The spectrogram does not exist for the selected day.";
-                specMessage.style.display = "block";
-            }
+        if (data.spec_png_path) {
+            specImage.src = data.spec_png_path;
+            specImage.style.display = "block";
+            specMessage.style.display = "none";
+        } else {
+            specImage.style.display = "none";
+            specMessage.textContent = data.spec_message || "The spectrogram does not exist for the selected day.";
+            specMessage.style.display = "block";
+        }
 
-            movieContainer.style.display = "block";
+        movieContainer.style.display = "block";
+    }
 
+    function updateSpecAndMovie(baseStart, offsetDays, thisQuery = null) {
+        const newDateStr = shiftDate(baseStart.slice(0, 10), offsetDays);
+
+        const cached = cachedSpecMovie(newDateStr);
+        if (cached) {
+            showSpecAndMovie(cached);
+            // Refill ahead of the next steps in either direction
+            if (!cachedSpecMovie(shiftDate(newDateStr, -2)) || !cachedSpecMovie(shiftDate(newDateStr, 2))) {
+                fetchSpecMovieRange(newDateStr).catch(() => {});
+            }
+            return;
+        }
+        fetchSpecMovieRange(newDateStr)
+        .then(() => {
+            if (thisQuery !== null && thisQuery !== queryVersion) return;
+            if (newDateStr !== shiftDate(startInput.value.slice(0, 10), movieOffsetDays)) return;
+            const data = cachedSpecMovie(newDateStr);
+            if (data) showSpecAndMovie(data);
         });
     }
 
@@ -104,7 +142,7 @@ document.addEventListener('DOMContentLoaded', function () {
         const generateBtn = document.getElementById(`generate-${bundleType}`);
         const downloadBtn = document.getElementById(`download-${bundleType}`);
 
-        generateBtn.onclick = () => {
+        const startGenerate = () => {
             const listId = bundleType === 'spec_fits' ? 'spec-list' :
                            bundleType === 'slow_lev1' ? 'image-lev1-list' :
                            'image-lev15-list';
@@ -121,9 +159,11 @@ document.addEventListener('DOMContentLoaded', function () {
             formData.append('end', endInput.value);
             const cadence = cadenceInput.value;
             if (cadence) formData.append('cadence', cadence);
+            formData.append('cadence_mode', cadenceModeInput.value);
             const imageType = document.getElementById('image_type').value;
             formData.append('image_type', imageType);
             formData.append('selected_files', JSON.stringify(selectedFiles));
+            if (bundleFormatInput) formData.append('format', bundleFormatInput.value);
 
             // First to give fetch summary info
             fetch(`${baseUrl}/check_bundle_summary/${bundleType}`, {
@@ -141,7 +181,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 if (!confirm(msg)) return;
 
                 downloadBtn.disabled = true;
-                fetch(`${baseUrl}/generate_bundle/${bundleType}`, {
+                fetch(`${baseUrl}/bundle_jobs/submit/${bundleType}`, {
                     method: 'POST',
                     body: formData
                 })
@@ -152,10 +192,10 @@ document.addEventListener('DOMContentLoaded', function () {
                     }
                     return res.json();
                 })
-                .then(data => {
-                    const archiveName = data.archive_name;
-                    downloadBtn.dataset.archiveName = archiveName;
-                    downloadBtn.disabled = false;
+                .then(job => {
+                    // Shared archives keep the name of this request on download
+                    downloadBtn.dataset.downloadName = job.download_name;
+                    pollBundleJob(job);
                 })
                 .catch(err => {
                     alert(err.message || `Failed to generate ${bundleType} bundle.`);
@@ -163,11 +203,48 @@ document.addEventListener('DOMContentLoaded', function () {
             })
             .catch(() => alert("Failed to retrieve file summary."));
         };
+        generateBtn.onclick = startGenerate;
+
+        // The archive is built by a background job: show its progress on the
+        // generate button (click it to cancel) until it is done
+        const generateLabel = generateBtn.textContent;
+        function pollBundleJob(job) {
+            if (job.state === 'done') {
+                generateBtn.textContent = generateLabel;
+                generateBtn.onclick = startGenerate;
+                downloadBtn.dataset.archiveName = job.job_id;
+                downloadBtn.disabled = false;
+                return;
+            }
+            if (job.state === 'failed' || job.state === 'cancelled') {
+                generateBtn.textContent = generateLabel;
+                generateBtn.onclick = startGenerate;
+                if (job.state === 'failed') alert(job.error || `Failed to generate ${bundleType} bundle.`);
+                return;
+            }
+            const pct = job.bytes_total ? Math.floor(100 * job.bytes_done / job.bytes_total) : 0;
+            generateBtn.textContent = job.state === 'queued' ? 'Queued… (cancel)' :
+                `${pct}% (${job.files_done}/${job.files_total}) (cancel)`;
+            generateBtn.onclick = () => {
+                fetch(`${baseUrl}/bundle_jobs/${job.job_id}/cancel`, { method: 'POST' });
+            };
+            setTimeout(() => {
+                fetch(`${baseUrl}/bundle_jobs/${job.job_id}`)
+                .then(res => res.json())
+                .then(pollBundleJob)
+                .catch(() => {
+                    generateBtn.textContent = generateLabel;
+                    generateBtn.onclick = startGenerate;
+                    alert(`Lost track of the ${bundleType} bundle job.`);
+                });
+            }, 1000);
+        }
 
         downloadBtn.onclick = () => {
             const archiveName = downloadBtn.dataset.archiveName;
             if (archiveName) {
-                window.location.href = `${baseUrl}/download_ready_bundle/${archiveName}`;
+                const name = encodeURIComponent(downloadBtn.dataset.downloadName || '');
+                window.location.href = `${baseUrl}/download_ready_bundle/${archiveName}?name=${name}`;
             }
         };
     }
@@ -181,21 +258,29 @@ document.addEventListener('DOMContentLoaded', function () {
         const cadence = cadenceInput.value;
         const imageType = imageTypeInput.value;
 
-        const formData = new FormData();
-        formData.append('start', start);
-        formData.append('end', end);
+        const params = new URLSearchParams();
+        params.append('start', start);
+        params.append('end', end);
         if (cadence) {
-            formData.append('cadence', cadence);
+            params.append('cadence', cadence);
         }
-        formData.append('image_type', imageType);
+        params.append('cadence_mode', cadenceModeInput.value);
+        params.append('image_type', imageType);
 
-        fetch(`${baseUrl}/api/flare/query`, {
-            method: 'POST',
-            body: formData
-        })
+        // The spec/movie quicklook does not depend on the query result
+        movieOffsetDays = 0;
+        updateSpecAndMovie(start, movieOffsetDays, thisQuery);
+
+        // File lists and the availability plot come from one request; a GET,
+        // so repeated views of past ranges are served from the browser cache
+        fetch(`${baseUrl}/api/flare/query_plot?${params}`)
         .then(res => res.json())
         .then(data => {
             if (thisQuery !== queryVersion) return;
+            if (data.error) {
+                alert(data.error);
+                return;
+            }
 
             updateFileList('spec-list', data.spec_fits);
             updateFileList('image-lev1-list', data.slow_lev1);
@@ -205,27 +290,8 @@ document.addEventListener('DOMContentLoaded', function () {
             setupGenerateAndDownloadButtons('slow_lev1');
             setupGenerateAndDownloadButtons('slow_lev15');
 
-            movieOffsetDays = 0;
-            updateSpecAndMovie(start, movieOffsetDays, thisQuery);
-
-            const plotFormData = new FormData();
-            plotFormData.append('start', start);
-            plotFormData.append('end', end);
-            if (cadence) {
-                plotFormData.append('cadence', cadence);
-            }
-            plotFormData.append('image_type', imageType);
-
-            fetch(`${baseUrl}/plot`, {
-                method: 'POST',
-                body: plotFormData
-            })
-            .then(res => res.json())
-            .then(result => {
-                if (thisQuery !== queryVersion) return;
-                const plotJSON = JSON.parse(result.plot);
-                Plotly.newPlot('plot-container', plotJSON.data, plotJSON.layout);
-            });
+            const plotJSON = JSON.parse(data.plot);
+            Plotly.newPlot('plot-container', plotJSON.data, plotJSON.layout);
         });
     }
 
@@ -296,6 +362,76 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    // Render the selected frames into one video on a background worker,
+    // showing the progress on the button (click it to cancel)
+    const videoFormatInput = document.getElementById('video_format');
+    ['slow_lev1', 'slow_lev15'].forEach(bundleType => {
+        const videoBtn = document.getElementById(`generate-video-${bundleType}`);
+        const listId = bundleType === 'slow_lev1' ? 'image-lev1-list' : 'image-lev15-list';
+        if (!videoBtn) return;
+        const videoLabel = videoBtn.textContent;
+
+        const startVideo = () => {
+            const listElement = document.getElementById(listId);
+            let selectedFiles = Array.from(listElement.selectedOptions).map(opt => opt.value);
+            if (selectedFiles.length === 0) {
+                selectedFiles = Array.from(listElement.options).map(opt => opt.value);
+            }
+
+            const formData = new FormData();
+            formData.append('selected_files', JSON.stringify(selectedFiles));
+            if (videoFormatInput) formData.append('format', videoFormatInput.value);
+
+            fetch(`${baseUrl}/movie_jobs/submit`, {
+                method: 'POST',
+                body: formData
+            })
+            .then(async res => {
+                if (!res.ok) {
+                    const errText = await res.text();
+                    throw new Error(errText);
+                }
+                return res.json();
+            })
+            .then(pollVideoJob)
+            .catch(err => {
+                alert(err.message || "Failed to generate the video.");
+            });
+        };
+        videoBtn.onclick = startVideo;
+
+        function pollVideoJob(job) {
+            if (job.state === 'done') {
+                videoBtn.textContent = videoLabel;
+                videoBtn.onclick = startVideo;
+                window.open(job.movie_url, '_blank');
+                return;
+            }
+            if (job.state === 'failed' || job.state === 'cancelled') {
+                videoBtn.textContent = videoLabel;
+                videoBtn.onclick = startVideo;
+                if (job.state === 'failed') alert(job.error || "Failed to generate the video.");
+                return;
+            }
+            const pct = job.files_total ? Math.floor(100 * job.files_done / job.files_total) : 0;
+            videoBtn.textContent = job.state === 'queued' ? 'Queued… (cancel)' :
+                `${pct}% (${job.files_done}/${job.files_total}) (cancel)`;
+            videoBtn.onclick = () => {
+                fetch(`${baseUrl}/bundle_jobs/${job.job_id}/cancel`, { method: 'POST' });
+            };
+            setTimeout(() => {
+                fetch(`${baseUrl}/bundle_jobs/${job.job_id}`)
+                .then(res => res.json())
+                .then(pollVideoJob)
+                .catch(() => {
+                    videoBtn.textContent = videoLabel;
+                    videoBtn.onclick = startVideo;
+                    alert("Lost track of the video job.");
+                });
+            }, 1000);
+        }
+    });
+
     queryAndUpdate();
 
 });
@@ -0,0 +1,102 @@
+## bench_availability_plot.py
+## python bench_availability_plot.py
+## python bench_availability_plot.py --html /tmp/plot-bench   # also write pages that time Plotly.newPlot in a browser
+##
+## Payload size and build time of the /plot availability figure for 1 day,
+## 1 month and 1 year of synthetic patchy data: the former one-trace-per-span
+## figure vs. the current single trace per product (build_availability_figure).
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blueprints.example import build_availability_figure, compress_time_segments, color_map, availability_max_gap_seconds
+
+
+def synthetic_obs_times(start, days, seed=0):
+    """Patchy 10 s image times (daily 12:00-03:00 window with random outages) and one spec span per day."""
+    rng = np.random.default_rng(seed)
+    obs_times = {'spec_fits': [], 'slow_lev1': [], 'slow_lev15': []}
+    for d in range(days):
+        day = start + timedelta(days=d)
+        obs_times['spec_fits'].append((day + timedelta(hours=12), day + timedelta(hours=27)))
+        for key in ('slow_lev1', 'slow_lev15'):
+            t = day + timedelta(hours=12)
+            end = day + timedelta(hours=27)
+            while t < end:
+                if rng.random() < 0.003:
+                    t += timedelta(seconds=int(rng.integers(700, 3600)))  # outage
+                obs_times[key].append(t)
+                t += timedelta(seconds=10)
+    return obs_times
+
+
+def legacy_availability_figure(obs_times, start, end, image_type):
+    """The former figure: one go.Scatter per spec file and per compressed segment."""
+    fig = go.Figure()
+    labels = ['spec_fits', 'slow_lev1', 'slow_lev15']
+    labels_fig = ['Spec', f'Image lev1_{image_type}', f'Image lev15_{image_type}']
+    for label, label_fig in zip(labels, labels_fig):
+        times = obs_times.get(label, [])
+        name = f"N({label_fig}) = {len(times)}"
+        spans = times if label == 'spec_fits' else compress_time_segments(times, availability_max_gap_seconds)
+        show_legend = True
+        for st, ed in spans:
+            fig.add_trace(go.Scatter(x=[st, ed], y=[label_fig, label_fig], mode='lines',
+                                     line=dict(width=15, color=color_map[label]),
+                                     name=name, showlegend=show_legend))
+            show_legend = False
+    fig.update_layout(xaxis=dict(range=[start, end], autorange=False),
+                      yaxis=dict(categoryorder='array', categoryarray=labels_fig), height=400)
+    return fig
+
+
+def timed_json(build):
+    t0 = time.perf_counter()
+    fig = build()
+    payload = pio.to_json(fig)
+    return payload, len(fig.data), time.perf_counter() - t0
+
+
+def write_html(path, payload):
+    """Standalone page that renders the figure and reports the Plotly.newPlot time."""
+    with open(path, 'w') as f:
+        f.write(f"""<html><head><script src="https://cdn.plot.ly/plotly-latest.min.js"></script></head>
+<body><div id="timing"></div><div id="plot"></div><script>
+const fig = {payload};
+const t0 = performance.now();
+Plotly.newPlot('plot', fig.data, fig.layout).then(() => {{
+  document.getElementById('timing').textContent = 'Plotly.newPlot: ' + (performance.now() - t0).toFixed(1) + ' ms';
+}});
+</script></body></html>""")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the availability figure payload")
+    parser.add_argument('--html', help="Directory to write browser render-timing pages into")
+    args = parser.parse_args()
+
+    start = datetime(2025, 1, 1)
+    print(f"{'range':>7} {'variant':>8} {'traces':>7} {'payload [kB]':>13} {'build+json [ms]':>16}")
+    for label, days in [('1 day', 1), ('1 month', 30), ('1 year', 365)]:
+        obs_times = synthetic_obs_times(start, days)
+        end = start + timedelta(days=days + 1)
+        for variant, build in [
+            ('legacy', lambda: legacy_availability_figure(obs_times, start, end, 'mfs')),
+            ('single', lambda: build_availability_figure(obs_times, start, end, 'mfs')),
+        ]:
+            payload, ntraces, dt = timed_json(build)
+            print(f"{label:>7} {variant:>8} {ntraces:>7d} {len(payload) / 1024:>13.1f} {dt * 1e3:>16.1f}")
+            if args.html:
+                os.makedirs(args.html, exist_ok=True)
+                write_html(os.path.join(args.html, f"{label.replace(' ', '')}_{variant}.html"), payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+## bench_bulk_insert.py
+## python bench_bulk_insert.py --host localhost --user bench --password bench --database lwa_bench
+## python bench_bulk_insert.py --rows 1000000 --modes values loaddata --commit-every 0 100000
+##
+## Rows/s of the lwadata2sql.py insert strategies (executemany, values, loaddata)
+## against a local MySQL/MariaDB stand-in. Synthetic image rows go into a scratch
+## copy of the lwa_slow_*_hdf_files schema (partitioned by month, unique
+## file_path), first into the empty table and then again as all-duplicates,
+## which is what a re-run over an already ingested range sends.
+## loaddata needs local_infile=ON on the server.
+
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+import mysql.connector
+
+from lwadata2sql import bulk_insert_rows, insert_modes
+
+bench_table = 'bench_lwa_slow_hdf_files'
+
+
+def create_bench_table(cursor, start, months):
+    partitions = []
+    current = start.replace(day=1)
+    for _ in range(months):
+        next_month = (current + timedelta(days=32)).replace(day=1)
+        partitions.append(f"PARTITION {current.strftime('p%Y%m')} VALUES LESS THAN (TO_DAYS('{next_month:%Y-%m-%d}'))")
+        current = next_month
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    cursor.execute(f"DROP TABLE IF EXISTS {bench_table}")
+    cursor.execute(f"""
+        CREATE TABLE {bench_table} (
+            id INT NOT NULL AUTO_INCREMENT,
+            file_path VARCHAR(1024) NOT NULL,
+            obs_time DATETIME NOT NULL,
+            file_size BIGINT NULL,
+            file_mtime_ns BIGINT NULL,
+            UNIQUE KEY uq_file_path (file_path(255), obs_time),
+            PRIMARY KEY (id, obs_time)
+        )
+        PARTITION BY RANGE (TO_DAYS(obs_time)) (
+            {", ".join(partitions)}
+        )
+    """)
+
+
+def make_rows(n_rows, start, cadence_seconds=10):
+    """Rows shaped like the mfs lev1 ingest: one 10 s image after another."""
+    rows = []
+    for i in range(n_rows):
+        t = start + timedelta(seconds=i * cadence_seconds)
+        path = (f"/nas7/ovro-lwa-data/hdf/slow/lev1/{t:%Y/%m/%d}/"
+                f"ovro-lwa-352.lev1_mfs_10s.{t:%Y-%m-%dT%H%M%S}Z.image_I.hdf")
+        rows.append((path, t, 120000000 + i, 1700000000000000000 + i))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk insert strategies of lwadata2sql.py")
+    parser.add_argument('--host', default=os.getenv('FLARE_DB_HOST', 'localhost'))
+    parser.add_argument('--user', default=os.getenv('FLARE_DB_USER'))
+    parser.add_argument('--password', default=os.getenv('FLARE_DB_PASSWORD'))
+    parser.add_argument('--database', default='lwa_bench', help="Scratch database (never the production one)")
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--modes', nargs='+', choices=insert_modes, default=list(insert_modes))
+    parser.add_argument('--commit-every', type=int, nargs='+', default=[0],
+                        help="Rows per transaction to try; 0 = the default of each mode")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Rows per statement in executemany mode")
+    args = parser.parse_args()
+
+    if args.database == 'lwa_metadata_query':
+        parser.error("refusing to benchmark in the production database")
+
+    start = datetime(2025, 4, 1)
+    rows = make_rows(args.rows, start)
+    months = (rows[-1][1].year - start.year) * 12 + rows[-1][1].month - start.month + 1
+    connection = mysql.connector.connect(host=args.host, user=args.user, password=args.password,
+                                         database=args.database, allow_local_infile=True)
+    cursor = connection.cursor()
+    print(f"{args.rows} rows over {months} month(s)")
+    print(f"{'mode':<12} {'commit':>8} {'new rows/s':>12} {'dup rows/s':>12}")
+    try:
+        for mode in args.modes:
+            for commit_every in args.commit_every:
+                create_bench_table(cursor, start, months)
+                connection.commit()
+                rates = []
+                for _ in ('new', 'dup'):
+                    t0 = time.perf_counter()
+                    bulk_insert_rows(connection, bench_table, ('file_path', 'obs_time', 'file_size', 'file_mtime_ns'),
+                                     rows, mode=mode, batch_size=args.batch_size,
+                                     commit_every=commit_every or None, verbose=False)
+                    rates.append(len(rows) / (time.perf_counter() - t0))
+                cursor.execute(f"SELECT COUNT(*) FROM {bench_table}")
+                n = cursor.fetchone()[0]
+                if n != len(rows):
+                    print(f"Warning: {n} rows in the table, expected {len(rows)}")
+                print(f"{mode:<12} {commit_every or 'default':>8} {rates[0]:>12,.0f} {rates[1]:>12,.0f}", flush=True)
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {bench_table}")
+        cursor.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
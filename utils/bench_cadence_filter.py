@@ -0,0 +1,64 @@
+## bench_cadence_filter.py
+## python bench_cadence_filter.py
+## python bench_cadence_filter.py --sizes 10000 100000 1000000 --cadence 10 60 600
+##
+## Compare the original per-element cadence loop with the searchsorted jump
+## loop of core/cadence.py on synthetic 10 s observation times (with gaps).
+## Both paths are checked to select exactly the same indices.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.cadence import cadence_filter_indices, greedy_cadence_loop, to_datetime64
+
+
+def synthetic_times(n, native_cadence=10., seed=0):
+    """n sorted datetimes on a jittered 10 s grid with occasional multi-minute gaps."""
+    rng = np.random.default_rng(seed)
+    steps = native_cadence + rng.normal(0, 0.05, n)
+    gaps = rng.random(n) < 0.001
+    steps[gaps] += rng.uniform(60, 3600, gaps.sum())
+    offsets_us = np.cumsum(np.round(steps * 1e6)).astype('int64')
+    t0 = np.datetime64('2025-05-01T12:00:00', 'us')
+    return (t0 + offsets_us.astype('timedelta64[us]')).astype(datetime).tolist()
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cadence filtering implementations")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--cadence', type=float, nargs='+', default=[10, 60, 600])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'cadence':>8} {'kept':>9} {'loop [ms]':>10} {'vector [ms]':>12} "
+          f"{'vector+conv [ms]':>17} {'speedup':>8}")
+    for n in args.sizes:
+        times = synthetic_times(n)
+        times64 = to_datetime64(times)
+        for cadence in args.cadence:
+            t_loop, ref = best_of(lambda: greedy_cadence_loop(times, cadence), args.repeat)
+            t_vec, idx = best_of(lambda: cadence_filter_indices(times64, cadence), args.repeat)
+            t_conv, idx2 = best_of(lambda: cadence_filter_indices(times, cadence), args.repeat)
+            if not (np.array_equal(ref, idx) and np.array_equal(ref, idx2)):
+                raise SystemExit(f"Mismatch at n={n}, cadence={cadence}")
+            print(f"{n:>9d} {cadence:>8g} {len(idx):>9d} {t_loop * 1e3:>10.2f} {t_vec * 1e3:>12.2f} "
+                  f"{t_conv * 1e3:>17.2f} {t_loop / t_conv:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
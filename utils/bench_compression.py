@@ -0,0 +1,106 @@
+## bench_compression.py
+## python bench_compression.py
+## python bench_compression.py --files 16 --file-mb 32 --threads 1 2 4 8 16 --packed 0.5
+##
+## Bundle compression throughput vs. thread count on synthetic HDF-sized files:
+## single-core gzip.GzipFile (the former tarfile/make_archive path) against the
+## block-parallel gzip writer and, if zstandard is installed, multithreaded zstd.
+## A --packed fraction of the files is random data, standing in for HDF5 files
+## with compressed datasets, which the gzip writer stores instead of deflating.
+
+import os
+import sys
+import gzip
+import time
+import tarfile
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.bundle_archive import write_tar, available_formats
+
+
+class CountingSink(object):
+    """Discards the archive, counting its size."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def make_files(directory, n_files, file_mb, packed_fraction, seed=0):
+    """Image-like float32 files (smooth disk + noise) and, for a fraction, incompressible ones."""
+    rng = np.random.default_rng(seed)
+    n_values = int(file_mb * 1024 * 1024 / 4)
+    side = int(np.sqrt(n_values))
+    y, x = np.mgrid[:side, :side]
+    disk = np.where((x - side / 2) ** 2 + (y - side / 2) ** 2 < (side / 4) ** 2, 1e4, 0.).astype('float32')
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(directory, f"synthetic_{i:03d}.hdf")
+        if i < round(packed_fraction * n_files):
+            data = rng.bytes(n_values * 4)
+        else:
+            image = disk + rng.normal(0, 30, disk.shape).astype('float32')
+            data = np.round(image, 1).tobytes()
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def gzipfile_tar(paths, sink, compresslevel):
+    with gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=compresslevel, mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode='w|', bufsize=1024 * 1024) as tar:
+            for path in paths:
+                tar.add(path, arcname=os.path.basename(path))
+
+
+def timed(run, paths):
+    sink = CountingSink()
+    t0 = time.perf_counter()
+    run(sink)
+    dt = time.perf_counter() - t0
+    total = sum(os.path.getsize(p) for p in paths)
+    return total / dt / 1024 ** 2, sink.size / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel bundle compression")
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--file-mb', type=float, default=16.)
+    parser.add_argument('--packed', type=float, default=0.5, help="Fraction of incompressible files")
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--level', type=int, default=6, help="gzip level")
+    parser.add_argument('--zstd-level', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_files(directory, args.files, args.file_mb, args.packed)
+        for path in paths:
+            with open(path, 'rb') as f:
+                while f.read(1024 * 1024):
+                    pass  # warm the page cache
+        print(f"{args.files} files x {args.file_mb:g} MB, {args.packed:.0%} incompressible, {os.cpu_count()} cores")
+        print(f"{'variant':>20} {'threads':>8} {'MB/s':>9} {'ratio':>7}")
+
+        speed, ratio = timed(lambda sink: gzipfile_tar(paths, sink, args.level), paths)
+        print(f"{'GzipFile (before)':>20} {1:>8d} {speed:>9.1f} {ratio:>7.3f}")
+        for fmt in available_formats():
+            level = args.zstd_level if fmt == 'zst' else args.level
+            for threads in args.threads:
+                speed, ratio = timed(lambda sink: write_tar(paths, sink, fmt=fmt, compresslevel=level,
+                                                            threads=threads), paths)
+                print(f"{'parallel ' + fmt:>20} {threads:>8d} {speed:>9.1f} {ratio:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
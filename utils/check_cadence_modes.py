@@ -0,0 +1,84 @@
+## check_cadence_modes.py
+## python check_cadence_modes.py
+## python check_cadence_modes.py --db --start 2025-05-01T00:00:00 --end 2025-05-08T00:00:00 --cadence 60 600
+##
+## Equivalence check between the exact greedy cadence filter and the bucketed
+## mode (first file per (seconds since epoch) DIV cadence bucket):
+##   1. bucketed == greedy on a gapless, bucket-aligned regular grid;
+##   2. otherwise greedy keeps at most one file per bucket, so
+##      len(greedy) <= len(bucket), and every bucket with data has a bucketed pick;
+##   3. with --db, the SQL decimation (load_image_rows_bucketed) returns exactly
+##      the rows bucket_filter_indices picks from the full fetch of the same range.
+
+import os
+import sys
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.cadence import cadence_filter_indices, bucket_filter_indices, to_datetime64
+
+
+def check_synthetic(cadences, seed=0):
+    rng = np.random.default_rng(seed)
+    t0 = datetime(2025, 5, 1, 12, 0, 0)
+
+    for cadence in cadences:
+        # 1. gapless 10 s grid starting on a bucket boundary
+        grid = [t0 + timedelta(seconds=10 * i) for i in range(20000)]
+        greedy = cadence_filter_indices(grid, cadence)
+        bucket = bucket_filter_indices(grid, cadence)
+        assert np.array_equal(greedy, bucket), f"aligned grid differs at cadence {cadence}"
+
+        # 2. whole-second jitter and random gaps
+        steps = np.maximum(1, np.round(10 + rng.normal(0, 2, 20000))).astype('int64')
+        steps[rng.random(steps.size) < 0.002] += rng.integers(60, 3600)
+        times = [t0 + timedelta(seconds=int(s)) for s in np.cumsum(steps)]
+        greedy = cadence_filter_indices(times, cadence)
+        bucket = bucket_filter_indices(times, cadence)
+        seconds = to_datetime64(times).view('int64') // 1000000
+        greedy_buckets = seconds[greedy] // int(cadence)
+        assert len(np.unique(greedy_buckets)) == len(greedy), "greedy kept two files in one bucket"
+        assert len(bucket) == len(np.unique(seconds // int(cadence))), "a non-empty bucket has no pick"
+        assert len(greedy) <= len(bucket)
+        print(f"cadence {cadence:>5d} s: aligned grid identical; jittered: greedy={len(greedy)} bucket={len(bucket)}")
+
+
+def check_database(start, end, cadences, image_type):
+    from blueprints.example import get_lwa_file_lists_from_mysql, load_image_rows_bucketed
+    from astropy.time import Time
+
+    file_lists, obs_times = get_lwa_file_lists_from_mysql(start, end, image_type=image_type)
+    tables = {
+        'slow_lev1': f'lwa_slow_{image_type}_lev1_hdf_files',
+        'slow_lev15': f'lwa_slow_{image_type}_lev15_hdf_files',
+    }
+    for key, table in tables.items():
+        times = obs_times[key]
+        for cadence in cadences:
+            expected = [times[i] for i in bucket_filter_indices(times, cadence).tolist()] if times else []
+            sql_rows = load_image_rows_bucketed(table, Time(start).datetime, Time(end).datetime, cadence)
+            got = [row[1] for row in sql_rows]
+            status = "OK" if got == expected else "MISMATCH"
+            n_greedy = len(cadence_filter_indices(times, cadence)) if times else 0
+            print(f"[{table}] cadence {cadence} s: rows={len(times)} sql_bucket={len(got)} "
+                  f"python_bucket={len(expected)} greedy={n_greedy} {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check greedy vs. bucketed cadence selection")
+    parser.add_argument('--cadence', type=int, nargs='+', default=[10, 60, 600, 3600])
+    parser.add_argument('--db', action='store_true', help="Also compare the SQL decimation against MySQL")
+    parser.add_argument('--start', default='2025-05-01T00:00:00')
+    parser.add_argument('--end', default='2025-05-02T00:00:00')
+    parser.add_argument('--image_type', default='mfs', choices=['mfs', 'fch'])
+    args = parser.parse_args()
+
+    check_synthetic(args.cadence)
+    if args.db:
+        check_database(args.start, args.end, args.cadence, args.image_type)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,17 @@ BASE_DIR="/common/webplots/lwa-data/tmp"
 # Default age limit in hours
 AGE_LIMIT_HOURS=24
 
+# Size budget of the data bundles under data-request/ (least recently used are evicted first)
+BUNDLE_STORE_GB="${LWA_BUNDLE_STORE_GB:-200}"
+REPO_DIR="$(cd "$(dirname "$0")/.." && pwd)"
+
 usage() {
     echo "Usage: $0 [AGE_LIMIT_HOURS]"
     echo ""
-    echo "Deletes .tar.gz files under data-request/ and .html files under html/"
-    echo "that are older than AGE_LIMIT_HOURS. Default is 24 hours if not specified."
+    echo "Evicts least recently used data bundles under data-request/ beyond"
+    echo "LWA_BUNDLE_STORE_GB (default 200), deletes unindexed files there and .html,"
+    echo ".mp4, .webm and .part files under html/ that are older than AGE_LIMIT_HOURS."
+    echo "Default is 24 hours if not specified."
     echo ""
     echo "Options:"
     echo "  --help         Show this help message and exit"
@@ -36,8 +42,10 @@ fi
 # Convert hours to minutes
 AGE_LIMIT_MINUTES=$((AGE_LIMIT_HOURS * 60))
 
-# Delete old .tar.gz files
-find "$BASE_DIR"/data-request -type f -name "*.tar.gz" -mmin +$AGE_LIMIT_MINUTES -exec rm -f {} \;
+# Evict data bundles (size-bounded LRU over the shared archive index)
+cd "$REPO_DIR" && python3 -m core.bundle_store "$BASE_DIR"/data-request \
+    --max-gb "$BUNDLE_STORE_GB" --stray-hours "$AGE_LIMIT_HOURS"
 
-# Delete old .html files
-find "$BASE_DIR"/html -type f -name "*.html" -mmin +$AGE_LIMIT_MINUTES -exec rm -f {} \;
+# Delete old .html files, rendered videos and partial videos left by killed workers
+find "$BASE_DIR"/html -type f \( -name "*.html" -o -name "*.mp4" -o -name "*.webm" -o -name "*.part" \) \
+    -mmin +$AGE_LIMIT_MINUTES -exec rm -f {} \;
@@ -1,16 +1,23 @@
 ##python lwa-query-web_utils.py --start 2025-04-25 --end 2025-05-01
 ##python lwa-query-web_utils.py --gen movie --start 2025-04-25 --end 2025-05-01
 ##python lwa-query-web_utils.py --start 2025-04-25 --end 2025-05-01 --out /tmp/movies
-##du -h /common/webplots/lwa-data/qlook_daily/movies/*.mp4
+##python lwa-query-web_utils.py --gen movie --start 2025-04-01 --end 2025-05-01 --jobs 4
+##python lwa-query-web_utils.py --gen movie --start 2025-04-01 --end 2025-05-01 --preset veryfast --threads 2
+##python lwa-query-web_utils.py --gen movie --start $(date -u -d yesterday +%F) --end $(date -u +%F)  # every 15 min, appends new frames
+##du -h /common/webplots/lwa-data/qlook_daily/movies/*/*.mp4
 import mysql.connector
 import os
-from glob import glob
 from datetime import datetime, timedelta
 from astropy.time import Time
 import subprocess
-import tempfile
-import shutil
+import json
+import sys
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.html_movie import png_size
 
 ##=========================connect to database
 def create_lwa_query_db_connection():
@@ -66,94 +73,288 @@ def get_lwa_file_lists_from_mysql(start_utc, end_utc, image_type="mfs"):
 
 
 ##=========================
-def generate_movies_from_date_range(start_date_str, end_date_str, save_path='/common/webplots/lwa-data/qlook_daily/movies/'):
+qlook_synop_dir = '/common/webplots/lwa-data/qlook_images/slow/synop'
+
+def extract_timestamp(path):
+    base = os.path.basename(path)
+    try:
+        tstr = base.split("T")[1][:6]  # 'HHMMSS'
+        dstr = base.split("T")[0].split(".")[-1]  # 'YYYY-MM-DD'
+        return datetime.strptime(dstr + tstr, "%Y-%m-%d%H%M%S")
+    except Exception:
+        return None
+
+def list_window_pngs(current_date):
+    """
+    PNGs of the day directory of current_date within 12:00 of the day to 03:00
+    of the next day, as sorted (path, obs_time, mtime_ns).
+    """
+    yyyy, mm, dd = current_date.strftime("%Y"), current_date.strftime("%m"), current_date.strftime("%d")
+    img_dir = f"{qlook_synop_dir}/{yyyy}/{mm}/{dd}"
+    start_time = datetime.combine(current_date, datetime.strptime("12:00:00", "%H:%M:%S").time())
+    end_time = datetime.combine(current_date + timedelta(days=1), datetime.strptime("03:00:00", "%H:%M:%S").time())
+    frames = []
+    try:
+        with os.scandir(img_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".png"):
+                    continue
+                ts = extract_timestamp(entry.path)
+                if ts and start_time <= ts <= end_time:
+                    frames.append((entry.path, ts, entry.stat().st_mtime_ns))
+    except FileNotFoundError:
+        pass
+    return sorted(frames)
+
+movie_fps = 6
+x264_presets = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+def _concat_file_line(path):
+    # Absolute file: URLs, since the list itself is read from pipe:0
+    return "file 'file:" + path.replace("'", "'\\''") + "'"
+
+def frame_cadence(frames):
+    """Median spacing (s) of the obs_times of frames [(path, obs_time, ...)], or None."""
+    gaps = sorted((b[1] - a[1]).total_seconds() for a, b in zip(frames, frames[1:]))
+    return gaps[len(gaps) // 2] if gaps and gaps[len(gaps) // 2] > 0 else None
+
+def hold_steps(t0, t1, cadence, max_hold=6):
+    """Movie frames showing an observation at t0 until the next one at t1."""
+    if not cadence:
+        return 1
+    return min(max(int(round((t1 - t0).total_seconds() / cadence)), 1), max_hold)
+
+def concat_list(entries):
+    """
+    ffmpeg concat demuxer script showing each (path, steps) entry for steps
+    movie frames, so gaps in the observations show as holds. The last entry is
+    shown once whatever its steps, which makes the movie exactly sum(steps)
+    frames long when it ends in a single step (see frame_entries).
+    """
+    lines = ["ffconcat version 1.0"]
+    for path, steps in entries:
+        lines.append(_concat_file_line(path))
+        # Without it the image timestamps are on a 1/25 s grid and holds come out a frame off
+        lines.append(f"option framerate {movie_fps}")
+        lines.append(f"duration {steps / movie_fps:.6f}")
+    return "\n".join(lines) + "\n"
+
+def frame_entries(frames, cadence, max_hold=6):
+    """(path, steps) of frames, each held until the next frame."""
+    return [(frame[0], hold_steps(frame[1], frames[i + 1][1], cadence, max_hold) if i + 1 < len(frames) else 1)
+            for i, frame in enumerate(frames)]
+
+def movie_path_for(save_path, current_date):
+    """{save_path}/{yyyy}/ovro-lwa-352.synop_mfs_image_I_movie_{yyyymmdd}.mp4, where /api/flare/spec_movie looks."""
+    return os.path.join(save_path, current_date.strftime("%Y"),
+                        f"ovro-lwa-352.synop_mfs_image_I_movie_{current_date.strftime('%Y%m%d')}.mp4")
+
+##=========================
+# Frames manifest: a JSON sidecar (<movie>.frames.json) listing the frames
+# encoded in the movie with their mtimes, plus the encoding settings. When the
+# PNGs of a day only grew at the end, just the new frames are encoded as a
+# segment and appended to the movie with a stream copy.
+def load_frames_manifest(movie_path):
+    try:
+        with open(f"{movie_path}.frames.json", 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_frames_manifest(movie_path, manifest):
+    path = f"{movie_path}.frames.json"
+    with open(f"{path}.part", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.part", path)
+
+def run_ffmpeg(args, quiet, stdin_text=None):
+    cmd = ["ffmpeg", "-y"]
+    if quiet:
+        cmd += ["-hide_banner", "-loglevel", "error"]
+    subprocess.run(cmd + args, input=stdin_text.encode('utf-8') if stdin_text is not None else None, check=True)
+
+def encode_frames(entries, output_path, ffmpeg_threads, preset, quiet):
+    run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe",
+        "-i", "pipe:0",
+        "-r", str(movie_fps),
+        "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p",
+        "-threads", str(ffmpeg_threads),
+        "-f", "mp4", output_path
+    ], quiet, concat_list(entries))
+
+def render_day_movie(date_str, save_path, ffmpeg_threads=0, force=False, quiet=False, preset='medium', max_hold=6):
+    """
+    Render or extend the movie of one day (module level so a process pool can run it).
+    The frames are fed to ffmpeg as a concat list on stdin, without linking or
+    copying them, and the movie is written next to its final name and renamed.
+    If its frames manifest shows that only new frames were added, those are
+    encoded as a segment and appended losslessly (stream copy).
+
+    Args:
+        ffmpeg_threads (int): encoder threads, 0 lets ffmpeg decide
+        force (bool): render from scratch even if the movie is up to date or could be appended to
+        quiet (bool): only let ffmpeg print errors
+        preset (str): x264 preset, from ultrafast (fast, larger) to veryslow (slow, smaller)
+        max_hold (int): longest hold, in movie frames, shown for an observation gap
+
+    Returns:
+        dict: date, status ('rendered', 'appended', 'up-to-date', 'no-png', 'failed'),
+        path, frames, encoded, seconds, error
+    """
+    t0 = time.perf_counter()
+    result = {'date': date_str, 'status': 'failed', 'path': None, 'frames': 0, 'encoded': 0, 'seconds': 0., 'error': None}
+    current_date = datetime.strptime(date_str, "%Y-%m-%d")
+    frames = list_window_pngs(current_date)
+    result['frames'] = len(frames)
+    if not frames:
+        print(f"[{date_str}] No PNGs in 12:00-03:00 window.")
+        result['status'] = 'no-png'
+        result['seconds'] = time.perf_counter() - t0
+        return result
+
+    output_path = movie_path_for(save_path, current_date)
+    frame_ids = [[os.path.basename(path), mtime_ns] for path, _, mtime_ns in frames]
+    settings = {'fps': movie_fps, 'preset': preset, 'max_hold': max_hold}
+    manifest = load_frames_manifest(output_path) if os.path.exists(output_path) else None
+    n_old = 0
+    if manifest and not force and manifest.get('settings') == settings:
+        old_ids = manifest.get('frames', [])
+        if frame_ids == old_ids:
+            print(f"[{date_str}] Movie is up to date ({len(frames)} PNGs).")
+            result.update(status='up-to-date', path=output_path, seconds=time.perf_counter() - t0)
+            return result
+        if 0 < len(old_ids) < len(frame_ids) and frame_ids[:len(old_ids)] == old_ids \
+                and png_size(frames[-1][0]) == tuple(manifest.get('size', ())):
+            n_old = len(old_ids)
+    elif manifest is None and not force and os.path.exists(output_path) \
+            and os.stat(output_path).st_mtime_ns >= max(m for _, _, m in frames):
+        # Rendered before manifests existed
+        print(f"[{date_str}] Movie is up to date ({len(frames)} PNGs).")
+        result.update(status='up-to-date', path=output_path, seconds=time.perf_counter() - t0)
+        return result
+
+    part_path = f"{output_path}.part"
+    segment_path = f"{output_path}.segment.part"
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if n_old:
+            cadence = manifest.get('cadence')
+            print(f"[{date_str}] {len(frames) - n_old} new PNGs appended to {n_old}.")
+            entries = frame_entries(frames[n_old:], cadence, max_hold)
+            # The last old frame is shown once at the end of the movie; hold it over the gap
+            lead = hold_steps(frames[n_old - 1][1], frames[n_old][1], cadence, max_hold) - 1
+            if lead > 0:
+                entries.insert(0, (frames[n_old - 1][0], lead))
+            encode_frames(entries, segment_path, ffmpeg_threads, preset, quiet)
+            run_ffmpeg([
+                "-f", "concat", "-safe", "0", "-protocol_whitelist", "file,pipe",
+                "-i", "pipe:0", "-c", "copy", "-movflags", "+faststart", "-f", "mp4", part_path
+            ], quiet, "ffconcat version 1.0\n" + _concat_file_line(output_path) + "\n" + _concat_file_line(segment_path) + "\n")
+            status = 'appended'
+        else:
+            print(f"[{date_str}] {len(frames)} PNGs in time window.")
+            cadence = frame_cadence(frames)
+            encode_frames(frame_entries(frames, cadence, max_hold), part_path, ffmpeg_threads, preset, quiet)
+            status = 'rendered'
+        # Without a manifest a crash in between leads to a full render, never to a wrong append
+        if os.path.exists(f"{output_path}.frames.json"):
+            os.remove(f"{output_path}.frames.json")
+        os.replace(part_path, output_path)
+        save_frames_manifest(output_path, {'settings': settings, 'cadence': cadence,
+                                           'size': list(png_size(frames[-1][0])), 'frames': frame_ids})
+        result.update(status=status, path=output_path, encoded=len(frames) - n_old)
+    except Exception as e:
+        print(f"[{date_str}] Movie generation failed: {e}")
+        result['error'] = str(e)
+    finally:
+        for path in (part_path, segment_path):
+            if os.path.exists(path):
+                os.remove(path)
+    result['seconds'] = time.perf_counter() - t0
+    return result
+
+def generate_movies_from_date_range(start_date_str, end_date_str, save_path='/common/webplots/lwa-data/qlook_daily/movies/',
+                                    jobs=1, force=False, preset='medium', threads=None, max_hold=6):
     """
     Given a date range in 'YYYY-MM-DD' format, find PNGs under the
     corresponding LWA synoptic image directory and generate a movie per day,
-    restricted to 12:00 of the day to 03:00 of the next day.
+    restricted to 12:00 of the day to 03:00 of the next day. Days whose movie
+    already holds all their PNGs are skipped and days that only gained new
+    PNGs are appended to, unless force is set.
 
     Args:
         start_date_str (str): Start date in 'YYYY-MM-DD'
         end_date_str (str): End date in 'YYYY-MM-DD'
         save_path (str): Directory where movies are saved
+        jobs (int): days rendered concurrently; the cores are split between
+            them through ffmpeg's -threads so they are not oversubscribed
+        preset (str): x264 preset (speed vs. size)
+        threads (int): ffmpeg threads per day instead of the automatic split (0: ffmpeg decides)
+        max_hold (int): longest hold, in movie frames, shown for an observation gap
 
     Returns:
         dict: {date_str: movie_relative_path or None}
     """
     results = {}
+    day_results = []
+    t0 = time.perf_counter()
     try:
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
         end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
-        current_date = start_date
-
-        while current_date <= end_date:
-            date_str = current_date.strftime("%Y-%m-%d")
-            yyyy, mm, dd = current_date.strftime("%Y"), current_date.strftime("%m"), current_date.strftime("%d")
-            img_dir = f"/common/webplots/lwa-data/qlook_images/slow/synop/{yyyy}/{mm}/{dd}"
-            all_png_files = sorted(glob(os.path.join(img_dir, "*.png")))
-
-            if not all_png_files:
-                print(f"[{date_str}] No PNG files found.")
-                results[date_str] = None
-                current_date += timedelta(days=1)
-                continue
-
-            start_time = datetime.combine(current_date, datetime.strptime("12:00:00", "%H:%M:%S").time())
-            end_time = datetime.combine(current_date + timedelta(days=1), datetime.strptime("03:00:00", "%H:%M:%S").time())
-
-            def extract_timestamp(path):
-                base = os.path.basename(path)
-                try:
-                    tstr = base.split("T")[1][:6]  # 'HHMMSS'
-                    dstr = base.split("T")[0].split(".")[-1]  # 'YYYY-MM-DD'
-                    return datetime.strptime(dstr + tstr, "%Y-%m-%d%H%M%S")
-                except Exception:
-                    return None
-
-            png_files = [f for f in all_png_files if (ts := extract_timestamp(f)) and start_time <= ts <= end_time]
-            if not png_files:
-                print(f"[{date_str}] No PNGs in 12:00-03:00 window.")
-                results[date_str] = None
-                current_date += timedelta(days=1)
-                continue
-
-            print(f"[{date_str}] {len(png_files)} PNGs in time window.")
-            temp_dir = tempfile.mkdtemp()
-
-            try:
-                # It creates temporary symbolic links to those files in a temp directory:                
-                for i, f in enumerate(png_files):
-                    os.symlink(f, os.path.join(temp_dir, f"{i:04d}.png"))
-
-                output_name = f"slow_hdf_movie_{yyyy}{mm}{dd}.mp4"
-                output_path = os.path.join(save_path, output_name)
-                print("path: ", os.path.dirname(output_path))
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-framerate", "6",
-                    "-i", os.path.join(temp_dir, "%04d.png"),
-                    "-c:v", "libx264", "-pix_fmt", "yuv420p",
-                    output_path
-                ]
-                subprocess.run(cmd, check=True)
-                results[date_str] = f"{save_path}{output_name}"
-
-            except Exception as e:
-                print(f"[{date_str}] Movie generation failed: {e}")
-                results[date_str] = None
-            finally:
-                # After the movie is generated, it cleans up the temporary symlinks only:
-                shutil.rmtree(temp_dir)
-
-            current_date += timedelta(days=1)
-
     except Exception as e:
         print(f"[ERROR] Failed to process date range: {e}")
-
+        return results
+    dates = []
+    current_date = start_date
+    while current_date <= end_date:
+        dates.append(current_date.strftime("%Y-%m-%d"))
+        current_date += timedelta(days=1)
+
+    jobs = max(1, min(int(jobs), len(dates) or 1))
+    if threads is not None:
+        ffmpeg_threads = int(threads)
+    else:
+        ffmpeg_threads = max(1, (os.cpu_count() or 1) // jobs) if jobs > 1 else 0
+    if jobs == 1:
+        for date_str in dates:
+            day_results.append(render_day_movie(date_str, save_path, ffmpeg_threads, force,
+                                                preset=preset, max_hold=max_hold))
+            print(f"[{date_str}] {day_results[-1]['status']} in {day_results[-1]['seconds']:.1f}s")
+    else:
+        print(f"Rendering {len(dates)} days with {jobs} jobs x {ffmpeg_threads} ffmpeg threads")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(render_day_movie, date_str, save_path, ffmpeg_threads, force, True,
+                                       preset, max_hold): date_str
+                       for date_str in dates}
+            for future in as_completed(futures):
+                try:
+                    day_result = future.result()
+                except Exception as e:
+                    day_result = {'date': futures[future], 'status': 'failed', 'path': None, 'frames': 0,
+                                  'encoded': 0, 'seconds': 0., 'error': str(e)}
+                day_results.append(day_result)
+                print(f"[{day_result['date']}] {day_result['status']} in {day_result['seconds']:.1f}s")
+
+    day_results.sort(key=lambda r: r['date'])
+    for r in day_results:
+        results[r['date']] = r['path']
+    print_movie_summary(day_results, time.perf_counter() - t0)
     return results
 
+def print_movie_summary(day_results, wall_seconds):
+    print(f"\n{'date':<12} {'status':<11} {'frames':>7} {'encoded':>8} {'seconds':>8}")
+    for r in day_results:
+        print(f"{r['date']:<12} {r['status']:<11} {r['frames']:>7d} {r['encoded']:>8d} {r['seconds']:>8.1f}"
+              + (f"  {r['error']}" if r['error'] else ""))
+    counts = {}
+    for r in day_results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    busy = sum(r['seconds'] for r in day_results)
+    print(", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+          + f"; {sum(r['encoded'] for r in day_results)} frames encoded"
+          + f"; wall {wall_seconds:.1f}s, sum of days {busy:.1f}s")
+
 # Example usage:
 # paths = generate_movies_from_date_range('2025-04-25', '2025-04-27')
 # print(paths)
@@ -166,12 +367,18 @@ def main():
     parser.add_argument('--start', required=True, help="Start date in YYYY-MM-DD")
     parser.add_argument('--end', required=True, help="End date in YYYY-MM-DD")
     parser.add_argument('--out', default='/common/webplots/lwa-data/qlook_daily/movies/', help="Output directory (default: /common/webplots/lwa-data/qlook_daily/movies/)")
+    parser.add_argument('--jobs', type=int, default=1, help="Days rendered concurrently (ffmpeg threads are split between them)")
+    parser.add_argument('--force', action='store_true', help="Render from scratch even if a movie is up to date or could be appended to")
+    parser.add_argument('--preset', choices=x264_presets, default='medium', help="x264 preset: faster renders or smaller movies")
+    parser.add_argument('--threads', type=int, default=None, help="ffmpeg threads per day (default: cores / jobs; 0: ffmpeg decides)")
+    parser.add_argument('--max-hold', type=int, default=6, help="Longest hold, in movie frames, shown for a gap in the observations")
 
     args = parser.parse_args()
 
     if args.gen == 'movie':
         print(f"Generating movies from {args.start} to {args.end}...")
-        results = generate_movies_from_date_range(args.start, args.end, save_path=args.out)
+        results = generate_movies_from_date_range(args.start, args.end, save_path=args.out, jobs=args.jobs, force=args.force,
+                                                  preset=args.preset, threads=args.threads, max_hold=args.max_hold)
         print("\nGenerated movie paths:")
         for date_str, path in results.items():
             print(f"{date_str}: {path if path else 'No movie generated'}")
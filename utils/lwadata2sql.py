@@ -1,24 +1,43 @@
 ## lwadata2sql.py
 ## python lwadata2sql.py --start 2025-04-01T00:00:00 --end 2025-05-01T00:00:00
+## python lwadata2sql.py --start 2025-04-01T00:00:00 --end 2025-05-01T00:00:00 --workers 16
+## python lwadata2sql.py --since-last
+## python lwadata2sql.py --watch
+## python lwadata2sql.py --start 2024-01-01T00:00:00 --end 2026-01-01T00:00:00 --full-scan --insert-mode loaddata --commit-every 200000
 ## python lwadata2sql.py --start 2025-04-30T00:00:00 --end 2025-05-01T00:00:00 --delete
+## python lwadata2sql.py --start 2024-01-01T00:00:00 --end 2026-01-01T00:00:00 --backfill-stats
 
 import mysql.connector
 import os
-from glob import glob
+import sys
 from datetime import datetime, timedelta
 import argparse
 import re
+import json
+import time
+import tempfile
+import queue
+import threading
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from astropy.io import fits
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.query_cache import bump_metadata_version
+from core.file_watcher import open_watcher
+
 beam_data_url = os.getenv('LWA_BEAM_FITS_URL', '/nas7a/beam/allday-fits/')
+# Shared with the web app; bumping it invalidates the cached query results
+metadata_version_path = os.getenv('LWA_METADATA_VERSION_PATH', '/home/xychen/lwadata-query-web-utils/lwa_metadata_version.json')
 
 ##=========================connect to database
-def create_lwa_query_db_connection():
+def create_lwa_query_db_connection(allow_local_infile=False):
     return mysql.connector.connect(
         host=os.getenv('FLARE_DB_HOST'),
         database='lwa_metadata_query',#os.getenv('FLARE_DB_DATABASE'),
         user=os.getenv('FLARE_DB_USER'),
-        password=os.getenv('FLARE_DB_PASSWORD')
+        password=os.getenv('FLARE_DB_PASSWORD'),
+        allow_local_infile=allow_local_infile
     )
 # connection = create_lwa_query_db_connection()
 # cursor = connection.cursor()
@@ -54,40 +73,59 @@ def parse_obs_time(filepath, file_type):
     except Exception:
         return None
 
-def filter_and_log(files, file_type, timerange):
+def _read_spec_times(filepath):
+    """parse_obs_time for spec files; module level so a process pool can run it."""
+    return parse_obs_time(filepath, 'spec') or (None, None)
+
+def filter_and_log(files, file_type, timerange, workers=1, failed=None):
     '''Filter a list of files within a given timerange.
+    Parameters:
+        files: file paths, or (file_path, file_size, file_mtime_ns) entries from scan_lwa_files
+        workers: processes reading the spec FITS headers
+        failed: if given, a list the paths that could not be read are appended to
     Return:
-        a list of (file_path, start_time, end_time) tuples for spec files.
-        a list of (file_path, obs_time) tuples for image files, 
+        a list of (file_path, start_time, end_time, file_size, file_mtime_ns) tuples for spec files.
+        a list of (file_path, obs_time, file_size, file_mtime_ns) tuples for image files,
+        with None size/mtime for plain paths
     '''
     print(f"file_type: {file_type}")
     start_range = datetime.strptime(timerange[0], "%Y-%m-%dT%H:%M:%S")
     end_range = datetime.strptime(timerange[1], "%Y-%m-%dT%H:%M:%S")
+    entries = sorted(f if isinstance(f, tuple) else (f, None, None) for f in files)
     result = []
     last_day = None
 
     if file_type == 'spec':
-        for f in sorted(files):
+        candidates = []
+        for entry in entries:
             # First filter based on filename date
-            filename = os.path.basename(f)
-            try:
-                match = re.search(r'\d{4}-\d{2}-\d{2}', filename)
-                if match:
-                    file_date = datetime.strptime(match.group(0), "%Y-%m-%d")
-            except Exception:
+            filename = os.path.basename(entry[0])
+            match = re.search(r'\d{4}-\d{2}-\d{2}', filename)
+            if not match:
                 continue
+            file_date = datetime.strptime(match.group(0), "%Y-%m-%d")
             if file_date < (start_range - timedelta(days=1)) or file_date > (end_range + timedelta(days=1)):
                 continue
-            try:
-                st, ed = parse_obs_time(f, file_type)
-                if ed >= start_range and st <= end_range:
-                    result.append((f, st, ed))
-            except Exception as e:
-                print(f"Warning: Failed to read header for {f} -- {e}")
+            candidates.append(entry)
+        # Header reads dominate on the NAS: spread them over processes
+        paths = [entry[0] for entry in candidates]
+        if workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                times = list(executor.map(_read_spec_times, paths, chunksize=max(1, len(paths) // (4 * workers))))
+        else:
+            times = [_read_spec_times(path) for path in paths]
+        for (f, size, mtime_ns), (st, ed) in zip(candidates, times):
+            if not st or not ed:
+                print(f"Warning: Failed to read header for {f}")
+                if failed is not None:
+                    failed.append(f)
+                continue
+            if ed >= start_range and st <= end_range:
+                result.append((f, st, ed, size, mtime_ns))
         return result
 
     elif file_type.startswith(('mfs_', 'fch_')):
-        for f in sorted(files):
+        for f, size, mtime_ns in entries:
             try:
                 t = parse_obs_time(f, file_type)
                 if not t or not (start_range <= t <= end_range):
@@ -96,35 +134,29 @@ def filter_and_log(files, file_type, timerange):
                 if current_day != last_day:
                     print(current_day)
                     last_day = current_day
-                result.append((f, t))
+                result.append((f, t, size, mtime_ns))
             except Exception as e:
                 print(f"Skipped {f}: {e}")
+                if failed is not None:
+                    failed.append(f)
         return result
     else:
         raise ValueError(f"Unsupported file_type: {file_type}")
 
-def get_path_lwa_files(timerange, file_type="spec"):
+def list_lwa_dirs(timerange, file_type):
     """
-    Parameters:
-        timerange: [start_str, end_str] in ISO format e.g. "2024-01-01T00:00:00"
-        file_type: one of ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
-    Returns:
-        List of file paths matching the type and time range
-    History:
-        2025-04-08, initial version supporting "spec", "slow_lev1", "slow_lev15"
-        2025-06-08, added support for "fch_lev1" and "fch_lev15"
-        2025-06-17, new path/name for spec fits data
+    Directories (and filename pattern) holding the files of file_type around timerange:
+    the spec year directories, or one directory per day for the HDF images.
     """
     start = datetime.strptime(timerange[0], "%Y-%m-%dT%H:%M:%S")
     end = datetime.strptime(timerange[1], "%Y-%m-%dT%H:%M:%S")
     start_1daybf = start - timedelta(days=1)
     end_1dayaf = end + timedelta(days=1)
 
-    files_collected = []
+    dirs = []
     if file_type == "spec":
         for year in range(start_1daybf.year, end_1dayaf.year+1):
-            pattern = f"{beam_data_url}/{year}/*.fits"
-            files_collected += glob(pattern)
+            dirs.append((f"{beam_data_url}/{year}", "*.fits"))
     else:
         # mfs/fch lev1/lev15 HDF files
         image_type, level = file_type.split("_")  # e.g., mfs, lev1
@@ -133,11 +165,118 @@ def get_path_lwa_files(timerange, file_type="spec"):
         date_cursor = start_1daybf
         while date_cursor <= end_1dayaf:
             y, m, d = date_cursor.strftime("%Y"), date_cursor.strftime("%m"), date_cursor.strftime("%d")
-            for disk in ['nas7']:#'nas6', 
-                files_collected += glob(f"/{disk}/ovro-lwa-data/hdf/slow/{level_dir}/{y}/{m}/{d}/{pattern}")
+            for disk in ['nas7']:#'nas6',
+                dirs.append((f"/{disk}/ovro-lwa-data/hdf/slow/{level_dir}/{y}/{m}/{d}", pattern))
             date_cursor += timedelta(days=1)
+    return dirs
+
+def scan_dir(dirpath, pattern, known_mtime_ns=None):
+    """
+    (file_path, file_size, file_mtime_ns) of the files in dirpath matching pattern.
+    Returns:
+        (dir_mtime_ns, entries); entries is None when the directory mtime equals
+        known_mtime_ns (no file added, removed or renamed since), and dir_mtime_ns
+        is None when the directory does not exist or a file could not be stat'ed
+        (so it is not recorded as scanned and is listed again next time)
+    """
+    try:
+        # Taken before listing, so files arriving during the scan are seen next time
+        dir_mtime_ns = os.stat(dirpath).st_mtime_ns
+    except FileNotFoundError:
+        return None, []
+    if known_mtime_ns is not None and dir_mtime_ns == known_mtime_ns:
+        return dir_mtime_ns, None
+    found = []
+    complete = True
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if not fnmatch(entry.name, pattern):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError as e:
+                    print(f"Skipped {entry.path}: {e}")
+                    complete = False
+                    continue
+                found.append((entry.path, st.st_size, st.st_mtime_ns))
+    except FileNotFoundError:
+        pass
+    return (dir_mtime_ns if complete else None), found
+
+def dir_coverage(dirpath, timerange):
+    """
+    Part of timerange a directory has to have been ingested for to be skipped:
+    timerange clipped to the days its files can cover (a day directory
+    YYYY/MM/DD, or a spec year directory, with a day of margin either side),
+    so a past day stays covered whatever range later runs ask for.
+    """
+    match = re.search(r'/(\d{4})/(\d{2})/(\d{2})$', dirpath)
+    if match:
+        lo = datetime(*map(int, match.groups()))
+        hi = lo + timedelta(days=1)
+    else:
+        match = re.search(r'/(\d{4})$', dirpath)
+        if not match:
+            return timerange[0], timerange[1]
+        lo = datetime(int(match.group(1)), 1, 1)
+        hi = datetime(int(match.group(1)) + 1, 1, 1)
+    lo = (lo - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S")
+    hi = (hi + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S")
+    return max(timerange[0], lo), min(timerange[1], hi)
+
+def scan_lwa_files(timerange, file_types, workers=8, dir_state=None):
+    """
+    Scan the directories of all file_types concurrently (NAS latency bound).
+    Parameters:
+        dir_state: {file_type: {dirpath: [mtime_ns, covered_start, covered_end]}}
+            from previous runs; a directory is not listed again if its mtime is
+            unchanged and its dir_coverage() of timerange was already ingested
+    Returns:
+        scanned: {file_type: [(file_path, file_size, file_mtime_ns), ...]}
+        dir_mtimes: {file_type: {dirpath: mtime_ns}} of the directories listed
+        skipped: {file_type: number of unchanged directories}
+    """
+    dir_state = dir_state or {}
+    jobs = [(file_type, dirpath, pattern) for file_type in file_types
+            for dirpath, pattern in list_lwa_dirs(timerange, file_type)]
+    scanned = {file_type: [] for file_type in file_types}
+    dir_mtimes = {file_type: {} for file_type in file_types}
+    skipped = {file_type: 0 for file_type in file_types}
+
+    def scan(job):
+        file_type, dirpath, pattern = job
+        known = dir_state.get(file_type, {}).get(dirpath)
+        needed = dir_coverage(dirpath, timerange)
+        covered = known and known[1] <= needed[0] and needed[1] <= known[2]
+        return scan_dir(dirpath, pattern, known[0] if covered else None)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for (file_type, dirpath, _), (dir_mtime_ns, found) in zip(jobs, executor.map(scan, jobs)):
+            if found is None:
+                skipped[file_type] += 1
+                continue
+            scanned[file_type].extend(found)
+            if dir_mtime_ns is not None:
+                dir_mtimes[file_type][dirpath] = dir_mtime_ns
+    return scanned, dir_mtimes, skipped
+
+def get_path_lwa_files(timerange, file_type="spec", workers=8):
+    """
+    Parameters:
+        timerange: [start_str, end_str] in ISO format e.g. "2024-01-01T00:00:00"
+        file_type: one of ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
+        workers: directory scan threads / FITS header processes
+    Returns:
+        List of file paths matching the type and time range
+    History:
+        2025-04-08, initial version supporting "spec", "slow_lev1", "slow_lev15"
+        2025-06-08, added support for "fch_lev1" and "fch_lev15"
+        2025-06-17, new path/name for spec fits data
+    """
+    files_collected = scan_lwa_files(timerange, [file_type], workers=workers)[0][file_type]
     # Filter and return sorted paths
-    files_filtered = filter_and_log(files_collected, file_type, timerange)
+    files_filtered = filter_and_log(files_collected, file_type, timerange, workers=workers)
     files_sorted = [f for f, *_ in files_filtered]
     return files_sorted
 
@@ -147,7 +286,129 @@ def get_path_lwa_files(timerange, file_type="spec"):
 #     print(f"{file_type}: {len(files)} found")
 
 ##=========================
-def insert_file_list_to_mysql(file_list, file_type, batch_size=1000):
+# Insert strategies for bulk_insert_rows(), fastest last:
+#   executemany: batch_size rows per INSERT statement (the connector
+#       rewrites them into one multi-row statement)
+#   values: multi-row INSERT statements as large as max_allowed_packet allows
+#   loaddata: LOAD DATA LOCAL INFILE from a temporary file (needs local_infile
+#       enabled on the server)
+# Rows whose unique key exists are skipped (INSERT IGNORE / LOAD DATA IGNORE), or
+# with update_columns overwritten (ON DUPLICATE KEY UPDATE / LOAD DATA REPLACE).
+insert_modes = ('executemany', 'values', 'loaddata')
+
+def _load_data_field(value):
+    """A value in the default LOAD DATA format (tab separated, backslash escaped, \\N for NULL)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def bulk_insert_rows(connection, table, columns, rows, mode='executemany', batch_size=1000,
+                     commit_every=None, label=None, verbose=True, update_columns=None):
+    """
+    INSERT IGNORE rows into table, or upsert them if update_columns is given.
+    Parameters:
+        columns: column names, in the order of the values in each row
+        mode: one of insert_modes
+        update_columns: columns overwritten when a row with the same unique key
+            exists (loaddata replaces the whole row)
+        batch_size: rows per statement in executemany mode
+        commit_every: rows per transaction (default: one per statement, or a
+            single transaction for loaddata)
+        verbose: print a line per statement
+    Returns:
+        number of rows inserted, as affected rows: duplicates of uq_file_path
+        count 0 if skipped or unchanged, 2 if updated (loaddata: replaced)
+    """
+    if mode not in insert_modes:
+        raise ValueError(f"Unsupported insert mode: {mode}")
+    label = label or table
+    cols = ", ".join(columns)
+    row_sql = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    insert_verb = "INSERT INTO" if update_columns else "INSERT IGNORE INTO"
+    on_duplicate = (" ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in update_columns)
+                    if update_columns else "")
+    cursor = connection.cursor()
+    inserted_total = 0
+    uncommitted = 0
+
+    def flush(n):
+        nonlocal inserted_total, uncommitted
+        inserted_total += max(cursor.rowcount, 0)
+        uncommitted += n
+        if commit_every is None or uncommitted >= commit_every:
+            connection.commit()
+            uncommitted = 0
+
+    try:
+        if mode == 'executemany':
+            insert_sql = f"{insert_verb} {table} ({cols}) VALUES {row_sql}{on_duplicate}"
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                cursor.executemany(insert_sql, batch)
+                flush(len(batch))
+                if verbose:
+                    print(f"[{label}] Inserted batch of {len(batch)} at item {i + len(batch)} / {len(rows)}")
+
+        elif mode == 'values':
+            cursor.execute("SELECT @@max_allowed_packet")
+            max_packet = int(cursor.fetchone()[0])
+            # Headroom for quoting/escaping done by the connector
+            budget = int(max_packet * 0.8)
+            prefix = f"{insert_verb} {table} ({cols}) VALUES "
+            batch, size = [], len(prefix)
+            for i, row in enumerate(rows):
+                row_size = 8 + sum(2 * len(str(v)) + 4 for v in row)
+                if batch and size + row_size > budget:
+                    cursor.execute(prefix + ", ".join([row_sql] * len(batch)) + on_duplicate, [v for r in batch for v in r])
+                    flush(len(batch))
+                    if verbose:
+                        print(f"[{label}] Inserted {len(batch)} rows ({size / 1e6:.1f} MB statement) at item {i} / {len(rows)}")
+                    batch, size = [], len(prefix)
+                batch.append(row)
+                size += row_size
+            if batch:
+                cursor.execute(prefix + ", ".join([row_sql] * len(batch)) + on_duplicate, [v for r in batch for v in r])
+                flush(len(batch))
+                if verbose:
+                    print(f"[{label}] Inserted final {len(batch)} rows")
+
+        else:
+            chunk = commit_every or len(rows) or 1
+            for i in range(0, len(rows), chunk):
+                with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', delete=False) as f:
+                    tmp_path = f.name
+                    for row in rows[i:i + chunk]:
+                        f.write("\t".join(_load_data_field(v) for v in row) + "\n")
+                try:
+                    cursor.execute(f"LOAD DATA LOCAL INFILE %s {'REPLACE' if update_columns else 'IGNORE'} INTO TABLE {table} "
+                                   f"CHARACTER SET utf8mb4 ({cols})", (tmp_path,))
+                finally:
+                    os.remove(tmp_path)
+                n = min(chunk, len(rows) - i)
+                flush(n)
+                if verbose:
+                    print(f"[{label}] Loaded {n} rows at item {i + n} / {len(rows)}")
+
+        if uncommitted:
+            connection.commit()
+    finally:
+        cursor.close()
+    return inserted_total
+
+def insert_file_records_to_mysql(records, file_type, batch_size=1000, mode='executemany', commit_every=None, verbose=True):
+    """
+    Parameters:
+        records: rows from filter_and_log() / file_records(), already parsed and stat'ed:
+            spec: (file_path, start_time, end_time, file_size, file_mtime_ns)
+            image: (file_path, obs_time, file_size, file_mtime_ns)
+        mode, commit_every, verbose: see bulk_insert_rows()
+    Rows of files already in MySQL are updated, so a file reprocessed in place
+    gets its new size and mtime (which key the data bundles).
+    Returns:
+        number of rows inserted or updated (affected rows, see bulk_insert_rows())
+    """
     # # table_map = {
     # #     'fast_hdf': 'lwa_fast_hdf_files',
     # #     'slow_hdf': 'lwa_slow_hdf_files',
@@ -169,63 +430,102 @@ def insert_file_list_to_mysql(file_list, file_type, batch_size=1000):
     if file_type not in table_map:
         raise ValueError(f"Unsupported file_type: {file_type}")
 
-    table = table_map[file_type]
-    batch = []
-    inserted_total = 0
-    connection = create_lwa_query_db_connection()
-    cursor = connection.cursor()
+    # Sizes and mtimes are recorded so the web app never has to stat the files
+    if file_type == 'spec':
+        columns = ('file_path', 'start_time', 'end_time', 'file_size', 'file_mtime_ns')
+        update_columns = ('start_time', 'end_time', 'file_size', 'file_mtime_ns')
+    else:
+        columns = ('file_path', 'obs_time', 'file_size', 'file_mtime_ns')
+        update_columns = ('file_size', 'file_mtime_ns')
 
-    for i, file_path in enumerate(file_list):
+    connection = create_lwa_query_db_connection(allow_local_infile=(mode == 'loaddata'))
+    try:
+        inserted_total = bulk_insert_rows(connection, table_map[file_type], columns, list(records), mode=mode,
+                                          batch_size=batch_size, commit_every=commit_every, label=file_type,
+                                          verbose=verbose, update_columns=update_columns)
+    finally:
+        connection.close()
+    if verbose:
+        print(f"[{file_type}] Total affected rows (inserted 1, updated 2): {inserted_total} for {len(records)} records")
+    return inserted_total
+
+def file_records(file_list, file_type):
+    """Parse and stat plain paths into the rows insert_file_records_to_mysql() takes."""
+    records = []
+    for file_path in file_list:
+        try:
+            st = os.stat(file_path)
+        except OSError as e:
+            print(f"Skipped {file_path}: {e}")
+            continue
         if file_type == 'spec':
-            start_time, end_time = parse_obs_time(file_path, file_type)
+            start_time, end_time = parse_obs_time(file_path, file_type) or (None, None)
             if not start_time or not end_time:
+                print(f"Warning: Failed to read header for {file_path}")
                 continue
-            batch.append((file_path, start_time, end_time))
-
-            if len(batch) >= batch_size:
-                cursor.executemany(
-                    f"INSERT IGNORE INTO {table} (file_path, start_time, end_time) VALUES (%s, %s, %s)",
-                    batch
-                )
-                inserted_total += cursor.rowcount
-                connection.commit()
-                print(f"[{file_type}] Committed batch of {len(batch)} at item {i+1} / {len(file_list)}")
-                batch.clear()
-
+            records.append((file_path, start_time, end_time, st.st_size, st.st_mtime_ns))
         else:
             obs_time = parse_obs_time(file_path, file_type)
             if not obs_time:
                 continue
-            batch.append((file_path, obs_time))
+            records.append((file_path, obs_time, st.st_size, st.st_mtime_ns))
+    return records
+
+def insert_file_list_to_mysql(file_list, file_type, batch_size=1000):
+    return insert_file_records_to_mysql(file_records(file_list, file_type), file_type, batch_size=batch_size)
 
+def backfill_file_stats(timerange, file_types=None, batch_size=1000):
+    """
+    Record file_size and file_mtime_ns of rows ingested before these columns
+    existed. Rows whose file is gone are left NULL.
+    """
+    table_map = {
+        'spec':        ('lwa_spec_fits_files', 'start_time'),
+        'mfs_lev1':    ('lwa_slow_mfs_lev1_hdf_files', 'obs_time'),
+        'mfs_lev15':   ('lwa_slow_mfs_lev15_hdf_files', 'obs_time'),
+        'fch_lev1':    ('lwa_slow_fch_lev1_hdf_files', 'obs_time'),
+        'fch_lev15':   ('lwa_slow_fch_lev15_hdf_files', 'obs_time')
+    }
+    start = datetime.strptime(timerange[0], "%Y-%m-%dT%H:%M:%S")
+    end = datetime.strptime(timerange[1], "%Y-%m-%dT%H:%M:%S")
+    connection = create_lwa_query_db_connection()
+    cursor = connection.cursor()
+    updated_total = 0
+    for file_type in (file_types or table_map.keys()):
+        table, time_column = table_map[file_type]
+        cursor.execute(
+            f"SELECT file_path, {time_column} FROM {table} "
+            f"WHERE {time_column} BETWEEN %s AND %s AND file_size IS NULL",
+            (start, end)
+        )
+        rows = cursor.fetchall()
+        batch = []
+        updated = 0
+        for file_path, t in rows:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            # The time column lets MySQL prune the partitions of the image tables
+            batch.append((st.st_size, st.st_mtime_ns, file_path, t))
             if len(batch) >= batch_size:
-                cursor.executemany(
-                    f"INSERT IGNORE INTO {table} (file_path, obs_time) VALUES (%s, %s)",
-                    batch
-                )
-                inserted_total += cursor.rowcount
+                cursor.executemany(f"UPDATE {table} SET file_size = %s, file_mtime_ns = %s "
+                                   f"WHERE file_path = %s AND {time_column} = %s", batch)
                 connection.commit()
-                print(f"[{file_type}] Committed batch of {len(batch)} at item {i+1} / {len(file_list)}")
+                updated += len(batch)
                 batch.clear()
-
-    if batch:
-        if file_type == 'spec':
-            cursor.executemany(
-                f"INSERT IGNORE INTO {table} (file_path, start_time, end_time) VALUES (%s, %s, %s)",
-                batch
-            )
-        else:
-            cursor.executemany(
-                f"INSERT IGNORE INTO {table} (file_path, obs_time) VALUES (%s, %s)",
-                batch
-            )
-        inserted_total += cursor.rowcount
-        connection.commit()
-        print(f"[{file_type}] Final batch committed with {len(batch)} entries")
-
+        if batch:
+            cursor.executemany(f"UPDATE {table} SET file_size = %s, file_mtime_ns = %s "
+                               f"WHERE file_path = %s AND {time_column} = %s", batch)
+            connection.commit()
+            updated += len(batch)
+        print(f"[{file_type}] Recorded sizes of {updated} / {len(rows)} rows")
+        updated_total += updated
     cursor.close()
     connection.close()
-    print(f"[{file_type}] Total Inserted: {inserted_total}, Skipped: {len(file_list) - inserted_total}")
+    if updated_total:
+        notify_metadata_changed(timerange)
+    return updated_total
 
 # # ##=========================
 # file_types = ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
@@ -237,6 +537,102 @@ def insert_file_list_to_mysql(file_list, file_type, batch_size=1000):
 #     insert_file_list_to_mysql(files, file_type)
 
 
+##=========================
+def notify_metadata_changed(timerange):
+    """
+    Tell the web app that rows within timerange changed, so cached query results get dropped.
+    The range is padded by one day since spec files span the day boundary.
+    """
+    start = datetime.strptime(timerange[0], "%Y-%m-%dT%H:%M:%S") - timedelta(days=1)
+    end = datetime.strptime(timerange[1], "%Y-%m-%dT%H:%M:%S") + timedelta(days=1)
+    try:
+        version = bump_metadata_version(metadata_version_path, [start, end])
+        print(f"Metadata version bumped to {version} for {timerange[0]} - {timerange[1]}")
+    except OSError as e:
+        print(f"Warning: failed to bump metadata version at {metadata_version_path} -- {e}")
+
+##=========================
+# Availability segments: per image product, the (start, end) spans of files
+# whose consecutive obs_times are at most segment_max_gap_seconds apart.
+# Must match availability_max_gap_seconds in blueprints/example.py.
+segment_max_gap_seconds = 600
+segment_table = 'lwa_availability_segments'
+image_table_map = {
+    'mfs_lev1':    'lwa_slow_mfs_lev1_hdf_files',
+    'mfs_lev15':   'lwa_slow_mfs_lev15_hdf_files',
+    'fch_lev1':    'lwa_slow_fch_lev1_hdf_files',
+    'fch_lev15':   'lwa_slow_fch_lev15_hdf_files'
+}
+
+def compress_time_segments(times, max_gap_seconds=segment_max_gap_seconds):
+    '''Sorted datetimes -> list of (start, end, n_files) continuous spans.'''
+    if not times:
+        return []
+    max_gap = timedelta(seconds=max_gap_seconds)
+    segments = []
+    start = prev = times[0]
+    n = 1
+    for t in times[1:]:
+        if t - prev > max_gap:
+            segments.append((start, prev, n))
+            start = t
+            n = 0
+        prev = t
+        n += 1
+    segments.append((start, prev, n))
+    return segments
+
+def update_availability_segments(timerange, file_type):
+    '''
+    Recompute the availability segments of one image product around timerange.
+    The window is widened to every stored segment within max gap of the range,
+    so segments that merge or split because of the change are rewritten whole.
+    '''
+    if file_type not in image_table_map:
+        raise ValueError(f"Unsupported file_type for segments: {file_type}")
+    table = image_table_map[file_type]
+    gap = timedelta(seconds=segment_max_gap_seconds)
+    start = datetime.strptime(timerange[0], "%Y-%m-%dT%H:%M:%S")
+    end = datetime.strptime(timerange[1], "%Y-%m-%dT%H:%M:%S")
+
+    connection = create_lwa_query_db_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT MIN(seg_start), MAX(seg_end) FROM {segment_table} "
+        "WHERE product = %s AND seg_end >= %s AND seg_start <= %s",
+        (file_type, start - gap, end + gap)
+    )
+    seg_min, seg_max = cursor.fetchone()
+    lo = min(start - gap, seg_min) if seg_min else start - gap
+    hi = max(end + gap, seg_max) if seg_max else end + gap
+
+    cursor.execute(
+        f"SELECT obs_time FROM {table} WHERE obs_time BETWEEN %s AND %s ORDER BY obs_time",
+        (lo, hi)
+    )
+    segments = compress_time_segments([row[0] for row in cursor.fetchall()])
+
+    cursor.execute(
+        f"DELETE FROM {segment_table} WHERE product = %s AND seg_end >= %s AND seg_start <= %s",
+        (file_type, lo, hi)
+    )
+    deleted = cursor.rowcount
+    if segments:
+        cursor.executemany(
+            f"INSERT INTO {segment_table} (product, seg_start, seg_end, n_files) VALUES (%s, %s, %s, %s)",
+            [(file_type, st, ed, n) for st, ed, n in segments]
+        )
+    connection.commit()
+    cursor.close()
+    connection.close()
+    print(f"[{file_type}] Segments between {lo} and {hi}: replaced {deleted} with {len(segments)}")
+
+def rebuild_availability_segments(timerange, file_types=None):
+    '''Rebuild segments of all (or the given) image products for a time range.'''
+    for file_type in (file_types or image_table_map.keys()):
+        update_availability_segments(timerange, file_type)
+    notify_metadata_changed(timerange)
+
 ##=========================
 def delete_files_from_mysql(timerange, file_type=None):
     """
@@ -275,33 +671,370 @@ def delete_files_from_mysql(timerange, file_type=None):
     connection.commit()
     cursor.close()
     connection.close()
+    for key in targets:
+        if key in image_table_map:
+            update_availability_segments(timerange, key)
+    forget_ingest_dirs(timerange, [key for key in targets if key in table_map])
+    notify_metadata_changed(timerange)
 
 # delete_files_from_mysql(['2024-12-20T00:00:00', '2025-01-15T00:00:00']) ##will delete all files
 # delete_files_from_mysql(['2024-12-20T00:00:00', '2025-01-15T00:00:00'], file_type="spec") ##will delete spec files
 
 
+##=========================
+# Ingest state: per product, the last ingested obs_time and, per directory
+# already scanned, its mtime and the time range ingested from it. A directory
+# only changes mtime when files are added, removed or renamed into it, so an
+# unchanged one is not listed again for a range it already covered. Files
+# rewritten in place are not detected (--full-scan rescans everything).
+ingest_state_path = os.getenv('LWA_INGEST_STATE_PATH', '/home/xychen/lwadata-query-web-utils/lwa_ingest_state.json')
+
+def load_ingest_state(path=ingest_state_path):
+    """{file_type: {'last_obs_time': ISO str, 'dirs': {dirpath: [mtime_ns, covered_start, covered_end]}}}"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_ingest_state(state, path=ingest_state_path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def forget_ingest_dirs(timerange, file_types=None, path=ingest_state_path):
+    """Drop the directory mtimes of timerange so the next ingest rescans them (after a delete)."""
+    state = load_ingest_state(path)
+    if not state:
+        return
+    for file_type in (file_types or list(state.keys())):
+        dirs = state.get(file_type, {}).get('dirs', {})
+        for dirpath, _ in list_lwa_dirs(timerange, file_type):
+            dirs.pop(dirpath, None)
+    save_ingest_state(state, path)
+
+def since_last_start(state, file_types, lookback_hours=24., now=None):
+    """
+    Earliest last_obs_time over file_types, and at least lookback_hours before
+    now (UTC) so files arriving late with an older obs_time are still picked up
+    (directories unchanged since they were ingested are skipped anyway).
+    None if any product was never ingested.
+    """
+    times = [state.get(file_type, {}).get('last_obs_time') for file_type in file_types]
+    if not times or None in times:
+        return None
+    lookback = ((now or datetime.utcnow()) - timedelta(hours=lookback_hours)).strftime("%Y-%m-%dT%H:%M:%S")
+    return min(min(times), lookback)
+
+def existing_file_stats(cursor, file_type, records):
+    """
+    {file_path: (file_size, file_mtime_ns)} of records already in MySQL, looked
+    up one day at a time over the span of the records (spec: start_time,
+    images: obs_time, both indexed).
+    """
+    table_map = {
+        'spec':        ('lwa_spec_fits_files', 'start_time'),
+        'mfs_lev1':    ('lwa_slow_mfs_lev1_hdf_files', 'obs_time'),
+        'mfs_lev15':   ('lwa_slow_mfs_lev15_hdf_files', 'obs_time'),
+        'fch_lev1':    ('lwa_slow_fch_lev1_hdf_files', 'obs_time'),
+        'fch_lev15':   ('lwa_slow_fch_lev15_hdf_files', 'obs_time')
+    }
+    table, time_column = table_map[file_type]
+    days = {}
+    for record in records:
+        t = record[1]
+        lo, hi = days.get(t.date(), (t, t))
+        days[t.date()] = (min(lo, t), max(hi, t))
+    existing = {}
+    for lo, hi in days.values():
+        cursor.execute(f"SELECT file_path, file_size, file_mtime_ns FROM {table} "
+                       f"WHERE {time_column} BETWEEN %s AND %s", (lo, hi))
+        existing.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+    return existing
+
+def ingest_lwa_files(timerange, file_types=None, workers=8, full_scan=False, insert_mode='executemany', commit_every=None):
+    """
+    Scan, parse and insert the new files of file_types in timerange, then update
+    the availability segments. The directories of all days and products are
+    scanned concurrently; spec FITS headers are read by a process pool.
+    Directories unchanged since the last run are skipped (unless full_scan),
+    and files already in MySQL with the same size and mtime are not sent again
+    (rewritten ones are, and their rows updated). insert_mode and
+    commit_every are passed to bulk_insert_rows().
+    """
+    file_types = file_types or ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
+    state = load_ingest_state()
+    t0 = time.perf_counter()
+    dir_state = None if full_scan else {file_type: state.get(file_type, {}).get('dirs', {}) for file_type in file_types}
+    scanned, dir_mtimes, skipped_dirs = scan_lwa_files(timerange, file_types, workers=workers, dir_state=dir_state)
+    t_scan = time.perf_counter() - t0
+    print(f"Scanned {sum(len(v) for v in dir_mtimes.values())} directories "
+          f"({sum(skipped_dirs.values())} unchanged, skipped), "
+          f"{sum(len(v) for v in scanned.values())} files in {t_scan:.2f}s ({workers} workers)")
+
+    timings = []
+    any_inserted = False
+    connection = create_lwa_query_db_connection()
+    cursor = connection.cursor()
+    try:
+        for file_type in file_types:
+            t0 = time.perf_counter()
+            failed = []
+            records = filter_and_log(scanned[file_type], file_type, timerange, workers=workers, failed=failed)
+            existing = existing_file_stats(cursor, file_type, records) if records else {}
+            # The lookup is a consistent read; end it so later lookups see the new rows
+            connection.commit()
+            # Files rewritten since they were ingested (or rows without stats) are sent again and updated
+            new_records = [record for record in records if existing.get(record[0]) != (record[-2], record[-1])]
+            n_changed = sum(1 for record in new_records if record[0] in existing)
+            t_parse = time.perf_counter() - t0
+            print(f"{file_type}: {len(records)} found, {len(records) - len(new_records)} already ingested, "
+                  f"{len(new_records) - n_changed} new, {n_changed} changed")
+            # Insert to MySQL
+            t0 = time.perf_counter()
+            inserted = insert_file_records_to_mysql(new_records, file_type, mode=insert_mode,
+                                                    commit_every=commit_every) if new_records else 0
+            t_insert = time.perf_counter() - t0
+            print(f"Success for {file_type}!")
+            t0 = time.perf_counter()
+            if inserted and file_type in image_table_map:
+                update_availability_segments(timerange, file_type)
+            t_segments = time.perf_counter() - t0
+            any_inserted = any_inserted or bool(inserted)
+            timings.append((file_type, skipped_dirs[file_type], len(records), len(records) - len(new_records),
+                            inserted, t_parse, t_insert, t_segments))
+
+            # Only recorded once the rows are in, so a failed run is retried; so are
+            # directories holding a file that could not be read
+            entry = state.setdefault(file_type, {})
+            dirs = entry.setdefault('dirs', {})
+            failed_dirs = {os.path.dirname(f) for f in failed}
+            for dirpath, mtime_ns in dir_mtimes[file_type].items():
+                if dirpath in failed_dirs:
+                    dirs.pop(dirpath, None)
+                    continue
+                known = dirs.get(dirpath)
+                covered = dir_coverage(dirpath, timerange)
+                if known and known[0] == mtime_ns and known[1] <= covered[1] and covered[0] <= known[2]:
+                    # Unchanged and overlapping: the covered range grows
+                    dirs[dirpath] = [mtime_ns, min(known[1], covered[0]), max(known[2], covered[1])]
+                else:
+                    dirs[dirpath] = [mtime_ns, covered[0], covered[1]]
+            if records:
+                last = max(record[1] for record in records).strftime("%Y-%m-%dT%H:%M:%S")
+                entry['last_obs_time'] = max(last, entry.get('last_obs_time') or last)
+            save_ingest_state(state)
+    finally:
+        cursor.close()
+        connection.close()
+
+    if any_inserted:
+        notify_metadata_changed(timerange)
+
+    print(f"{'type':<10} {'dirs_skip':>9} {'matched':>8} {'known':>8} {'inserted':>8} {'parse':>8} {'insert':>8} {'segments':>8}")
+    for file_type, n_skipped, n_matched, n_known, inserted, t_parse, t_insert, t_segments in timings:
+        print(f"{file_type:<10} {n_skipped:>9d} {n_matched:>8d} {n_known:>8d} {inserted:>8d} "
+              f"{t_parse:>7.2f}s {t_insert:>7.2f}s {t_segments:>7.2f}s")
+    print(f"scan: {t_scan:.2f}s (all types)")
+
+
+##=========================
+# Watch mode: new files are inserted within seconds of landing instead of at
+# the next cron run. A watcher thread (core.file_watcher) feeds a bounded
+# queue; when inserts fall behind, the queue fills and the watcher blocks
+# (inotify events wait in the kernel queue, polling simply checks later).
+def watch_targets(file_types, now=None):
+    """{dirpath: [(pattern, file_type)]} of the directories around now (UTC)."""
+    now = now or datetime.utcnow()
+    timerange = [(now - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S"), now.strftime("%Y-%m-%dT%H:%M:%S")]
+    targets = {}
+    for file_type in file_types:
+        for dirpath, pattern in list_lwa_dirs(timerange, file_type):
+            targets.setdefault(dirpath, []).append((pattern, file_type))
+    return targets
+
+def flush_watch_batch(batch, insert_mode='executemany', max_queued=0, queued=0):
+    """Insert a batch of (file_type, path, detected_at) from the watcher and print one metrics line."""
+    t0 = time.perf_counter()
+    by_type = {}
+    for file_type, path, _ in batch:
+        by_type.setdefault(file_type, set()).add(path)
+    inserted_total = 0
+    changed = []
+    for file_type, paths in by_type.items():
+        records = file_records(sorted(paths), file_type)
+        inserted = insert_file_records_to_mysql(records, file_type, mode=insert_mode, verbose=False) if records else 0
+        if inserted:
+            lo = min(record[1] for record in records).strftime("%Y-%m-%dT%H:%M:%S")
+            hi = max(record[2] if file_type == 'spec' else record[1] for record in records).strftime("%Y-%m-%dT%H:%M:%S")
+            changed.append((lo, hi))
+            if file_type in image_table_map:
+                update_availability_segments([lo, hi], file_type)
+        inserted_total += inserted
+    if changed:
+        notify_metadata_changed([min(lo for lo, _ in changed), max(hi for _, hi in changed)])
+    latency = time.monotonic() - min(detected_at for _, _, detected_at in batch)
+    counts = ", ".join(f"{file_type}={len(paths)}" for file_type, paths in sorted(by_type.items()))
+    print(f"[watch {datetime.utcnow():%Y-%m-%d %H:%M:%S}] {len(batch)} files ({counts}), "
+          f"{inserted_total} inserted in {time.perf_counter() - t0:.2f}s, "
+          f"oldest waited {latency:.1f}s, queue {queued}/{max_queued}", flush=True)
+    return inserted_total
+
+def watch_lwa_files(file_types=None, mode='auto', batch_seconds=5., max_batch=5000, max_queued=20000,
+                    poll_seconds=10., refresh_seconds=60., insert_mode='executemany', workers=8,
+                    max_retry_seconds=300.):
+    """
+    Catch up on the last day, then insert new files as they land until interrupted.
+    Parameters:
+        mode: watcher kind, 'inotify', 'poll' or 'auto' (see core.file_watcher.open_watcher)
+        batch_seconds: files are inserted once the oldest waiting one is this old
+        max_batch: or as soon as this many are waiting
+        max_queued: bound of the queue between watcher and inserter (backpressure)
+        poll_seconds: directory check interval of the polling watcher
+        refresh_seconds: how often the watched day directories are recomputed
+        max_retry_seconds: a batch whose insert failed (e.g. MySQL unreachable) is
+            kept and retried after batch_seconds, doubling up to this
+    """
+    file_types = file_types or ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
+    targets = watch_targets(file_types)
+    watcher = open_watcher(list(targets), mode=mode, interval=poll_seconds)
+    # Registered before the catch-up scan so nothing landing meanwhile is missed
+    watcher.watch({dirpath: [p for p, _ in patterns] for dirpath, patterns in targets.items()}, report_existing=False)
+    print(f"Watching {len(targets)} directories with {watcher.kind}")
+    now = datetime.utcnow()
+    ingest_lwa_files([(now - timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S"), now.strftime("%Y-%m-%dT%H:%M:%S")],
+                     file_types, workers=workers, insert_mode=insert_mode)
+
+    pending = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    failure = []
+
+    def produce():
+        nonlocal targets
+        refreshed = time.monotonic()
+        try:
+            while not stop.is_set():
+                if time.monotonic() - refreshed >= refresh_seconds:
+                    targets = watch_targets(file_types)
+                    watcher.watch({dirpath: [p for p, _ in patterns] for dirpath, patterns in targets.items()})
+                    refreshed = time.monotonic()
+                for path in watcher.poll(timeout=1.):
+                    dirpath, name = os.path.split(path)
+                    for pattern, file_type in targets.get(dirpath, []):
+                        if fnmatch(name, pattern):
+                            # Blocks while the inserter is behind
+                            pending.put((file_type, path, time.monotonic()))
+        except Exception as e:
+            failure.append(e)
+            raise
+
+    producer = threading.Thread(target=produce, name='lwa-watcher', daemon=True)
+    producer.start()
+    batch = []
+    retry_delay = 0.
+    retry_at = 0.
+    try:
+        while True:
+            if not producer.is_alive():
+                raise RuntimeError(f"Watcher stopped: {failure[0] if failure else 'unknown error'}")
+            oldest = min((detected_at for _, _, detected_at in batch), default=None)
+            timeout = batch_seconds if oldest is None else oldest + batch_seconds - time.monotonic()
+            timeout = min(max(0.05, timeout, retry_at - time.monotonic()), 1.)
+            if len(batch) < max_batch:
+                try:
+                    batch.append(pending.get(timeout=timeout))
+                except queue.Empty:
+                    pass
+            else:
+                # Full batch waiting for a retry: leave the rest queued (backpressure)
+                time.sleep(timeout)
+            oldest = min((detected_at for _, _, detected_at in batch), default=None)
+            if batch and time.monotonic() >= retry_at and \
+                    (len(batch) >= max_batch or time.monotonic() - oldest >= batch_seconds):
+                while len(batch) < max_batch:
+                    try:
+                        batch.append(pending.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    flush_watch_batch(batch, insert_mode=insert_mode, max_queued=max_queued, queued=pending.qsize())
+                except Exception as e:
+                    retry_delay = min(retry_delay * 2 if retry_delay else batch_seconds, max_retry_seconds)
+                    retry_at = time.monotonic() + retry_delay
+                    print(f"[watch {datetime.utcnow():%Y-%m-%d %H:%M:%S}] Inserting {len(batch)} files failed: {e}; "
+                          f"retrying in {retry_delay:g}s", flush=True)
+                    continue
+                batch = []
+                retry_delay = 0.
+                retry_at = 0.
+    except KeyboardInterrupt:
+        print("Stopping, inserting the files still waiting")
+        stop.set()
+        while True:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                flush_watch_batch(batch, insert_mode=insert_mode, max_queued=max_queued, queued=0)
+            except Exception as e:
+                print(f"Inserting the last {len(batch)} files failed: {e}; the next ingest run picks them up")
+    finally:
+        stop.set()
+        watcher.close()
+
+
 ##=========================
 def main():
     parser = argparse.ArgumentParser(description="Insert or delete LWA metadata in MySQL")
-    parser.add_argument('--start', required=True, help="Start time in format YYYY-MM-DDTHH:MM:SS")
-    parser.add_argument('--end', required=True, help="End time in format YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument('--start', help="Start time in format YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument('--end', help="End time in format YYYY-MM-DDTHH:MM:SS (default: now, UTC, with --since-last)")
+    parser.add_argument('--since-last', action='store_true', help="Ingest from the last ingested obs_time of each product up to --end")
+    parser.add_argument('--lookback-hours', type=float, default=24.,
+                        help="With --since-last, start at least this many hours ago to catch late files (default: 24)")
+    parser.add_argument('--full-scan', action='store_true', help="List every directory even if unchanged since the last ingest")
     parser.add_argument('--delete', action='store_true', help="If set, delete records instead of inserting")
+    parser.add_argument('--rebuild-segments', action='store_true', help="Only rebuild the availability segments for the time range")
+    parser.add_argument('--backfill-stats', action='store_true', help="Only record missing file sizes/mtimes for the time range")
+    parser.add_argument('--insert-mode', choices=insert_modes, default='executemany',
+                        help="How rows are sent: executemany (default), values (max_allowed_packet sized statements) or loaddata (LOAD DATA LOCAL INFILE)")
+    parser.add_argument('--commit-every', type=int, default=None, help="Rows per transaction (default: one per statement)")
+    parser.add_argument('--watch', action='store_true', help="Keep running and insert new files as they land")
+    parser.add_argument('--watch-mode', choices=['auto', 'inotify', 'poll'], default='auto',
+                        help="auto: inotify if inotify_simple is installed and the data is on a local filesystem, else polling")
+    parser.add_argument('--batch-seconds', type=float, default=5., help="Watch mode: max time a new file waits before insertion")
+    parser.add_argument('--poll-seconds', type=float, default=10., help="Watch mode: directory check interval when polling")
+    parser.add_argument('--workers', type=int, default=8, help="Threads scanning the data directories, processes reading FITS headers")
     args = parser.parse_args()
 
+    if args.watch:
+        watch_lwa_files(mode=args.watch_mode, batch_seconds=args.batch_seconds, poll_seconds=args.poll_seconds,
+                        insert_mode=args.insert_mode, workers=args.workers)
+        return
+    if args.since_last:
+        file_types = ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
+        start = since_last_start(load_ingest_state(), file_types, lookback_hours=args.lookback_hours) or args.start
+        if not start:
+            parser.error("--since-last needs --start until every product has been ingested once")
+        end = args.end or datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        ingest_lwa_files([start, end], file_types, workers=args.workers, full_scan=args.full_scan,
+                         insert_mode=args.insert_mode, commit_every=args.commit_every)
+        return
+    if not args.start or not args.end:
+        parser.error("--start and --end are required")
     timerange = [args.start, args.end]
 
-    if args.delete:
+    if args.rebuild_segments:
+        rebuild_availability_segments(timerange)
+    elif args.backfill_stats:
+        backfill_file_stats(timerange)
+    elif args.delete:
         delete_files_from_mysql(timerange)
     else:
-        file_types = ["spec", "mfs_lev1", "mfs_lev15", "fch_lev1", "fch_lev15"]
-        for file_type in file_types:
-            # Get files list
-            files = get_path_lwa_files(timerange, file_type=file_type)
-            print(f"{file_type}: {len(files)} found")
-            # Insert to MySQL
-            insert_file_list_to_mysql(files, file_type)
-            print(f"Success for {file_type}!")
-
+        ingest_lwa_files(timerange, workers=args.workers, full_scan=args.full_scan,
+                         insert_mode=args.insert_mode, commit_every=args.commit_every)
 
 if __name__ == '__main__':
     main()
@@ -345,6 +1078,35 @@ History:
 
 
 
+# ##=========================
+'''In MySQL : file sizes and mtimes recorded at ingest (NULL for older rows until --backfill-stats)
+
+ALTER TABLE lwa_spec_fits_files ADD COLUMN file_size BIGINT NULL, ADD COLUMN file_mtime_ns BIGINT NULL;
+ALTER TABLE lwa_slow_mfs_lev1_hdf_files ADD COLUMN file_size BIGINT NULL, ADD COLUMN file_mtime_ns BIGINT NULL;
+ALTER TABLE lwa_slow_mfs_lev15_hdf_files ADD COLUMN file_size BIGINT NULL, ADD COLUMN file_mtime_ns BIGINT NULL;
+ALTER TABLE lwa_slow_fch_lev1_hdf_files ADD COLUMN file_size BIGINT NULL, ADD COLUMN file_mtime_ns BIGINT NULL;
+ALTER TABLE lwa_slow_fch_lev15_hdf_files ADD COLUMN file_size BIGINT NULL, ADD COLUMN file_mtime_ns BIGINT NULL;
+
+'''
+
+
+# ##=========================
+'''In MySQL : availability segments, maintained by update_availability_segments()
+product is one of mfs_lev1, mfs_lev15, fch_lev1, fch_lev15.
+Initial fill: python lwadata2sql.py --start 2024-01-01T00:00:00 --end 2026-01-01T00:00:00 --rebuild-segments
+
+CREATE TABLE lwa_availability_segments (
+    product VARCHAR(16) NOT NULL,
+    seg_start DATETIME NOT NULL,
+    seg_end DATETIME NOT NULL,
+    n_files INT NOT NULL,
+    PRIMARY KEY (product, seg_start),
+    INDEX idx_product_end (product, seg_end)
+);
+
+'''
+
+
 # ##=========================
 '''In MySQL : version - June-18
 
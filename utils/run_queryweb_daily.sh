@@ -15,4 +15,5 @@ end_datetime=$(date -d "today" +%Y-%m-%dT03:00:00)
 
 # Run the commands
 # python "$sh_path/lwa-query-web_utils.py" --gen movie --start "$start_date" --end "$end_date"
-python "$sh_path/lwadata2sql.py" --start "$start_datetime" --end "$end_datetime"
+# Only new files since the last run; --start is used until every product has been ingested once
+python "$sh_path/lwadata2sql.py" --since-last --start "$start_datetime"